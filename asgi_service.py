@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Asyncio (ASGI) variant of the message logger service
+
+Serves the same endpoints with the same JSON as
+message_logger_service.py, so the extension works against either.
+/health, /ready and /messages run on threads of their own, since /health
+queries the disk cache, and stay responsive while compressions queue up.
+Compressions run on a bounded pool of threads; they mostly wait on the
+model worker processes, so threads rather than processes keep the result
+cache, score cache and batcher shared. When a client disconnects before
+its result is ready, the request's deadline is cancelled: its queued
+model windows are dropped and no response is sent. A disconnect during
+/compress/batch or /compress/stream stops the work not started.
+
+Run with: uvicorn asgi_service:app --port 8002
+or, pre-forked: python3 serve.py asgi --workers 4
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import message_logger_service as service
+from batch_compression import array_items, ndjson_items
+from deadline import RequestCancelled, deadline_for_request
+from stream_compression import stream_events, with_error_event
+
+# Compressions running at once per process; the rest wait for a thread
+COMPRESS_THREADS = int(os.environ.get('SEQUOIA_ASGI_THREADS', 8))
+
+logger = logging.getLogger(__name__)
+
+_compressions = ThreadPoolExecutor(max_workers=COMPRESS_THREADS, thread_name_prefix='compress')
+
+# POST endpoints: handler(data, headers, deadline) -> (body, status, headers)
+COMPRESSIONS = {
+    '/log-message': service.log_message_response,
+    '/compress': service.compress_response,
+}
+# GET endpoints, run on the loop's default threads rather than the compression threads
+REPORTS = {
+    '/health': lambda: (dict(service.health_report(), asgi=stats()), 200, {}),
+    '/ready': service.readiness_response,
+    '/messages': lambda: (service.messages_report(), 200, {}),
+    '/': lambda: (service.SERVICE_INFO, 200, {}),
+}
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+# Shared with the pre-fork server, which loads the model before forking
+preload = service.preload
+post_fork = service.post_fork
+
+counters = {'requests': 0, 'in_flight': 0, 'cancelled': 0}
+# Queued in place of the rest of a streamed body whose client went away
+DISCONNECTED = object()
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection before its response was ready"""
+
+
+class Headers(dict):
+    """Request headers, looked up case-insensitively like Flask's"""
+
+    def __init__(self, raw):
+        super().__init__((name.decode('latin-1').lower(), value.decode('latin-1')) for name, value in raw)
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+
+def stats():
+    return dict(counters, threads=COMPRESS_THREADS)
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def parse_json(body):
+    """Request body as JSON, or None when it is not valid JSON (like Flask's get_json(silent=True))"""
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def run_compression(handler, data, headers, receive):
+    """
+    Run handler on the compression threads until it finishes or the client disconnects
+    Raises ClientDisconnected, after cancelling the request's deadline
+    """
+    url = data.get('url') if isinstance(data, dict) else None
+    # Started now, so time spent waiting for a thread counts against the budget
+    deadline = deadline_for_request(headers, url)
+    work = asyncio.get_running_loop().run_in_executor(_compressions, handler, data, headers, deadline)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait((work, disconnect), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        deadline.cancel()
+        work.cancel()
+        raise
+    finally:
+        disconnect.cancel()
+    if work.done():
+        return work.result()
+    # Drops the call while it waits for a thread, and the model work it queued
+    deadline.cancel()
+    work.cancel()
+    raise ClientDisconnected()
+
+
+async def send_json(send, body, status=200, headers=None):
+    payload = json.dumps(body).encode()
+    raw_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    raw_headers += CORS_HEADERS
+    raw_headers += [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                    for name, value in (headers or {}).items()]
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def send_preflight(send, headers):
+    """CORS preflight answer, allowing any origin like flask_cors does"""
+    raw_headers = CORS_HEADERS + [
+        (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+        (b'access-control-allow-headers', headers.get('Access-Control-Request-Headers', '').encode('latin-1')),
+        (b'content-length', b'0'),
+    ]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def body_reader(receive):
+    """
+    The request body as a blocking iterator of chunks, for a thread, and
+    the coroutine function feeding it from receive; chunks are handed over
+    one at a time, and once the client disconnects the iterator raises
+    RequestCancelled instead of ending as if the body were complete
+    """
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(maxsize=1)
+
+    async def read_chunks():
+        """Queue body chunks then None; returns once the client disconnects"""
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                # Not the end of the body: the text read so far must not be finished
+                while not chunks.empty():
+                    chunks.get_nowait()
+                chunks.put_nowait(DISCONNECTED)
+                return
+            await chunks.put(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        await chunks.put(None)
+        await wait_for_disconnect(receive)
+
+    def body():
+        while (data := asyncio.run_coroutine_threadsafe(chunks.get(), loop).result()) is not None:
+            if data is DISCONNECTED:
+                raise RequestCancelled('The client disconnected')
+            yield data
+
+    return body(), read_chunks
+
+
+def body_lines(chunks):
+    """Lines of a chunked body, without their line breaks"""
+    pending = []
+    for data in chunks:
+        *lines, last = data.split(b'\n')
+        if lines:
+            lines[0] = b''.join(pending) + lines[0]
+            pending = []
+            yield from lines
+        pending.append(last)
+    rest = b''.join(pending)
+    if rest:
+        yield rest
+
+
+async def compress_batch(scope, headers, receive, send):
+    """POST /compress/batch: NDJSON lines sent as the batch's items finish"""
+    if headers.get('Content-Type', '').split(';')[0].strip() == 'application/json':
+        data = parse_json(await read_body(receive))
+        if not isinstance(data, list):
+            return await send_json(send, {'error': 'Expected a JSON array of items, or NDJSON'}, 400)
+        items = array_items(data)
+        read_chunks = functools.partial(wait_for_disconnect, receive)
+    else:
+        # Items start while the rest of the body is still being uploaded
+        chunks, read_chunks = body_reader(receive)
+        items = ndjson_items(body_lines(chunks))
+    run, error = service.batch_run(items, dict(parse_qsl(scope.get('query_string', b'').decode())), headers)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+
+    disconnect = asyncio.ensure_future(read_chunks())
+    await send_lines(send, run, disconnect, b'application/x-ndjson', run.cancel)
+
+
+async def compress_stream(scope, headers, receive, send):
+    """POST /compress/stream: compressed segments sent as the chunked body is read"""
+    chunks, read_chunks = body_reader(receive)
+    args = dict(parse_qsl(scope.get('query_string', b'').decode()))
+    run, sse, error = service.stream_run(chunks, args, headers)
+    if error:
+        return await send_json(send, {'error': error}, 400)
+
+    disconnect = asyncio.ensure_future(read_chunks())
+    await send_lines(send, stream_events(run, sse), disconnect,
+                     b'text/event-stream' if sse else b'application/x-ndjson', run.cancel)
+
+
+async def send_lines(send, lines, disconnect, content_type, cancel=None):
+    """
+    Stream the lines of a blocking iterable, produced on a thread, until
+    it ends or the disconnect task completes; an exception raised by the
+    iterable is sent as a last error line
+    Raises ClientDisconnected, after calling cancel and closing the iterable
+    """
+    loop = asyncio.get_running_loop()
+    # A few lines ahead of the client at most, so a slow reader bounds memory
+    queue = asyncio.Queue(maxsize=4)
+    stopped = threading.Event()
+
+    def pump():
+        # Past the 200, a failure can only be reported as the last line
+        iterator = with_error_event(lines, content_type == b'text/event-stream')
+        try:
+            for line in iterator:
+                if stopped.is_set():
+                    break
+                asyncio.run_coroutine_threadsafe(queue.put(line), loop).result()
+        finally:
+            # Runs the iterable's own clean-up, e.g. dropping work not started
+            iterator.close()
+            if not stopped.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+    threading.Thread(target=pump, name='line-pump', daemon=True).start()
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', content_type)] + CORS_HEADERS})
+    try:
+        while True:
+            line = asyncio.ensure_future(queue.get())
+            await asyncio.wait((line, disconnect), return_when=asyncio.FIRST_COMPLETED)
+            if not line.done():
+                line.cancel()
+                raise ClientDisconnected()
+            if line.result() is None:
+                break
+            await send({'type': 'http.response.body', 'body': line.result().encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    except (ClientDisconnected, asyncio.CancelledError):
+        stopped.set()
+        if cancel is not None:
+            cancel()
+        # Unblocks the pump if it is waiting to queue a line
+        while not queue.empty():
+            queue.get_nowait()
+        raise
+    finally:
+        disconnect.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _compressions.shutdown(wait=False, cancel_futures=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+# Stream NDJSON lines (or server-sent events) as their parts finish
+STREAMS = {
+    '/compress/batch': compress_batch,
+    '/compress/stream': compress_stream,
+}
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    path, method = scope['path'], scope['method']
+    headers = Headers(scope['headers'])
+    if method == 'OPTIONS':
+        return await send_preflight(send, headers)
+    if method == 'GET' and path in REPORTS:
+        report = await asyncio.get_running_loop().run_in_executor(None, REPORTS[path])
+        return await send_json(send, *report)
+    if path in STREAMS and method == 'POST':
+        return await count_request(path, STREAMS[path](scope, headers, receive, send))
+    if path not in COMPRESSIONS:
+        status = 405 if path in REPORTS or path in STREAMS else 404
+        return await send_json(send, {'error': 'Method not allowed' if status == 405 else 'Not found'}, status)
+    if method != 'POST':
+        return await send_json(send, {'error': 'Method not allowed'}, 405)
+
+    await count_request(path, compress(COMPRESSIONS[path], headers, receive, send))
+
+
+async def compress(handler, headers, receive, send):
+    data = parse_json(await read_body(receive))
+    await send_json(send, *await run_compression(handler, data, headers, receive))
+
+
+async def count_request(path, request):
+    """Await a compression request, counting it and whether its client went away"""
+    counters['requests'] += 1
+    counters['in_flight'] += 1
+    try:
+        await request
+    except ClientDisconnected:
+        counters['cancelled'] += 1
+        logger.info(f"Client disconnected, {path} request cancelled")
+    finally:
+        counters['in_flight'] -= 1
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        print("❌ uvicorn is not installed")
+        print("Install with: pip3 install uvicorn")
+        sys.exit(1)
+    logger.info('🚀 Starting ChatGPT Message Logger Service (ASGI)...')
+    uvicorn.run(app, host='0.0.0.0', port=8002)
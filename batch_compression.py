@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Batch compression with streamed results
+
+POST /compress/batch takes a JSON array or an NDJSON stream of
+{id, text, ratio} items and answers with one NDJSON line per item as soon
+as that item is done, so results may come back out of order; each line
+carries the item's id and its index in the input. At most `concurrency`
+items of a batch are compressed at once, on threads shared by all batches,
+and their model calls are batched with everyone else's. Items are taken
+from the input in chunks whose texts are token-counted together in one
+call, filling the token count cache for the items' own counts.
+
+An item that is malformed or fails only produces an error line for
+itself. When the client goes away, items not started are dropped and the
+deadlines of running ones are cancelled.
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ThreadPoolExecutor
+from concurrent.futures import wait as wait_for_futures
+
+from deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+# Most items of one batch compressed at once; requests may ask for fewer
+MAX_CONCURRENCY = int(os.environ.get('SEQUOIA_BATCH_CONCURRENCY', 8))
+# Threads shared by all batches of this process
+BATCH_THREADS = int(os.environ.get('SEQUOIA_BATCH_THREADS', MAX_CONCURRENCY))
+
+_batch_items = ThreadPoolExecutor(max_workers=BATCH_THREADS, thread_name_prefix='batch-item')
+
+
+class BatchItemError(ValueError):
+    """A batch item is malformed; reported on its own line"""
+
+
+def ndjson_items(lines):
+    """(index, item) for each non-blank NDJSON line; a line that is not JSON becomes a BatchItemError"""
+    index = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            item = BatchItemError(f'item {index} is not valid JSON: {e}')
+        yield index, item
+        index += 1
+
+
+def array_items(items):
+    """(index, item) for each item of a JSON array"""
+    return enumerate(items)
+
+
+def item_text(item):
+    """The text of a batch item, raising BatchItemError when the item is malformed"""
+    if isinstance(item, BatchItemError):
+        raise item
+    if not isinstance(item, dict):
+        raise BatchItemError('item must be a JSON object')
+    if not isinstance(item.get('text'), str):
+        raise BatchItemError('item has no text')
+    return item['text']
+
+
+def is_well_formed(item):
+    try:
+        item_text(item)
+        return True
+    except BatchItemError:
+        return False
+
+
+def item_line(index, item, fields):
+    """One NDJSON output line, with the item's id and input index"""
+    item_id = item.get('id') if isinstance(item, dict) else None
+    return json.dumps(dict(fields, id=item_id, index=index)) + '\n'
+
+
+class BatchRun:
+    """
+    One batch's items, compressed concurrently; iterating yields an NDJSON
+    line for each item as soon as it is done
+    """
+
+    def __init__(self, items, compress_item, prepare=None, concurrency=MAX_CONCURRENCY, budget_ms=None):
+        """
+        Args:
+            items: (index, item) pairs, from ndjson_items() or array_items()
+            compress_item: compress_item(item, deadline) returns the result
+                dict of one item; its exceptions become that item's error line
+            prepare: optional, called with each chunk of well-formed items
+                before they start, e.g. to token-count their texts together
+            concurrency: most items compressed at once, up to MAX_CONCURRENCY
+            budget_ms: latency budget of each item, None for no limit
+        """
+        self.items = iter(items)
+        self.compress_item = compress_item
+        self.prepare = prepare
+        self.concurrency = max(1, min(concurrency, MAX_CONCURRENCY))
+        self.budget_ms = budget_ms
+        self.completed = 0
+        self._running = {}
+        self._lock = threading.Lock()
+        # Completed by cancel(), waking the wait for running items
+        self._cancelled = Future()
+
+    def __iter__(self):
+        exhausted = False
+        try:
+            while not self._cancelled.done():
+                chunk = []
+                while not exhausted and len(self._running) + len(chunk) < self.concurrency:
+                    try:
+                        chunk.append(next(self.items))
+                    except StopIteration:
+                        exhausted = True
+                well_formed = [item for _, item in chunk if is_well_formed(item)]
+                if self.prepare is not None and well_formed:
+                    self.prepare(well_formed)
+                with self._lock:
+                    for index, item in chunk:
+                        deadline = Deadline(self.budget_ms)
+                        future = _batch_items.submit(run_item, self.compress_item, item, deadline)
+                        self._running[future] = (index, item, deadline)
+                    if not self._running:
+                        return
+                    running = list(self._running)
+
+                done, _ = wait_for_futures(running + [self._cancelled], return_when=FIRST_COMPLETED)
+                if self._cancelled.done():
+                    return
+                for future in done:
+                    with self._lock:
+                        index, item, _ = self._running.pop(future)
+                    self.completed += 1
+                    yield item_line(index, item, future.result())
+        finally:
+            # Closed early when the client went away
+            self.cancel()
+
+    def cancel(self):
+        """Drop the items not started and give up on the running ones; safe from any thread"""
+        try:
+            self._cancelled.set_result(True)
+        except InvalidStateError:
+            pass
+        with self._lock:
+            for future, (_, _, deadline) in self._running.items():
+                future.cancel()
+                deadline.cancel()
+
+
+def run_item(compress_item, item, deadline):
+    """Result fields of one item, or its error"""
+    try:
+        item_text(item)
+        return compress_item(item, deadline)
+    except BatchItemError as e:
+        return {'error': str(e)}
+    except Exception as e:
+        logger.error(f"Batch item failed: {e}")
+        return {'error': f'{type(e).__name__}: {e}'}
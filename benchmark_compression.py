@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the compression hot paths
+
+Run with: python3 benchmark_compression.py
+"""
+
+import os
+import re
+import time
+
+import improved_compression_service as service
+from rule_packs import RULES_DIR, read_pack_file
+
+SAMPLE_PARAGRAPH = (
+    "Basically, I would like to learn more about machine learning and it is very important "
+    "that I do not miss anything. Could you please explain how neural networks work? "
+    "Honestly, the user interface of most tools is clearly very confusing.\n\n"
+)
+
+SPARSE_PARAGRAPH = (
+    "The quarterly report covers revenue, churn and hiring across all regions. "
+    "Each section lists the figures first and the commentary second, followed by "
+    "a short summary of open questions for the next planning cycle. "
+)
+
+SIZES = [10 * 1024, 100 * 1024, 1024 * 1024]
+
+
+def legacy_rule_based_compress(text, pack):
+    """The original replace-per-rule implementation, kept as a baseline"""
+    compressed = text
+    for group in pack['rules']:
+        for phrase, replacement in group['phrases'].items():
+            compressed = compressed.replace(phrase, replacement)
+            if group['match_capitalized']:
+                compressed = compressed.replace(phrase.capitalize(), replacement.capitalize())
+    for filler in pack['deletions']:
+        pattern = r'\b' + re.escape(filler) + r'\b'
+        compressed = re.sub(pattern, '', compressed, flags=re.IGNORECASE)
+    compressed = ' '.join(compressed.split())
+    return compressed.strip()
+
+
+def make_text(size):
+    """Repeat the sample paragraph up to roughly size bytes"""
+    repeats = size // len(SAMPLE_PARAGRAPH) + 1
+    return (SAMPLE_PARAGRAPH * repeats)[:size]
+
+
+def time_call(func, text, repeat=3):
+    """Best wall-clock time of func(text) over a few runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_rule_based():
+    """Compare the legacy rule loop against the compiled matcher, output and time"""
+    print("\n📏 rule_based_compress: legacy vs compiled matcher")
+    print("-" * 60)
+    print(f"{'size':>10} {'legacy ms':>12} {'compiled ms':>12} {'speedup':>10} {'same output':>12}")
+    pack = read_pack_file(os.path.join(RULES_DIR, 'en.json'))[1]
+    for size in SIZES:
+        text = make_text(size)
+        same = legacy_rule_based_compress(text, pack) == service.compressor.rule_based_compress(text)
+        legacy = time_call(lambda t: legacy_rule_based_compress(t, pack), text)
+        compiled = time_call(service.compressor.rule_based_compress, text)
+        print(f"{size // 1024:>8}KB {legacy * 1000:>12.2f} {compiled * 1000:>12.2f} {legacy / compiled:>9.1f}x "
+              f"{'yes' if same else 'NO':>12}")
+
+
+def benchmark_token_accounting():
+    """Compare re-encoding the whole rule result against counting only the edits"""
+    print("\n🪙 Rule result token count: full re-encode vs incremental")
+    print("-" * 60)
+    print(f"{'input':>16} {'full ms':>10} {'incremental ms':>15} {'speedup':>10}")
+    compressor = service.compressor
+    # Pasted documents usually trigger only a handful of rules
+    sparse = SPARSE_PARAGRAPH * 20 + SAMPLE_PARAGRAPH
+    inputs = [(f"dense {size // 1024}KB", make_text(size)) for size in SIZES]
+    inputs += [(f"sparse {size // 1024}KB", (sparse * (size // len(sparse) + 1))[:size]) for size in SIZES]
+    for label, text in inputs:
+        original_tokens = compressor.count_tokens(text)
+        compressed, edits = compressor.rule_based_rewrite(text)
+        full = time_call(compressor.count_tokens, compressed)
+        incremental = time_call(
+            lambda t: compressor.count_tokens_after_edits(t, original_tokens, edits, compressed), text
+        )
+        print(f"{label:>16} {full * 1000:>10.2f} {incremental * 1000:>15.2f} {full / incremental:>9.1f}x")
+
+
+def benchmark_segment_edits():
+    """Time resending a long prompt after editing one sentence"""
+    print("\n✏️ smart_compress after a one-sentence edit: first send vs resend")
+    print("-" * 60)
+    print(f"{'input':>16} {'first ms':>10} {'resend ms':>10} {'speedup':>10}")
+    compressor = service.compressor
+    for size in [20 * 1024] + SIZES[1:]:
+        # Number the paragraphs so every sentence is distinct
+        paragraphs = []
+        while sum(map(len, paragraphs)) < size:
+            paragraphs.append(f"Part {len(paragraphs)}. " + SAMPLE_PARAGRAPH)
+        text = ''.join(paragraphs)
+        middle = len(paragraphs) // 2
+        paragraphs[middle] = paragraphs[middle].replace("neural networks", "decision trees")
+        edited = ''.join(paragraphs)
+
+        compressor.segment_cache = service.SegmentCache()
+        start = time.perf_counter()
+        compressor.smart_compress(text)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        compressor.smart_compress(edited)
+        resend = time.perf_counter() - start
+        print(f"{size // 1024:>14}KB {first * 1000:>10.2f} {resend * 1000:>10.2f} {first / resend:>9.1f}x")
+
+
+if __name__ == "__main__":
+    print("🏁 Compression microbenchmarks")
+    print("=" * 60)
+    benchmark_rule_based()
+    benchmark_token_accounting()
+    benchmark_segment_edits()
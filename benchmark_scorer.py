@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Selective Context scorer runtimes against fp32
+
+Each runtime is loaded in its own process so its resident memory can be
+measured separately. Reports load time, RSS, latency for one prompt and
+for a batch of eight, and parity with fp32: the mean absolute difference
+in token self-information and the share of prompts compressed to exactly
+the same text.
+
+Run with: python3 benchmark_scorer.py [runtime ...]
+ONNX runtimes need python3 export_scorer.py first.
+
+python3 benchmark_scorer.py windowed instead times a 50 KB prompt
+compressed in parallel windows with 1, 2, 4, ... model workers.
+"""
+
+import functools
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+from micro_batcher import MicroBatcher
+from model_pool import ModelPool
+from selective_context import MODEL_NAME, RUNTIME, RUNTIMES, SelectiveContext
+from windowed_compression import WindowedCompressor
+
+PROMPTS = [
+    "Could you please explain how neural networks learn from examples, and why they need so much data?",
+    "I am planning a trip to Japan in April. What should I pack, and which cities should I visit first?",
+    "Write a short function that checks whether a string is a palindrome, ignoring case and punctuation.",
+    "Summarize the main causes of the French Revolution in a few sentences for a high school student.",
+    "What is the difference between a process and a thread, and when should I use each of them?",
+    "My sourdough bread comes out dense every time. I feed the starter daily. What am I doing wrong?",
+    "Give me three ideas for a birthday party for a seven year old who loves dinosaurs and space.",
+    "Explain the trade-offs between SQL and NoSQL databases for a small e-commerce startup.",
+]
+RATIO = 0.3
+REPEAT = 5
+
+
+def resident_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # Peak rather than current RSS where /proc is missing; kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def median_ms(function, repeat=REPEAT):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def measure(runtime, model_name, results):
+    """Load one runtime and time it; runs in a child process"""
+    try:
+        from selective_context import SelectiveContext
+        before = resident_mb()
+        start = time.perf_counter()
+        scorer = SelectiveContext(model_name, runtime=runtime)
+        load_seconds = time.perf_counter() - start
+        scorer.compressgo(PROMPTS[0], RATIO)
+        results.put({
+            'runtime': runtime,
+            'load_s': load_seconds,
+            'rss_mb': resident_mb() - before,
+            'single_ms': median_ms(lambda: scorer.compressgo(PROMPTS[0], RATIO)),
+            'batch_ms': median_ms(lambda: scorer.compress_batch(PROMPTS, [RATIO] * len(PROMPTS))),
+            'self_info': [info for _, info in scorer.self_info_batch(PROMPTS)],
+            'compressed': scorer.compress_batch(PROMPTS, [RATIO] * len(PROMPTS)),
+        })
+    except Exception as e:
+        results.put({'runtime': runtime, 'error': f"{type(e).__name__}: {e}"})
+
+
+def run(runtime, model_name):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=measure, args=(runtime, model_name, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def benchmark_windowed(size=50 * 1024):
+    """Time windowed compression of a long prompt as workers are added"""
+    text = (' '.join(PROMPTS) + '\n\n') * (size // len(' '.join(PROMPTS)) + 1)
+    text = text[:size]
+    cores = os.cpu_count() or 1
+    counts = sorted({2 ** power for power in range(cores.bit_length()) if 2 ** power <= cores} | {cores})
+    print(f"🪟 Windowed compression of a {size // 1024} KB prompt ({MODEL_NAME}, {RUNTIME})")
+    print("=" * 60)
+    print(f"{'workers':>8} {'threads':>8} {'seconds':>10} {'speedup':>10}")
+    baseline = None
+    for workers in counts:
+        pool = ModelPool(functools.partial(SelectiveContext, MODEL_NAME, 'cpu'), workers=workers,
+                         threads_per_worker=max(1, cores // workers), timeout=600)
+        try:
+            stats = pool.stats()
+            while stats['ready'] < workers:
+                if stats['start_errors']:
+                    print(f"⚠ workers failed to start: {stats['last_start_error']}")
+                    return
+                time.sleep(0.5)
+                stats = pool.stats()
+            batcher = MicroBatcher(lambda texts: pool.call('self_info_batch', texts), concurrency=workers)
+            # No score cache, so every repeat scores every window
+            windowed = WindowedCompressor(batcher.submit)
+            windowed.compress(text[:4096], RATIO)
+            seconds = median_ms(lambda: windowed.compress(text, RATIO), repeat=3) / 1000
+            batcher.close()
+        finally:
+            pool.close()
+        baseline = baseline or seconds
+        print(f"{workers:>8} {pool.threads:>8} {seconds:>10.2f} {baseline / seconds:>9.1f}x")
+
+
+def main():
+    if sys.argv[1:] == ['windowed']:
+        benchmark_windowed()
+        return
+    runtimes = sys.argv[1:] or list(RUNTIMES)
+    if 'fp32' not in runtimes:
+        runtimes.insert(0, 'fp32')
+    print(f"🏁 Selective Context scorer runtimes ({MODEL_NAME})")
+    print("=" * 86)
+    print(f"{'runtime':>10} {'load s':>8} {'RSS MB':>8} {'1 prompt ms':>12} {'8 prompts ms':>13} "
+          f"{'Δ self-info':>12} {'same output':>12}")
+
+    baseline = None
+    for runtime in runtimes:
+        result = run(runtime, MODEL_NAME)
+        if 'error' in result:
+            print(f"{runtime:>10}   ⚠ skipped: {result['error']}")
+            continue
+        if baseline is None:
+            baseline = result
+        differences = [
+            abs(a - b)
+            for tokens, base_tokens in zip(result['self_info'], baseline['self_info'])
+            for a, b in zip(tokens, base_tokens)
+        ]
+        same = sum(a == b for a, b in zip(result['compressed'], baseline['compressed'])) / len(PROMPTS)
+        print(f"{runtime:>10} {result['load_s']:>8.2f} {result['rss_mb']:>8.0f} {result['single_ms']:>12.1f} "
+              f"{result['batch_ms']:>13.1f} {statistics.mean(differences):>12.4f} {same:>11.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Compare the compression tiers: rules, statistical scorer and Selective Context
+
+For each tier, reports latency per prompt, the share of tokens removed,
+key-term recall (numbers, names and long words still present after
+compression) and, when Selective Context can run here, word-level
+agreement with its output at the same ratio.
+
+Run with: python3 benchmark_tiers.py [--table PATH] [--ratio 0.3]
+The statistical tier needs a table from build_stat_table.py first.
+"""
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+
+import improved_compression_service as service
+import tokenizer_registry
+from benchmark_scorer import PROMPTS
+from selective_context import MODEL_NAME
+from statistical_scorer import TABLE_PATH, StatisticalScorer
+
+DOCUMENT = (
+    "In March 2023 the Lisbon office migrated 4,200 customer accounts to the new billing platform. "
+    "The migration was planned by Ana Ferreira and took eleven weeks instead of the expected six, "
+    "mostly because the legacy exports contained duplicated invoices. Basically, the team had to "
+    "reconcile every duplicate by hand before the cutover, which was honestly very tedious. "
+    "Could you please summarize the main lessons for the Madrid office, which starts its own "
+    "migration of roughly 9,000 accounts next quarter?"
+)
+KEY_TERM = re.compile(r'\b(?:\d[\d,.]*|[A-Z][a-z]+(?:\s[A-Z][a-z]+)*|\w{8,})\b')
+WORD = re.compile(r'\w+')
+REPEAT = 20
+
+
+def median_ms(function, text):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(text)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def key_term_recall(original, compressed):
+    """Share of the original's numbers, names and long words that survive compression"""
+    terms = set(KEY_TERM.findall(original))
+    kept = set(WORD.findall(compressed))
+    return sum(all(word in kept for word in WORD.findall(term)) for term in terms) / len(terms) if terms else 1.0
+
+
+def word_agreement(compressed, reference):
+    """F1 of the words kept by two compressions of the same text"""
+    words, reference_words = set(WORD.findall(compressed.lower())), set(WORD.findall(reference.lower()))
+    if not words or not reference_words:
+        return 0.0
+    overlap = len(words & reference_words)
+    precision, recall = overlap / len(words), overlap / len(reference_words)
+    return 2 * precision * recall / (precision + recall) if overlap else 0.0
+
+
+def load_selective_context():
+    try:
+        from selective_context import SelectiveContext
+        return SelectiveContext(MODEL_NAME)
+    except Exception as e:
+        print(f"⚠ Selective Context skipped: {type(e).__name__}: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--table', default=TABLE_PATH, help='table from build_stat_table.py')
+    parser.add_argument('--ratio', type=float, default=0.3, help='share removed by the ratio-based tiers')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.table):
+        print(f"❌ No table at {args.table}; build one with python3 build_stat_table.py corpus.txt")
+        return 1
+    statistical = StatisticalScorer(args.table)
+    model = load_selective_context()
+    tiers = {
+        'rules': lambda text: service.compressor.rule_based_compress(text),
+        'statistical': lambda text: statistical.compress(text, args.ratio),
+    }
+    if model is not None:
+        tiers['selective'] = lambda text: model.compressgo(text, args.ratio)
+
+    prompts = PROMPTS + [DOCUMENT, DOCUMENT * 8]
+    counter = tokenizer_registry.counter_for_url(None)
+    references = [tiers['selective'](text) for text in prompts] if model is not None else None
+    print(f"🏁 Compression tiers at ratio {args.ratio} over {len(prompts)} prompts ({os.path.basename(args.table)})")
+    print("=" * 76)
+    print(f"{'tier':>12} {'median ms':>10} {'long ms':>9} {'tokens cut':>11} {'key terms':>10} {'agreement':>10}")
+    for name, compress in tiers.items():
+        compressed = [compress(text) for text in prompts]
+        originals = counter.count_batch(prompts)
+        remaining = counter.count_batch(compressed)
+        cut = 1 - sum(remaining) / sum(originals)
+        recall = statistics.mean(key_term_recall(text, result) for text, result in zip(prompts, compressed))
+        agreement = (
+            f"{statistics.mean(word_agreement(a, b) for a, b in zip(compressed, references)):>10.2f}"
+            if references else f"{'-':>10}"
+        )
+        latency = statistics.median(median_ms(compress, text) for text in prompts[:-1])
+        print(f"{name:>12} {latency:>10.3f} {median_ms(compress, prompts[-1]):>9.3f} {cut:>10.0%} "
+              f"{recall:>10.0%} {agreement}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Token-budget fallback compression
+
+The tier used when no model can answer. The prompt is split once into
+words, each with the whitespace before it. Every word gets a small integer
+importance from set lookups: filler and function words score lowest, and
+numbers, names, long and first-seen words score higher. Words are then
+taken from the most important bucket down until the token budget is
+spent, and kept in their original order. Token counts come from counting
+each distinct word once, so the whole pass is linear in the prompt, and
+the joined result is counted exactly once more to make sure it fits.
+"""
+
+import re
+
+# Function and filler words, dropped first
+COMMON_WORDS = frozenset([
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
+    'from', 'about', 'into', 'through', 'during', 'before', 'after', 'above', 'below',
+    'up', 'down', 'out', 'off', 'over', 'under', 'again', 'further', 'then', 'once',
+    'very', 'really', 'quite', 'rather', 'pretty', 'much', 'many', 'more', 'most',
+    'please', 'could', 'would', 'should', 'might', 'can', 'will',
+    'is', 'are', 'was', 'were', 'be', 'been', 'being', 'am', 'do', 'does', 'did',
+    'that', 'this', 'these', 'those', 'it', 'its', 'so', 'just', 'also', 'some', 'any',
+    'basically', 'actually', 'literally', 'honestly', 'simply', 'kind', 'sort',
+])
+WORD = re.compile(r'\s*\S+|\s+$')
+PUNCTUATION = '.,!?;:"\'()[]{}'
+SENTENCE_END = ('.', '!', '?', ':')
+LONG_WORD = 7
+# Importance buckets run from 0 (common word) to TOP
+TOP = 5
+
+
+def split_words(text):
+    """Words of text, each with the whitespace before it; they join back to text"""
+    return WORD.findall(text)
+
+
+def word_importance(words):
+    """Importance bucket of every word, 0 to TOP, in one pass"""
+    buckets = []
+    seen = set()
+    sentence_start = True
+    for word in words:
+        core = word.strip().strip(PUNCTUATION)
+        lower = core.lower()
+        if not core:
+            # Bare punctuation and trailing whitespace
+            bucket = 1
+        elif lower in COMMON_WORDS:
+            bucket = 0
+        else:
+            bucket = 2
+            if any(character.isdigit() for character in core):
+                bucket += 1
+            elif core[0].isupper() and not sentence_start:
+                bucket += 1
+            if len(core) >= LONG_WORD:
+                bucket += 1
+            if lower not in seen:
+                bucket += 1
+            seen.add(lower)
+        buckets.append(min(bucket, TOP))
+        sentence_start = word.rstrip().endswith(SENTENCE_END)
+    return buckets
+
+
+def token_budget(original_tokens, ratio):
+    """Tokens left after removing the ratio share of original_tokens"""
+    return max(0, round(original_tokens * (1 - min(max(ratio, 0.0), 1.0))))
+
+
+def compress_to_budget(text, budget, count_batch):
+    """
+    Keep the most important words of text that fit in budget tokens
+
+    Args:
+        count_batch: returns the token counts of a list of texts
+    Returns:
+        (compressed text, its token count)
+    """
+    words = split_words(text)
+    distinct = list(dict.fromkeys(words))
+    tokens = dict(zip(distinct, count_batch(distinct)))
+    if sum(tokens[word] for word in words) <= budget:
+        (total,) = count_batch([text])
+        if total <= budget:
+            return text, total
+
+    # Bucket sort: word positions by importance, in text order within a bucket
+    buckets = word_importance(words)
+    by_bucket = [[] for _ in range(TOP + 1)]
+    for position, bucket in enumerate(buckets):
+        by_bucket[bucket].append(position)
+
+    kept = [False] * len(words)
+    chosen = []
+    remaining = budget
+    for positions in reversed(by_bucket):
+        for position in positions:
+            cost = tokens[words[position]]
+            if cost <= remaining:
+                kept[position] = True
+                chosen.append(position)
+                remaining -= cost
+        if remaining <= 0:
+            break
+    if not chosen and budget > 0:
+        # No word is small enough; keep the most important one rather than nothing
+        position = next(positions[0] for positions in reversed(by_bucket) if positions)
+        kept[position] = True
+        chosen.append(position)
+
+    while True:
+        compressed = ''.join(word for word, keep in zip(words, kept) if keep).strip()
+        # Joined words can tokenize differently; drop the last chosen words if over
+        (total,) = count_batch([compressed])
+        if total <= budget or len(chosen) <= 1:
+            return compressed, total
+        excess = total - budget
+        while excess > 0 and chosen:
+            position = chosen.pop()
+            kept[position] = False
+            excess -= max(1, tokens[words[position]])
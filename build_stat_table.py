@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Build the token importance table for the statistical scorer
+
+Counts tiktoken ids over a corpus of text files, in which documents are
+separated by blank lines, and writes a unigram self-information or IDF
+table where statistical_scorer looks for it, with the byte length of every
+token next to it. Prompts like the ones users
+send make the best corpus.
+
+Run with: python3 build_stat_table.py corpus.txt [more.txt ...] [--kind idf]
+"""
+
+import argparse
+import os
+import re
+import sys
+
+import numpy as np
+
+import tokenizer_registry
+from statistical_scorer import (
+    ENCODING, KINDS, TABLE_DIR, build_table, lengths_path, table_path, token_byte_lengths
+)
+
+DOCUMENT_BREAK = re.compile(r'\n\s*\n')
+
+
+def read_documents(paths):
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as corpus:
+            for document in DOCUMENT_BREAK.split(corpus.read()):
+                if document.strip():
+                    yield document
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('corpus', nargs='+', help='text files, documents separated by blank lines')
+    parser.add_argument('--kind', choices=KINDS, default='unigram')
+    parser.add_argument('--encoding', default=ENCODING, help='tiktoken encoding name')
+    parser.add_argument('--output', help=f'table file (default: {TABLE_DIR}/<encoding>.<kind>.npy)')
+    args = parser.parse_args()
+
+    try:
+        encoder = tokenizer_registry.get_encoder(args.encoding)
+    except Exception as e:
+        print(f"❌ Could not load the {args.encoding} tokenizer: {e}")
+        return 1
+    documents = [encoder.encode_ordinary(document) for document in read_documents(args.corpus)]
+    if not documents:
+        print("❌ The corpus is empty")
+        return 1
+    table = build_table(documents, encoder.n_vocab, args.kind)
+
+    output = args.output or table_path(args.encoding, args.kind)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    np.save(output, table)
+    # Saves each worker a pass over the whole vocabulary at start-up
+    lengths = lengths_path(args.encoding, os.path.dirname(os.path.abspath(output)))
+    np.save(lengths, token_byte_lengths(encoder))
+    tokens = sum(len(ids) for ids in documents)
+    seen = len(np.unique(np.concatenate([np.asarray(ids, dtype=np.int64) for ids in documents])))
+    print(f"✓ {args.kind} table from {len(documents)} documents, {tokens} tokens, {seen} distinct")
+    print(f"📦 {output}: {os.path.getsize(output) / 1e6:.1f} MB, token lengths in {lengths}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for compression results
+
+Results are keyed by a hash of the prompt text together with everything
+else that decides the output (ratio, method, rule pack version,
+tokenizer), so a changed rule pack or tokenizer never serves a stale
+result. Entries expire after a TTL and the least recently used entry is
+evicted once the cache is full.
+
+A CompressionCache can be backed by a DiskCache, an SQLite database in WAL
+mode that every worker process reads and writes concurrently and that
+survives restarts, so a fresh deploy starts with warm hit rates. The
+disk tier is capped in bytes, evicting the least recently read entries,
+and is wiped whenever its schema version changes.
+
+Concurrent misses on the same key are coalesced: the first request
+computes the result and identical requests arriving meanwhile (a double
+click on send, a retry) wait for it instead of compressing again.
+
+Clients can skip the cache, e.g. for benchmarking, by sending the header
+``X-Sequoia-Cache: bypass``; responses carry the same header with
+``hit``, ``miss``, ``coalesced`` or ``bypass``.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_HEADER = 'X-Sequoia-Cache'
+BYPASS = 'bypass'
+COALESCED = 'coalesced'
+MAX_ENTRIES = int(os.environ.get('SEQUOIA_RESULT_CACHE_SIZE', 2048))
+TTL_SECONDS = float(os.environ.get('SEQUOIA_RESULT_CACHE_TTL', 3600))
+
+CACHE_DIR = os.environ.get(
+    'SEQUOIA_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'sequoia')
+)
+DISK_CACHE_MB = float(os.environ.get('SEQUOIA_DISK_CACHE_MB', 256))
+DISK_TTL_SECONDS = float(os.environ.get('SEQUOIA_DISK_CACHE_TTL', 7 * 24 * 3600))
+# Bump whenever the stored result format changes; older databases are wiped
+SCHEMA_VERSION = 1
+# Reads refresh an entry's access time at most this often, to keep writes rare
+TOUCH_INTERVAL = 60
+# Check the total size after this many writes
+EVICTION_CHECK_INTERVAL = 64
+
+
+def cache_key(text, *params):
+    """Hash of text and the parameters that decide how it is compressed"""
+    digest = hashlib.blake2b(repr(params).encode('utf-8'), digest_size=16)
+    digest.update(b'\0')
+    digest.update(text.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+def bypass_requested(headers):
+    """True if the request asked to skip the result cache"""
+    return headers.get(CACHE_HEADER, '').strip().lower() == BYPASS
+
+
+class Flight:
+    """A result being computed, which concurrent requests for its key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class CompressionCache:
+    """Thread-safe LRU of compression results with a TTL"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS, clock=time.monotonic, backing=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        # Optional slower tier (DiskCache) consulted on a miss
+        self.backing = backing
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # Misses being computed, by key
+        self._flights = {}
+        self.coalesced = 0
+        self.coalesce_timeouts = 0
+
+    def get(self, key):
+        """Cached result for key, or None if missing or expired"""
+        with self._lock:
+            value = self._get_entry(key)
+        if value is not None:
+            return value
+        return self._get_backing(key)
+
+    def _get_entry(self, key):
+        """In-memory result for key, counting the hit or miss; called holding the lock"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(value)
+            del self._entries[key]
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def _get_backing(self, key):
+        if self.backing is not None:
+            value = self.backing.get(key)
+            if value is not None:
+                self._store(key, value)
+                return value
+        return None
+
+    def put(self, key, value):
+        self._store(key, value)
+        if self.backing is not None:
+            self.backing.put(key, value)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, dict(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute, use_cache=True, cacheable=None, wait=None, result_key=None):
+        """
+        Return (result, status) where status is 'hit', 'miss', 'coalesced' or 'bypass'
+
+        Args:
+            key: cache_key() of the request
+            compute: function producing the result on a miss
+            use_cache: False to neither read nor fill the cache, nor share a result
+            cacheable: optional predicate; results it rejects are not stored
+            wait: most seconds to wait for the same key being computed by
+                another request before computing it here; None waits for it
+            result_key: optional, returns the key to store a computed result
+                under when it may differ from key, e.g. one naming the tier
+                that actually produced it
+        """
+        if not use_cache:
+            return compute(), BYPASS
+
+        # Looked up and joined in one step, so a request missing just as the
+        # same key's computation finishes finds its result instead of redoing it
+        with self._lock:
+            value = self._get_entry(key)
+            if value is not None:
+                return value, 'hit'
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+        if not leader:
+            if not flight.done.wait(wait):
+                with self._lock:
+                    self.coalesce_timeouts += 1
+            elif flight.result is not None:
+                with self._lock:
+                    self.coalesced += 1
+                return dict(flight.result), COALESCED
+            # Too slow for this request's budget, failed or not cacheable: compute here
+            value = compute()
+            if cacheable is None or cacheable(value):
+                self.put(result_key(value) if result_key else key, value)
+            return value, 'miss'
+
+        try:
+            value = self._get_backing(key)
+            if value is not None:
+                flight.result = value
+                return value, 'hit'
+            value = compute()
+            if cacheable is None or cacheable(value):
+                # Results cut short, e.g. for a client that went away, are not shared either
+                flight.result = value
+                self.put(result_key(value) if result_key else key, value)
+            return value, 'miss'
+        finally:
+            # Stored before the flight ends, so a later request finds one or the other
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.backing is not None:
+            self.backing.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'in_flight': len(self._flights),
+                'coalesced': self.coalesced,
+                'coalesce_timeouts': self.coalesce_timeouts,
+            }
+        if self.backing is not None:
+            stats['disk'] = self.backing.stats()
+        return stats
+
+
+class DiskCache:
+    """
+    Compression results in an SQLite database shared by all worker processes
+
+    Every error is logged and treated as a miss: the disk tier can make
+    compression faster but never makes it fail.
+    """
+
+    def __init__(self, path=None, max_bytes=DISK_CACHE_MB * 1024 * 1024,
+                 ttl=DISK_TTL_SECONDS, clock=time.time):
+        self.path = path or os.path.join(CACHE_DIR, 'results.sqlite3')
+        self.max_bytes = int(max_bytes)
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._connect()
+
+    def _connect(self):
+        """Connection for this thread, reopened after a fork"""
+        local = self._local
+        if getattr(local, 'pid', None) == os.getpid():
+            return local.connection
+
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        self._migrate(connection)
+        local.connection, local.pid = connection, os.getpid()
+        return connection
+
+    def _migrate(self, connection):
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            row = connection.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+            if row is None or int(row[0]) != SCHEMA_VERSION:
+                if row is not None:
+                    logger.info(f"Result cache schema {row[0]} → {SCHEMA_VERSION}, dropping old entries")
+                connection.execute('DROP TABLE IF EXISTS results')
+                connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),)
+                )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _count(self, name):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        try:
+            connection = self._connect()
+            row = connection.execute(
+                'SELECT value, created, accessed FROM results WHERE key = ?', (key,)
+            ).fetchone()
+            now = self.clock()
+            if row is None or row[1] + self.ttl <= now:
+                self._count('misses')
+                return None
+            if now - row[2] > TOUCH_INTERVAL:
+                connection.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+            self._count('hits')
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Result cache read failed: {e}")
+            self._count('errors')
+            return None
+
+    def put(self, key, value):
+        try:
+            connection = self._connect()
+            payload = json.dumps(value, ensure_ascii=False)
+            now = self.clock()
+            connection.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                (key, payload, len(key) + len(payload.encode('utf-8')), now, now)
+            )
+            with self._stats_lock:
+                self._writes += 1
+                check = self._writes % EVICTION_CHECK_INTERVAL == 0
+            if check:
+                self.evict()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Result cache write failed: {e}")
+            self._count('errors')
+
+    def evict(self):
+        """Drop expired entries, then the least recently read ones until under max_bytes"""
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            removed = connection.execute(
+                'DELETE FROM results WHERE created <= ?', (self.clock() - self.ttl,)
+            ).rowcount
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total > self.max_bytes:
+                # Trim to 90% so the next few writes do not trigger another pass
+                excess = total - int(self.max_bytes * 0.9)
+                cutoff = connection.execute(
+                    'SELECT accessed FROM ('
+                    'SELECT accessed, SUM(size) OVER (ORDER BY accessed, key) AS running FROM results'
+                    ') WHERE running >= ? LIMIT 1', (excess,)
+                ).fetchone()
+                if cutoff is not None:
+                    removed += connection.execute(
+                        'DELETE FROM results WHERE accessed <= ?', (cutoff[0],)
+                    ).rowcount
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        with self._stats_lock:
+            self.evictions += removed
+
+    def clear(self):
+        try:
+            self._connect().execute('DELETE FROM results')
+        except sqlite3.Error as e:
+            logger.warning(f"Result cache clear failed: {e}")
+
+    def stats(self):
+        try:
+            entries, size = self._connect().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results'
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        with self._stats_lock:
+            return {
+                'path': self.path,
+                'schema_version': SCHEMA_VERSION,
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'errors': self.errors,
+            }
+
+
+def open_result_cache():
+    """In-memory result cache backed by the shared disk cache when it can be opened"""
+    backing = None
+    if DISK_CACHE_MB > 0:
+        try:
+            backing = DiskCache()
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Disk result cache unavailable, using memory only: {e}")
+    return CompressionCache(backing=backing)
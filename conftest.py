@@ -0,0 +1,19 @@
+"""
+Test setup shared by every test module
+
+The services open the disk result cache and look for statistical tables
+under SEQUOIA_CACHE_DIR when they are imported. Pointing it at a fresh
+directory keeps test runs from reading or filling the developer's real
+cache, where a result cached by one run could hide a change in the next.
+"""
+
+import os
+import shutil
+import tempfile
+
+CACHE_DIR = tempfile.mkdtemp(prefix='sequoia-test-cache-')
+os.environ['SEQUOIA_CACHE_DIR'] = CACHE_DIR
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
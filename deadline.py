@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Latency budgets for the compression cascade
+
+The user is waiting to send while a prompt is compressed, so each request
+carries a deadline: the X-Sequoia-Deadline-Ms header, or the default for
+the site it came from. Tiers run cheapest first (cache, rules, model) and
+a slower tier is only waited on while budget remains; when the deadline
+hits, the request returns the best result it already has and the slow
+call is cancelled if it has not started, or abandoned if it has. A
+request whose client has gone away is cancelled the same way.
+"""
+
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ThreadPoolExecutor
+from concurrent.futures import wait as wait_for_futures
+
+import tokenizer_registry
+
+DEADLINE_HEADER = 'X-Sequoia-Deadline-Ms'
+DEFAULT_DEADLINE_MS = float(os.environ.get('SEQUOIA_DEADLINE_MS', 2000))
+# Caps what a client can ask for, so abandoned work stays bounded
+MAX_DEADLINE_MS = 60000
+# Threads running in-process slow tiers; abandoned calls hold one until done
+SLOW_TIER_THREADS = int(os.environ.get('SEQUOIA_SLOW_TIER_THREADS', 4))
+
+_slow_tiers = ThreadPoolExecutor(max_workers=SLOW_TIER_THREADS, thread_name_prefix='slow-tier')
+
+
+class DeadlineExceeded(TimeoutError):
+    """A tier did not finish within the request's latency budget"""
+
+
+class RequestCancelled(DeadlineExceeded):
+    """The request was cancelled, e.g. because its client disconnected"""
+
+
+def site_deadline_ms(url):
+    """Default budget for the site of url, e.g. SEQUOIA_DEADLINE_MS_ANTHROPIC for claude.ai"""
+    site = tokenizer_registry.profile_for_url(url).name
+    return float(os.environ.get(f'SEQUOIA_DEADLINE_MS_{site.upper()}', DEFAULT_DEADLINE_MS))
+
+
+def requested_budget_ms(headers):
+    """Budget from the request header, capped to MAX_DEADLINE_MS; None when absent or malformed"""
+    try:
+        budget_ms = float(headers.get(DEADLINE_HEADER))
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(budget_ms):
+        return None
+    return min(max(budget_ms, 0), MAX_DEADLINE_MS)
+
+
+def deadline_for_request(headers, url):
+    """Deadline from the request header, or the site default when absent or malformed"""
+    budget_ms = requested_budget_ms(headers)
+    if budget_ms is None:
+        budget_ms = min(max(site_deadline_ms(url), 0), MAX_DEADLINE_MS)
+    return Deadline(budget_ms)
+
+
+class Deadline:
+    """Budget started at creation; None means no limit"""
+
+    def __init__(self, budget_ms=None, clock=time.monotonic):
+        self.budget_ms = budget_ms
+        self.clock = clock
+        self.started = clock()
+        # Completed by cancel(), waking any wait() in progress
+        self._cancelled = Future()
+
+    def cancel(self):
+        """Give up on the request now: pending and future waits raise RequestCancelled"""
+        try:
+            self._cancelled.set_result(True)
+        except InvalidStateError:
+            pass
+
+    @property
+    def cancelled(self):
+        return self._cancelled.done()
+
+    def elapsed_ms(self):
+        return (self.clock() - self.started) * 1000
+
+    def remaining(self):
+        """Seconds left, or None without a limit"""
+        if self.cancelled:
+            return 0.0
+        if self.budget_ms is None:
+            return None
+        return max(0.0, (self.budget_ms - self.elapsed_ms()) / 1000)
+
+    @property
+    def expired(self):
+        return self.cancelled or (self.budget_ms is not None and self.remaining() <= 0)
+
+    def wait(self, future):
+        """Result of future, or DeadlineExceeded once the budget runs out or on cancel()"""
+        wait_for_futures((future, self._cancelled), timeout=self.remaining(), return_when=FIRST_COMPLETED)
+        if future.done():
+            return future.result()
+        # Only succeeds while the call is still queued
+        future.cancel()
+        if self.cancelled:
+            raise RequestCancelled("request cancelled")
+        raise DeadlineExceeded(f"no result within {self.budget_ms:g} ms")
+
+    def report(self, tier, abandoned=()):
+        """Fields added to a compression result: winning tier and budget used"""
+        return {
+            'tier': tier,
+            'abandoned_tiers': list(abandoned),
+            'deadline_ms': self.budget_ms,
+            'elapsed_ms': round(self.elapsed_ms(), 2),
+        }
+
+
+def run_with_deadline(function, deadline, *args):
+    """Run a blocking slow tier on a background thread, waiting at most until the deadline"""
+    if deadline is None or deadline.budget_ms is None:
+        return function(*args)
+    if deadline.cancelled:
+        raise RequestCancelled("request cancelled")
+    if deadline.expired:
+        raise DeadlineExceeded(f"budget of {deadline.budget_ms:g} ms already used")
+    return deadline.wait(_slow_tiers.submit(function, *args))
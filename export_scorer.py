@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Export the Selective Context scoring model to ONNX for CPU inference
+
+Writes an fp32 export and, unless --no-quantize is given, an int8 copy
+with dynamically quantized weights, where selective_context looks for
+them. Select one per deployment with SEQUOIA_SC_RUNTIME=onnx or onnx-int8.
+
+Run with: python3 export_scorer.py [--model gpt2] [--output-dir DIR]
+Requires: pip3 install onnx onnxruntime
+"""
+
+import argparse
+import os
+import sys
+
+from selective_context import MODEL_NAME, ONNX_DIR, onnx_path
+
+# Opset with the attention ops GPT-2 exports to in recent torch releases
+ONNX_OPSET = 14
+
+
+def export_onnx(model_name=MODEL_NAME, output_dir=ONNX_DIR, quantize=True):
+    """Export model_name's logits as an ONNX graph with dynamic batch and sequence axes"""
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask, use_cache=False).logits
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = AutoModelForCausalLM.from_pretrained(model_name).eval()
+    fp32_path = onnx_path(model_name, False, output_dir)
+    example = torch.ones((2, 8), dtype=torch.long)
+    dynamic = {0: 'batch', 1: 'sequence'}
+    with torch.no_grad():
+        torch.onnx.export(
+            LogitsOnly(model), (example, example), fp32_path,
+            input_names=['input_ids', 'attention_mask'], output_names=['logits'],
+            dynamic_axes={'input_ids': dynamic, 'attention_mask': dynamic, 'logits': dynamic},
+            opset_version=ONNX_OPSET
+        )
+    print(f"✓ Exported {model_name} to {fp32_path}")
+    paths = [fp32_path]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        int8_path = onnx_path(model_name, True, output_dir)
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"✓ Quantized weights to int8 in {int8_path}")
+        paths.append(int8_path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--model', default=MODEL_NAME, help='Hugging Face model name or directory')
+    parser.add_argument('--output-dir', default=ONNX_DIR, help='where selective_context looks for exports')
+    parser.add_argument('--no-quantize', action='store_true', help='only write the fp32 export')
+    args = parser.parse_args()
+
+    try:
+        paths = export_onnx(args.model, args.output_dir, not args.no_quantize)
+    except ImportError as e:
+        print(f"❌ {e}")
+        print("Install with: pip3 install torch transformers onnx onnxruntime")
+        return 1
+    for path in paths:
+        print(f"📦 {path}: {os.path.getsize(path) / 1e6:.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
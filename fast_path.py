@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Fast path for prompts that compression cannot shrink
+
+Code, stack traces, URLs, base64 blobs and text in another language than
+the rule pack never get shorter, yet smart_compress would run every
+strategy on them. A cheap classifier looks at character-class statistics
+of the start of the prompt, a prefilter checks whether the rule pack
+matches anything at all, and a negative cache remembers prompts that
+already gave no savings, so these short-circuit to no_compression_needed
+without running any compressor.
+"""
+
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from compression_cache import cache_key
+
+NEGATIVE_CACHE_SIZE = int(os.environ.get('SEQUOIA_NEGATIVE_CACHE_SIZE', 65536))
+# Only the start of a prompt is classified, keeping the check sub-millisecond
+SAMPLE_LENGTH = 4096
+MIN_CLASSIFIED_LINES = 3
+MAX_CLASSIFIED_LINES = 50
+
+URLS = re.compile(r'(?:(?:https?|ftp)://\S+\s*)+')
+BASE64 = re.compile(r'[A-Za-z0-9+/=_\-\r\n]+')
+TRACE_LINE = re.compile(
+    r'^\s*(?:Traceback \(most recent call last\)|File "[^"]*", line \d+|at [\w$.<>]+\(.*\)'
+    r'|\.\.\. \d+ more|Caused by:|[\w.]+(?:Error|Exception)\b)'
+)
+CODE_LINE = re.compile(
+    r'^\s*(?:[}\])]|#include\b|(?:def|class|import|from|return|elif|else|try|except|finally|'
+    r'const|let|var|function|public|private|protected|package|func|fn|struct|impl|SELECT|FROM|WHERE)\b)'
+    r'|[;{}]\s*$|\)\s*:\s*$|=>|[=!]==?|&&|\|\|'
+)
+
+
+def classify(text, language='en'):
+    """
+    Name the kind of incompressible input text looks like, or None
+
+    Returns one of 'url', 'base64', 'stack_trace', 'code', 'non_english'.
+    """
+    sample = text[:SAMPLE_LENGTH].strip()
+    if not sample:
+        return None
+
+    if URLS.fullmatch(sample):
+        return 'url'
+    if len(sample) >= 64 and BASE64.fullmatch(sample) and any(char.isdigit() for char in sample):
+        return 'base64'
+
+    lines = [line for line in sample.splitlines() if line.strip()][:MAX_CLASSIFIED_LINES]
+    if len(lines) >= MIN_CLASSIFIED_LINES:
+        trace_lines = sum(1 for line in lines if TRACE_LINE.match(line))
+        if trace_lines >= 2 and trace_lines * 3 >= len(lines):
+            return 'stack_trace'
+        code_lines = sum(1 for line in lines if CODE_LINE.search(line))
+        if code_lines * 5 >= len(lines) * 3:
+            return 'code'
+
+    if language == 'en' and not sample.isascii():
+        # Share of visible characters outside ASCII, counted at C speed
+        visible = len(sample) - sum(map(sample.count, ' \t\r\n'))
+        non_ascii = len(sample) - len(sample.encode('ascii', 'ignore'))
+        if non_ascii * 10 >= visible * 3:
+            return 'non_english'
+    return None
+
+
+class FastPath:
+    """Decides when smart_compress can skip compression, and counts what was skipped"""
+
+    def __init__(self, negative_cache_size=NEGATIVE_CACHE_SIZE):
+        self.negative_cache_size = negative_cache_size
+        self._negative = OrderedDict()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped = Counter()
+        self.skipped_chars = 0
+
+    def check(self, text, params, language='en', matcher=None):
+        """
+        Reason to skip compressing text, or None to compress it
+
+        Args:
+            params: everything besides the text that decides the result,
+                as passed to remember()
+            language: language of the rule pack in use
+            matcher: the rule pack's PhraseMatcher when rules are the only
+                strategy, so a prompt no rule matches can be skipped
+        """
+        key = cache_key(text, *params)
+        with self._lock:
+            self.checked += 1
+            known = key in self._negative
+            if known:
+                self._negative.move_to_end(key)
+
+        if known:
+            reason = 'negative_cache'
+        else:
+            reason = classify(text, language)
+            if reason is None and matcher is not None and (
+                    matcher.pattern is None or matcher.pattern.search(text) is None):
+                reason = 'no_rule_hits'
+
+        if reason is not None:
+            with self._lock:
+                self.skipped[reason] += 1
+                self.skipped_chars += len(text)
+        return reason
+
+    def remember(self, text, params):
+        """Record that text gave no savings, so the next request skips it"""
+        key = cache_key(text, *params)
+        with self._lock:
+            self._negative[key] = True
+            self._negative.move_to_end(key)
+            while len(self._negative) > self.negative_cache_size:
+                self._negative.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            skipped = sum(self.skipped.values())
+            return {
+                'checked': self.checked,
+                'skipped': skipped,
+                'skipped_by_reason': dict(self.skipped),
+                'skipped_chars': self.skipped_chars,
+                'skip_rate': round(skipped / self.checked, 4) if self.checked else 0.0,
+                'negative_cache_entries': len(self._negative),
+                'negative_cache_size': self.negative_cache_size,
+            }
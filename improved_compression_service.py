@@ -10,7 +10,17 @@ import logging
 import importlib.util
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import tiktoken
+
+import tokenizer_registry
+from compression_cache import CACHE_HEADER, bypass_requested, cache_key, open_result_cache
+from deadline import Deadline, DeadlineExceeded, deadline_for_request, run_with_deadline
+from fast_path import FastPath
+from model_pool import cores_per_worker, limit_threads
+from rule_matcher import apply_edits
+from rule_packs import RulePackRegistry
+from segment_cache import MIN_SEGMENTED_LENGTH, SegmentCache, count_segments, rewrite_segments
+from token_accounting import count_after_edits, diff_edits
+from warmup import WARMUP_TEXT, BackgroundLoader
 
 # Add prompt_compressor to path if it exists
 if os.path.exists('./prompt_compressor'):
@@ -28,41 +38,77 @@ CORS(app)
 
 class AdvancedPromptCompressor:
     def __init__(self):
-        self.encoder = tiktoken.get_encoding("cl100k_base")
+        self.encoder = tokenizer_registry.get_encoder("cl100k_base")
+        self.rule_packs = RulePackRegistry()
+        self.result_cache = open_result_cache()
+        # Per-sentence rewrites and token counts, so edited long prompts
+        # only redo the sentences that changed
+        self.segment_cache = SegmentCache()
+        # Skips prompts that cannot shrink: code, traces, URLs, known misses
+        self.fast_path = FastPath()
+        # Set once the library has loaded and warmed up in the background;
+        # until then requests are served with the rule packs
         self.prompt_compressor = None
-        self._load_prompt_compressor()
+        self.library_loader = BackgroundLoader(
+            'prompt_compressor', self._load_prompt_compressor,
+            warm=lambda library: library.compress(WARMUP_TEXT),
+            on_ready=self._use_prompt_compressor
+        )
         
     def _load_prompt_compressor(self):
-        """Try to load the prompt_compressor library"""
-        try:
-            # Try to import the prompt_compressor module
-            spec = importlib.util.spec_from_file_location(
-                "prompt_compressor", 
-                "./prompt_compressor/prompt_compressor/__init__.py"
-            )
-            if spec and spec.loader:
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-                
-                # Try to get the PromptCompressor class
-                if hasattr(module, 'PromptCompressor'):
-                    self.prompt_compressor = module.PromptCompressor()
-                    logger.info("✓ Loaded prompt_compressor library")
-                else:
-                    logger.warning("PromptCompressor class not found in module")
-                    
-        except Exception as e:
-            logger.warning(f"Could not load prompt_compressor library: {e}")
-            logger.info("Falling back to built-in compression rules")
+        """Try to load the prompt_compressor library, returns None when it is not installed"""
+        if not os.path.exists('./prompt_compressor/prompt_compressor/__init__.py'):
+            logger.info("prompt_compressor library not found, using built-in compression rules")
+            return None
+        
+        # Try to import the prompt_compressor module
+        spec = importlib.util.spec_from_file_location(
+            "prompt_compressor", 
+            "./prompt_compressor/prompt_compressor/__init__.py"
+        )
+        if not spec or not spec.loader:
+            return None
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        
+        # Try to get the PromptCompressor class
+        if not hasattr(module, 'PromptCompressor'):
+            logger.warning("PromptCompressor class not found in module")
+            return None
+        return module.PromptCompressor()
+    
+    def _use_prompt_compressor(self, library):
+        """Switch smart_compress to the library once it is warmed up"""
+        self.prompt_compressor = library
+        logger.info("✓ Loaded prompt_compressor library")
     
-    def count_tokens(self, text):
-        """Count tokens using tiktoken"""
+    def count_tokens(self, text, counter=None):
+        """Count tokens using tiktoken, or with a site's token counter if given"""
         try:
-            return len(self.encoder.encode(text))
+            if counter is not None:
+                return counter.count(text)
+            return tokenizer_registry.count(text, self.encoder.name)
         except Exception as e:
             logger.error(f"Error counting tokens: {e}")
             return len(text.split())
     
+    def count_tokens_after_edits(self, text, text_tokens, edits, rewritten=None, counter=None):
+        """Token count of text after edits, re-encoding only the regions around each edit"""
+        count = lambda piece: self.count_tokens(piece, counter)
+        if counter is not None and not counter.incremental:
+            # Only BPE counts can be patched window by window
+            return count(rewritten if rewritten is not None else apply_edits(text, edits))
+        return count_after_edits(count, text, text_tokens, edits, rewritten)
+    
+    def count_prompt_tokens(self, text, counter):
+        """Token count of a whole prompt, summed from cached sentence counts when long"""
+        if counter.incremental and len(text) >= MIN_SEGMENTED_LENGTH:
+            return count_segments(
+                lambda piece: self.count_tokens(piece, counter), text,
+                self.segment_cache, ('tokens', counter.name)
+            )
+        return self.count_tokens(text, counter)
+    
     def library_compress(self, text):
         """Compress using the prompt_compressor library"""
         if not self.prompt_compressor:
@@ -84,276 +130,43 @@ class AdvancedPromptCompressor:
             logger.error(f"Library compression failed: {e}")
             return None
     
-    def rule_based_compress(self, text):
-        """Enhanced rule-based compression"""
-        # Common contraction rules
-        contractions = {
-            "I am": "I'm",
-            "you are": "you're",
-            "he is": "he's",
-            "she is": "she's",
-            "it is": "it's",
-            "we are": "we're",
-            "they are": "they're",
-            "I will": "I'll",
-            "you will": "you'll",
-            "he will": "he'll",
-            "she will": "she'll",
-            "it will": "it'll",
-            "we will": "we'll",
-            "they will": "they'll",
-            "I would": "I'd",
-            "you would": "you'd",
-            "he would": "he'd",
-            "she would": "she'd",
-            "we would": "we'd",
-            "they would": "they'd",
-            "I have": "I've",
-            "you have": "you've",
-            "we have": "we've",
-            "they have": "they've",
-            "do not": "don't",
-            "does not": "doesn't",
-            "did not": "didn't",
-            "can not": "can't",
-            "cannot": "can't",
-            "will not": "won't",
-            "would not": "wouldn't",
-            "should not": "shouldn't",
-            "could not": "couldn't",
-            "have not": "haven't",
-            "has not": "hasn't",
-            "had not": "hadn't",
-            "is not": "isn't",
-            "are not": "aren't",
-            "was not": "wasn't",
-            "were not": "weren't"
-        }
-        
-        # Politeness reduction rules
-        politeness_reductions = [
-            ("could you please", "please"),
-            ("would you mind", "please"),
-            ("I would like to", "I want to"),
-            ("I would appreciate if", "please"),
-            ("it would be great if", "please"),
-            ("if you could", "please"),
-            ("I am wondering if", "can"),
-            ("I was hoping that", "please"),
-            ("would it be possible to", "can you"),
-        ]
-        
-        # Redundancy removal
-        redundancy_rules = [
-            ("really very", "very"),
-            ("quite very", "very"),
-            ("really quite", "quite"),
-            ("more about", "about"),
-            ("learn more about", "learn about"),
-            ("understand more about", "understand"),
-            ("know more about", "know about"),
-            ("in order to", "to"),
-            ("for the purpose of", "to"),
-            ("with the goal of", "to"),
-            ("very detailed", "detailed"),
-            ("very important", "important"),
-            ("very interesting", "interesting"),
-            ("very helpful", "helpful"),
-            ("very useful", "useful"),
-            ("very good", "good"),
-            ("very bad", "bad"),
-            ("very large", "large"),
-            ("very small", "small"),
-            ("very long", "long"),
-            ("very short", "short"),
-            ("very fast", "fast"),
-            ("very slow", "slow"),
-            ("very easy", "easy"),
-            ("very difficult", "difficult"),
-            ("very simple", "simple"),
-            ("very complex", "complex"),
-            ("very clear", "clear"),
-            ("very obvious", "obvious"),
-            ("very basic", "basic"),
-            ("very advanced", "advanced"),
-            ("very specific", "specific"),
-            ("very general", "general"),
-            ("very accurate", "accurate"),
-            ("very precise", "precise"),
-            ("very exact", "exact"),
-            ("very similar", "similar"),
-            ("very different", "different"),
-            ("very common", "common"),
-            ("very rare", "rare"),
-            ("very popular", "popular"),
-            ("very famous", "famous"),
-            ("very successful", "successful"),
-            ("very effective", "effective"),
-            ("very efficient", "efficient"),
-            ("very powerful", "powerful"),
-            ("very strong", "strong"),
-            ("very weak", "weak"),
-            ("very high", "high"),
-            ("very low", "low"),
-            ("very big", "big"),
-            ("very little", "little"),
-            ("very much", "much"),
-            ("very many", "many"),
-            ("very few", "few"),
-            ("very often", "often"),
-            ("very rarely", "rarely"),
-            ("very quickly", "quickly"),
-            ("very slowly", "slowly"),
-            ("very carefully", "carefully"),
-            ("very easily", "easily"),
-            ("very well", "well"),
-            ("very badly", "badly"),
-            ("very nicely", "nicely"),
-            ("very beautifully", "beautifully"),
-            ("very perfectly", "perfectly"),
-            ("very completely", "completely"),
-            ("very totally", "totally"),
-            ("very absolutely", "absolutely"),
-            ("very definitely", "definitely"),
-            ("very certainly", "certainly"),
-            ("very surely", "surely"),
-            ("very probably", "probably"),
-            ("very possibly", "possibly"),
-            ("very maybe", "maybe"),
-            ("very perhaps", "perhaps"),
-            ("very usually", "usually"),
-            ("very normally", "normally"),
-            ("very typically", "typically"),
-            ("very generally", "generally"),
-            ("very usually", "usually"),
-            ("very commonly", "commonly"),
-            ("very frequently", "frequently"),
-            ("very regularly", "regularly"),
-            ("very constantly", "constantly"),
-            ("very continuously", "continuously"),
-            ("very always", "always"),
-            ("very never", "never"),
-            ("very sometimes", "sometimes"),
-            ("very occasionally", "occasionally"),
-            ("very rarely", "rarely"),
-            ("very seldom", "seldom"),
-            ("very hardly", "hardly"),
-            ("very barely", "barely"),
-            ("very scarcely", "scarcely"),
-            ("very almost", "almost"),
-            ("very nearly", "nearly"),
-            ("very approximately", "approximately"),
-            ("very roughly", "roughly"),
-            ("very about", "about"),
-            ("very around", "around"),
-            ("very close to", "close to"),
-            ("very near to", "near to"),
-            ("very far from", "far from"),
-            ("very away from", "away from"),
-            ("very inside", "inside"),
-            ("very outside", "outside"),
-            ("very within", "within"),
-            ("very without", "without"),
-            ("very above", "above"),
-            ("very below", "below"),
-            ("very under", "under"),
-            ("very over", "over"),
-            ("very on top of", "on top of"),
-            ("very in front of", "in front of"),
-            ("very behind", "behind"),
-            ("very next to", "next to"),
-            ("very beside", "beside"),
-            ("very between", "between"),
-            ("very among", "among"),
-            ("very through", "through"),
-            ("very across", "across"),
-            ("very along", "along"),
-            ("very around", "around"),
-            ("very throughout", "throughout"),
-            ("very during", "during"),
-            ("very while", "while"),
-            ("very when", "when"),
-            ("very where", "where"),
-            ("very why", "why"),
-            ("very how", "how"),
-            ("very what", "what"),
-            ("very which", "which"),
-            ("very who", "who"),
-            ("very whom", "whom"),
-            ("very whose", "whose"),
-        ]
-        
-        # Filler word removal
-        filler_words = [
-            "basically", "actually", "literally", "obviously", 
-            "clearly", "definitely", "certainly", "surely",
-            "of course", "naturally", "undoubtedly", "indeed",
-            "frankly", "honestly", "truthfully", "seriously"
-        ]
-        
-        # Additional compression rules for common phrases
-        additional_rules = [
-            ("artificial intelligence", "AI"),
-            ("machine learning", "ML"),
-            ("deep learning", "DL"),
-            ("neural networks", "neural nets"),
-            ("natural language processing", "NLP"),
-            ("computer vision", "CV"),
-            ("data science", "DS"),
-            ("big data", "large data"),
-            ("cloud computing", "cloud"),
-            ("internet of things", "IoT"),
-            ("virtual reality", "VR"),
-            ("augmented reality", "AR"),
-            ("blockchain technology", "blockchain"),
-            ("cryptocurrency", "crypto"),
-            ("user interface", "UI"),
-            ("user experience", "UX"),
-            ("application programming interface", "API"),
-            ("representational state transfer", "REST"),
-            ("graphical user interface", "GUI"),
-            ("command line interface", "CLI"),
-        ]
-        
-        compressed = text
-        
-        # Apply contractions
-        for full, contracted in contractions.items():
-            compressed = compressed.replace(full, contracted)
-            compressed = compressed.replace(full.capitalize(), contracted.capitalize())
-        
-        # Apply politeness reductions
-        for verbose, concise in politeness_reductions:
-            compressed = compressed.replace(verbose, concise)
-            compressed = compressed.replace(verbose.capitalize(), concise.capitalize())
-        
-        # Apply redundancy rules
-        for redundant, concise in redundancy_rules:
-            compressed = compressed.replace(redundant, concise)
-        
-        # Apply additional compression rules
-        for long_phrase, short_phrase in additional_rules:
-            compressed = compressed.replace(long_phrase, short_phrase)
-            compressed = compressed.replace(long_phrase.capitalize(), short_phrase.capitalize())
-        
-        # Remove filler words (but be careful not to change meaning)
-        for filler in filler_words:
-            # Only remove if it's a standalone word
-            import re
-            pattern = r'\b' + re.escape(filler) + r'\b'
-            compressed = re.sub(pattern, '', compressed, flags=re.IGNORECASE)
-        
-        # Clean up extra spaces
-        compressed = ' '.join(compressed.split())
-        
-        return compressed.strip()
+    def rule_based_compress(self, text, url=None):
+        """Enhanced rule-based compression using the rule pack for the request's site"""
+        # Contractions, politeness, redundancy and abbreviations apply in order,
+        # then filler words and whitespace are cleaned up
+        return self.rule_packs.for_url(url).matcher.sub(text)
     
-    def smart_compress(self, text):
-        """Smart compression that tries multiple approaches"""
-        original_tokens = self.count_tokens(text)
-        
-        # Don't compress very short messages
-        if original_tokens < 5:
+    def rule_based_rewrite(self, text, url=None):
+        """Rule-based compression that also returns the (start, end, replacement) edits made"""
+        pack = self.rule_packs.for_url(url)
+        if len(text) >= MIN_SEGMENTED_LENGTH:
+            return rewrite_segments(pack.matcher, text, self.segment_cache, ('rules', pack.digest))
+        return pack.matcher.rewrite(text)
+    
+    def smart_compress(self, text, url=None, deadline=None):
+        """
+        Smart compression that tries multiple approaches, cheapest first
+        
+        The library is only waited on until deadline (a Deadline); past it,
+        the rule-based result is returned and the library is listed in
+        abandoned_tiers. with_library reports whether the library was
+        loaded and answered, i.e. whether the result depends on it.
+        """
+        # Count tokens the way the target site's models do
+        counter = tokenizer_registry.counter_for_url(url)
+        original_tokens = self.count_prompt_tokens(text, counter)
+        # The library may finish loading part way; decide with one view of it
+        library_loaded = self.prompt_compressor is not None
+        
+        # Don't compress very short messages, or ones that cannot shrink
+        pack = self.rule_packs.for_url(url)
+        fast_path_params = (pack.digest, library_loaded, counter.name)
+        skip_reason = 'too_short' if original_tokens < 5 else self.fast_path.check(
+            text, fast_path_params, pack.language,
+            # Without the library, a prompt no rule matches cannot shrink
+            None if library_loaded else pack.matcher
+        )
+        if skip_reason:
             return {
                 'original_text': text,
                 'compressed_text': text,
@@ -361,34 +174,58 @@ class AdvancedPromptCompressor:
                 'compressed_tokens': original_tokens,
                 'tokens_saved': 0,
                 'compression_ratio': 0,
-                'method': 'no_compression_needed'
+                'method': 'no_compression_needed',
+                'skip_reason': skip_reason,
+                'tokenizer': counter.name,
+                'tier': 'fast_path',
+                'abandoned_tiers': [],
+                'with_library': library_loaded
             }
         
         best_compression = text
         best_tokens = original_tokens
         best_method = 'original'
+        abandoned = []
+        with_library = False
+        
+        # Try rule-based compression; it takes microseconds, so there is
+        # always a result by the time the deadline hits
+        rule_result, rule_edits = self.rule_based_rewrite(text, url)
+        if rule_result and rule_edits:
+            if len(text) >= MIN_SEGMENTED_LENGTH:
+                rule_tokens = self.count_prompt_tokens(rule_result, counter)
+            else:
+                rule_tokens = self.count_tokens_after_edits(
+                    text, original_tokens, rule_edits, rule_result, counter
+                )
+            if rule_tokens < best_tokens:
+                best_compression = rule_result
+                best_tokens = rule_tokens
+                best_method = 'rule_based'
         
-        # Try library compression
-        if self.prompt_compressor:
+        # Try library compression while the budget lasts
+        if library_loaded:
             try:
-                library_result = self.library_compress(text)
+                library_result = run_with_deadline(self.library_compress, deadline, text)
+                with_library = True
                 if library_result and library_result != text:
-                    library_tokens = self.count_tokens(library_result)
-                    if library_tokens < best_tokens:
+                    library_tokens = self.count_tokens_after_edits(
+                        text, original_tokens, diff_edits(text, library_result), library_result, counter
+                    )
+                    # The library wins ties with the rules
+                    if library_tokens < best_tokens or (best_method == 'rule_based' and library_tokens == best_tokens):
                         best_compression = library_result
                         best_tokens = library_tokens
                         best_method = 'library'
+            except DeadlineExceeded as e:
+                logger.info(f"Library compression abandoned: {e}")
+                abandoned.append('library')
             except Exception as e:
                 logger.error(f"Library compression error: {e}")
         
-        # Try rule-based compression
-        rule_result = self.rule_based_compress(text)
-        if rule_result and rule_result != text:
-            rule_tokens = self.count_tokens(rule_result)
-            if rule_tokens < best_tokens:
-                best_compression = rule_result
-                best_tokens = rule_tokens
-                best_method = 'rule_based'
+        # Only remember misses the library had a chance to improve on
+        if best_method == 'original' and not abandoned:
+            self.fast_path.remember(text, fast_path_params)
         
         # Calculate final statistics
         tokens_saved = original_tokens - best_tokens
@@ -401,12 +238,65 @@ class AdvancedPromptCompressor:
             'compressed_tokens': best_tokens,
             'tokens_saved': tokens_saved,
             'compression_ratio': round(compression_ratio, 2),
-            'method': best_method
+            'method': best_method,
+            'tokenizer': counter.name,
+            'tier': {'library': 'library', 'rule_based': 'rules'}.get(best_method, 'none'),
+            'abandoned_tiers': abandoned,
+            'with_library': with_library
         }
 
-# Initialize compressor
+    def cached_smart_compress(self, text, url=None, use_cache=True, deadline=None):
+        """
+        smart_compress through the result cache, returns (result, cache status)
+        
+        The result reports the tier that produced it ('cache' on a hit) and
+        the share of the deadline used.
+        """
+        deadline = deadline or Deadline()
+        pack = self.rule_packs.for_url(url)
+        tokenizer = tokenizer_registry.counter_for_url(url).name
+
+        def key(with_library):
+            return cache_key(text, 'smart', with_library, pack.name, pack.version, pack.digest, tokenizer)
+
+        result, cache_status = self.result_cache.get_or_compute(
+            key(self.prompt_compressor is not None), lambda: self.smart_compress(text, url, deadline), use_cache,
+            # A result cut short by the deadline would shortchange requests with more time
+            cacheable=lambda result: not result['abandoned_tiers'], wait=deadline.remaining(),
+            # Stored for the tiers that ran: a result the library did not answer
+            # is not served once it has loaded, nor the other way round
+            result_key=lambda result: key(result['with_library'])
+        )
+        tier = 'cache' if cache_status == 'hit' else result['tier']
+        return dict(result, **deadline.report(tier, result['abandoned_tiers'])), cache_status
+
+# Initialize compressor. Under the pre-fork server (serve.py) the library
+# is loaded by preload() in the master and the watcher starts per worker.
+PREFORK = os.environ.get('SEQUOIA_PREFORK') == '1'
 compressor = AdvancedPromptCompressor()
 
+def watch_rule_packs():
+    """Pick up rule pack edits without a restart"""
+    compressor.rule_packs.watch()
+    compressor.rule_packs.install_signal_handler()
+
+def preload(workers=1):
+    """Load the tokenizers and warm up the library once, in the pre-fork master"""
+    tokenizer_registry.preload()
+    # Thread pools started by the warm-up keep their size in the forked workers
+    limit_threads(cores_per_worker(workers))
+    compressor.library_loader.run()
+
+def post_fork(workers):
+    """Start watching rule packs in a forked web worker"""
+    # Packs edited since the master loaded them
+    compressor.rule_packs.reload()
+    watch_rule_packs()
+
+if not PREFORK:
+    compressor.library_loader.start()
+    watch_rule_packs()
+
 @app.route('/compress', methods=['POST'])
 def compress_text():
     """Compress text endpoint"""
@@ -420,12 +310,17 @@ def compress_text():
         if not text or not text.strip():
             return jsonify({'error': 'Empty text provided'}), 400
         
-        result = compressor.smart_compress(text)
+        result, cache_status = compressor.cached_smart_compress(
+            text, data.get('url'), not bypass_requested(request.headers),
+            deadline_for_request(request.headers, data.get('url'))
+        )
         
         logger.info(f"Compression: {result['original_tokens']} → {result['compressed_tokens']} tokens "
-                   f"({result['compression_ratio']}%) using {result['method']}")
+                   f"({result['compression_ratio']}%) using {result['method']} (cache {cache_status})")
         
-        return jsonify(result)
+        response = jsonify(result)
+        response.headers[CACHE_HEADER] = cache_status
+        return response
         
     except Exception as e:
         logger.error(f"Error in compress endpoint: {e}")
@@ -450,7 +345,10 @@ def log_message():
         logger.info(f"Message logged from {url}: {message[:100]}...")
         
         # Compress the message
-        compression_result = compressor.smart_compress(message)
+        compression_result, cache_status = compressor.cached_smart_compress(
+            message, url, not bypass_requested(request.headers),
+            deadline_for_request(request.headers, url)
+        )
         
         # Format response for extension
         response = {
@@ -465,13 +363,20 @@ def log_message():
                 'compressed_tokens': compression_result['compressed_tokens'],
                 'token_compression_ratio': compression_result['compression_ratio'],
                 'method': compression_result['method'],
-                'tiktoken_available': True
+                'tokenizer': compression_result['tokenizer'],
+                'tiktoken_available': True,
+                'tier': compression_result['tier'],
+                'abandoned_tiers': compression_result['abandoned_tiers'],
+                'deadline_ms': compression_result['deadline_ms'],
+                'elapsed_ms': compression_result['elapsed_ms']
             },
             'logged': True,
             'url': url
         }
         
-        return jsonify(response)
+        response = jsonify(response)
+        response.headers[CACHE_HEADER] = cache_status
+        return response
         
     except Exception as e:
         logger.error(f"Error in log-message endpoint: {e}")
@@ -484,13 +389,20 @@ def log_message():
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
+    """Liveness: answers as soon as the server is up, while the library may still load"""
     return jsonify({
         'status': 'healthy',
         'service': 'advanced_prompt_compressor',
-        'library_loaded': compressor.prompt_compressor is not None
+        'library_loaded': compressor.prompt_compressor is not None,
+        'library_state': compressor.library_loader.state
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 once the library is warmed up or known to be absent, 503 before"""
+    loader = compressor.library_loader.stats()
+    return jsonify(loader), 200 if loader['ready'] else 503
+
 @app.route('/stats', methods=['GET'])
 def service_stats():
     """Service statistics"""
@@ -503,9 +415,16 @@ def service_stats():
             'smart_selection': True,
             'token_counting': True
         },
+        'rule_packs': compressor.rule_packs.describe(),
+        'tokenizers': tokenizer_registry.stats(),
+        'result_cache': compressor.result_cache.stats(),
+        'segment_cache': compressor.segment_cache.stats(),
+        'fast_path': compressor.fast_path.stats(),
+        'library': compressor.library_loader.stats(),
         'endpoints': {
             '/compress': 'POST - Compress text',
             '/health': 'GET - Health check',
+            '/ready': 'GET - Readiness (compression library warmed up)',
             '/stats': 'GET - Service statistics'
         }
     })
@@ -523,4 +442,5 @@ def index():
 if __name__ == '__main__':
     logger.info("Starting Advanced Prompt Compression Service on http://localhost:8002")
     logger.info(f"Library loaded: {compressor.prompt_compressor is not None}")
+    logger.info("For production, serve with: python3 serve.py improved --workers 4")
     app.run(host='0.0.0.0', port=8002, debug=False)
\ No newline at end of file
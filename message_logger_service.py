@@ -1,29 +1,81 @@
 #!/usr/bin/env python3
+import functools
+import importlib.metadata
+import importlib.util
 import json
 import logging
+import multiprocessing
+import os
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 
-# Import tiktoken for token counting
-try:
-    import tiktoken
-    TIKTOKEN_AVAILABLE = True
+from batch_compression import MAX_CONCURRENCY, BatchItemError, BatchRun, array_items, ndjson_items
+from budget_compression import compress_to_budget, token_budget
+from compression_cache import CACHE_HEADER, bypass_requested, cache_key, open_result_cache
+from deadline import (
+    Deadline, DeadlineExceeded, deadline_for_request, requested_budget_ms, run_with_deadline
+)
+from micro_batcher import MicroBatcher
+from model_pool import (
+    POOL_QUEUE_SIZE, LocalModel, ModelPool, PoolBusy, cores_per_worker, load_prompt_compressor
+)
+from score_cache import ScoreCache
+from segment_cache import MIN_SEGMENTED_LENGTH, SegmentCache, compress_segments
+from selective_context import MODEL_NAME, RUNTIME, ScoredText, SelectiveContext
+from stream_compression import StreamRun, read_chunks, stream_events, with_error_event
+from warmup import WARMUP_TEXT
+from windowed_compression import WindowedCompressor
+
+# Shared tiktoken encoders for token counting
+import tokenizer_registry
+TIKTOKEN_AVAILABLE = tokenizer_registry.TIKTOKEN_AVAILABLE
+if TIKTOKEN_AVAILABLE:
     print("✓ tiktoken library loaded successfully")
-except ImportError as e:
-    TIKTOKEN_AVAILABLE = False
-    print(f"⚠ tiktoken not available: {e}")
+else:
+    print("⚠ tiktoken not available")
     print("Install with: pip3 install tiktoken")
 
-# Import PCToolkit for prompt compression
-try:
-    from pctoolkit.compressors import PromptCompressor
+# Bumped when the fallback compression changes, so cached results are redone
+FALLBACK_VERSION = 2
+
+# Most ratios one /compress request may ask for
+MAX_VARIANTS = int(os.environ.get('SEQUOIA_MAX_VARIANTS', 16))
+
+# 'batched' runs Selective Context with batched scoring when transformers is
+# installed; 'pctoolkit' always uses PCToolkit's SCCompressor
+SC_BACKEND = os.environ.get('SEQUOIA_SC_BACKEND', 'batched')
+BATCHED_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ('torch', 'transformers'))
+
+# Look for PCToolkit; it is only imported in the model worker processes
+if importlib.util.find_spec('pctoolkit') is not None:
+    COMPRESSION_AVAILABLE = True
+    try:
+        PCTOOLKIT_VERSION = importlib.metadata.version('pctoolkit')
+    except importlib.metadata.PackageNotFoundError:
+        PCTOOLKIT_VERSION = 'unknown'
+    print("✓ PCToolkit prompt compression library found")
+elif SC_BACKEND == 'batched' and BATCHED_AVAILABLE:
     COMPRESSION_AVAILABLE = True
-    print("✓ PCToolkit prompt compression library loaded successfully")
-except ImportError as e:
+    PCTOOLKIT_VERSION = None
+else:
     COMPRESSION_AVAILABLE = False
-    print(f"⚠ PCToolkit not available: {e}")
+    PCTOOLKIT_VERSION = None
+    print("⚠ PCToolkit not available")
     print("Install with: pip install -r requirements.txt and download PCToolkit")
+USE_BATCHED = COMPRESSION_AVAILABLE and SC_BACKEND == 'batched' and BATCHED_AVAILABLE
+# The model backend that runs, as reported in results and /health
+MODEL_METHOD = 'selective_context' if USE_BATCHED else 'SCCompressor'
+if USE_BATCHED:
+    print(f"✓ Selective Context will run {MODEL_NAME} ({RUNTIME}) with batched scoring")
+
+# The statistical scorer needs numpy and a table from build_stat_table.py
+try:
+    from statistical_scorer import TABLE_PATH as STAT_TABLE_PATH, StatisticalScorer
+    STATISTICAL_AVAILABLE = os.path.exists(STAT_TABLE_PATH)
+except ImportError:
+    STAT_TABLE_PATH = None
+    STATISTICAL_AVAILABLE = False
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -31,17 +83,109 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-# Initialize prompt compressor
+# Initialize prompt compressor workers. Spawned workers re-import this
+# module, so only the serving process starts a pool. Workers load and warm
+# up their model in the background; until one is ready, requests get the
+# statistical or simple compression below. Under the pre-fork server
+# (serve.py) the model is instead loaded once in the master by preload()
+# and shared with the forked web workers.
+MODEL_WARMUP = ('compressgo', (WARMUP_TEXT, 0.3))
+PREFORK = os.environ.get('SEQUOIA_PREFORK') == '1'
 compressor = None
-if COMPRESSION_AVAILABLE:
+batcher = None
+windowed = None
+preloaded = None
+
+def model_factory():
+    """Loads the compression model; picklable, so pool workers can call it"""
+    if USE_BATCHED:
+        return functools.partial(SelectiveContext, MODEL_NAME, 'cpu')
+    # SCCompressor (Selective Context Compressor); you can change it to other
+    # types like 'LLMLingua', 'LongLLMLingua', etc.
+    return functools.partial(load_prompt_compressor, 'SCCompressor', 'cpu')  # Use 'cuda' if you have GPU
+
+def start_compressor(model):
+    """Serve compression from model, a ModelPool or LocalModel"""
+    global compressor, batcher, windowed
+    compressor = model
+    if USE_BATCHED:
+        # Selective Context scoring batched across concurrent requests
+        batcher = MicroBatcher(
+            lambda texts: compressor.call('self_info_batch', texts),
+            concurrency=compressor.size, max_pending=compressor.size + POOL_QUEUE_SIZE
+        )
+        # Prompts are scored in windows, cached, and long ones spread over all workers
+        windowed = WindowedCompressor(batcher.submit, ScoreCache(), f'{MODEL_NAME}/{RUNTIME}')
+
+if COMPRESSION_AVAILABLE and multiprocessing.parent_process() is None and not PREFORK:
     try:
-        # Initialize the SCCompressor (Selective Context Compressor)
-        # You can change 'SCCompressor' to other types like 'LLMLingua', 'LongLLMLingua', etc.
-        compressor = PromptCompressor(type='SCCompressor', device='cpu')  # Use 'cuda' if you have GPU
-        logger.info("✓ Prompt compressor initialized successfully")
+        start_compressor(ModelPool(model_factory(), warmup=MODEL_WARMUP))
+        logger.info(f"✓ Prompt compressor pool starting with {compressor.size} workers")
     except Exception as e:
         logger.error(f"✗ Failed to initialize prompt compressor: {e}")
         compressor = None
+        batcher = None
+        windowed = None
+
+def preload(workers=1):
+    """
+    Load everything shared by the web workers once, in the pre-fork master:
+    tokenizers and the warmed-up model, which runs on each of the workers'
+    share of the cores
+    """
+    global preloaded
+    tokenizer_registry.preload()
+    if COMPRESSION_AVAILABLE:
+        try:
+            preloaded = LocalModel(model_factory(), warmup=MODEL_WARMUP, threads=cores_per_worker(workers))
+            logger.info(f"✓ Prompt compressor preloaded in {preloaded.load_seconds}s")
+        except Exception as e:
+            logger.error(f"✗ Failed to preload prompt compressor: {e}")
+
+def post_fork(workers):
+    """Start serving the preloaded model in a forked web worker"""
+    if preloaded is not None:
+        start_compressor(preloaded)
+
+def model_ready():
+    """True once a model worker has warmed up and can take requests"""
+    return compressor is not None and compressor.is_ready()
+
+def model_state():
+    """'ready', 'loading', 'failed', or 'unavailable' when no model is installed"""
+    return compressor.state() if compressor else 'unavailable'
+
+def model_compress(text, ratio, deadline=None):
+    """
+    Compress text on the model workers; with Selective Context, its windows
+    are batched with concurrent requests and their scores cached
+    Raises DeadlineExceeded when no result arrives before deadline
+    """
+    if windowed:
+        # Windows still waiting for their batch are dropped from it
+        return windowed.compress(text, ratio, deadline)
+    return run_with_deadline(compressor.call, deadline, 'compressgo', text, ratio)
+
+def compressor_version():
+    """Identifies the model compressor in cache keys, so an upgrade invalidates them"""
+    if USE_BATCHED:
+        return f'selective_context/{MODEL_NAME}/{RUNTIME}'
+    return PCTOOLKIT_VERSION
+
+# Shared with other workers and kept across restarts through the disk tier
+result_cache = open_result_cache()
+# Compressed paragraphs of long prompts, so an edit only recompresses its paragraph
+segment_cache = SegmentCache()
+
+# Middle tier, used instead of simple compression while the model is
+# unavailable or too slow for the deadline
+statistical = None
+if STATISTICAL_AVAILABLE:
+    try:
+        statistical = StatisticalScorer()
+        logger.info(f"✓ Statistical scorer loaded from {STAT_TABLE_PATH}")
+    except Exception as e:
+        logger.error(f"✗ Failed to load the statistical scorer: {e}")
 
 message_stats = {'total_messages': 0, 'messages': [], 'start_time': datetime.now().isoformat()}
 
@@ -59,142 +203,323 @@ def count_tokens(text, model="gpt-3.5-turbo"):
         return len(text) // 4
     
     try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(text))
+        return tokenizer_registry.count(text, model)
     except Exception as e:
         logger.warning(f"Token counting failed: {e}, using character estimation")
         return len(text) // 4
 
-def simple_compress(text, ratio=0.3):
+def count_tokens_batch(texts, url=None):
     """
-    Simple fallback compression when PCToolkit is not available
-    Removes common words and shortens text
+    Count tokens for several texts at once, using the token counter for the
+    site the prompt came from (loaded the first time that site is seen)
+    Returns:
+        (list of int in the same order as texts, name of the tokenizer used)
     """
-    if not text or len(text) < 10:
-        return text
-    
-    # Remove common words for basic compression
-    common_words = [
-        'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
-        'from', 'about', 'into', 'through', 'during', 'before', 'after', 'above', 'below', 
-        'up', 'down', 'out', 'off', 'over', 'under', 'again', 'further', 'then', 'once',
-        'very', 'really', 'quite', 'rather', 'pretty', 'much', 'many', 'more', 'most',
-        'please', 'could', 'would', 'should', 'might', 'can', 'will'
-    ]
-    
-    words = text.split()
-    target_word_count = int(len(words) * ratio)
+    try:
+        counter = tokenizer_registry.counter_for_url(url)
+        return counter.count_batch(texts), counter.name
+    except Exception as e:
+        logger.warning(f"Token counting failed: {e}, using character estimation")
+        return [len(text) // 4 for text in texts], 'char_estimate'
+
+def simple_compress_result(text, ratio, url, note, max_tokens=None):
+    """
+    compress_prompt result for the fallback compression, which keeps the
+    most important words that fit in the token budget: the ratio share of
+    tokens removed, or max_tokens. within_budget is False when even the
+    most important word is over it and was kept anyway
+    """
+    counts = lambda texts: count_tokens_batch(texts, url)[0]
+    (original_tokens,), tokenizer = count_tokens_batch([text], url)
+    budget = max_tokens if max_tokens is not None else token_budget(original_tokens, ratio)
+    fallback_compressed, compressed_tokens = compress_to_budget(text, budget, counts)
+    within_budget = compressed_tokens <= budget
+    if not within_budget:
+        logger.info(f"Simple compression kept {compressed_tokens} tokens, over the budget of {budget}")
+    if max_tokens is not None:
+        ratio = round(1 - compressed_tokens / original_tokens, 4) if original_tokens else 0.0
+    original_length = len(text)
+    compressed_length = len(fallback_compressed)
     
-    # Keep important words, remove common ones
-    compressed_words = []
-    important_words = []
+    char_ratio = (original_length - compressed_length) / original_length * 100 if original_length > 0 else 0
+    token_ratio = (original_tokens - compressed_tokens) / original_tokens * 100 if original_tokens > 0 else 0
     
-    for word in words:
-        word_lower = word.lower().strip('.,!?;:"')
-        if word_lower not in common_words or len(compressed_words) < target_word_count:
-            compressed_words.append(word)
-        if word_lower not in common_words:
-            important_words.append(word)
+    return {
+        'original': text,
+        'compressed': fallback_compressed,
+        'compression_ratio': round(char_ratio, 2),
+        'token_compression_ratio': round(token_ratio, 2),
+        'original_length': original_length,
+        'compressed_length': compressed_length,
+        'original_tokens': original_tokens,
+        'compressed_tokens': compressed_tokens,
+        'method': 'simple_fallback',
+        'target_ratio': ratio,
+        'token_budget': budget,
+        'within_budget': within_budget,
+        'success': True,
+        'tiktoken_available': TIKTOKEN_AVAILABLE,
+        'tokenizer': tokenizer,
+        'tier': 'fallback',
+        'abandoned_tiers': [],
+        'note': note
+    }
+
+def model_unavailable_note():
+    if model_state() == 'loading':
+        return 'Compression model is still loading'
+    return 'PCToolkit not available'
+
+def fit_report(result, max_tokens):
+    """Add the token budget, and whether the compressed text is within it"""
+    return dict(result, target_tokens=max_tokens, fits=result['compressed_tokens'] <= max_tokens)
+
+def fallback_result(text, ratio, url, note, max_tokens=None):
+    """
+    compress_prompt result from the best tier below the model: the
+    statistical scorer once its table is built, else simple compression
+    """
+    if statistical is None:
+        return simple_compress_result(text, ratio, url, f'{note}, using simple compression', max_tokens)
+    scored = statistical.scored(text)
+    if max_tokens is not None:
+        compressed, ratio = scored.fit(max_tokens, lambda texts: count_tokens_batch(texts, url)[0])
+    else:
+        compressed = scored.compress(ratio)
+    return dict(scored_result(text, compressed, ratio, url, 'statistical', 'statistical'),
+                note=f'{note}, using statistical compression')
+
+def fallback_method():
+    """Identifies the tier below the model in cache keys"""
+    if statistical is None:
+        return f'simple_fallback/{FALLBACK_VERSION}'
+    table = os.stat(statistical.path)
+    return f'statistical/{os.path.basename(statistical.path)}/{table.st_size}/{int(table.st_mtime)}'
+
+def scored_result(text, compressed_result, ratio, url, method=MODEL_METHOD, tier='model'):
+    """compress_prompt result for text compressed by the model, or the statistical scorer"""
+    # Calculate compression statistics
+    original_length = len(text)
+    compressed_length = len(compressed_result)
+    (original_tokens, compressed_tokens), tokenizer = count_tokens_batch([text, compressed_result], url)
     
-    # If we still have too many words, take the most important ones
-    if len(compressed_words) > target_word_count and important_words:
-        compressed_words = important_words[:target_word_count]
+    char_ratio = (original_length - compressed_length) / original_length * 100
+    token_ratio = (original_tokens - compressed_tokens) / original_tokens * 100 if original_tokens > 0 else 0
     
-    return ' '.join(compressed_words) if compressed_words else text
+    return {
+        'original': text,
+        'compressed': compressed_result,
+        'compression_ratio': round(char_ratio, 2),
+        'token_compression_ratio': round(token_ratio, 2),
+        'original_length': original_length,
+        'compressed_length': compressed_length,
+        'original_tokens': original_tokens,
+        'compressed_tokens': compressed_tokens,
+        'method': method,
+        'target_ratio': ratio,
+        'success': True,
+        'tiktoken_available': TIKTOKEN_AVAILABLE,
+        'tokenizer': tokenizer,
+        'tier': tier,
+        'abandoned_tiers': []
+    }
+
+def failed_result(text, ratio, url, error):
+    """compress_prompt result returning text unchanged after the model failed"""
+    (original_tokens,), tokenizer = count_tokens_batch([text], url)
+    return {
+        'original': text,
+        'compressed': text,
+        'compression_ratio': 0,
+        'token_compression_ratio': 0,
+        'original_length': len(text),
+        'compressed_length': len(text),
+        'original_tokens': original_tokens,
+        'compressed_tokens': original_tokens,
+        'method': 'failed',
+        'target_ratio': ratio,
+        'success': False,
+        'tiktoken_available': TIKTOKEN_AVAILABLE,
+        'tokenizer': tokenizer,
+        'tier': 'none',
+        'abandoned_tiers': [],
+        'error': str(error),
+        # Model workers were all busy; the client may retry later
+        'retryable': isinstance(error, PoolBusy)
+    }
 
-def compress_prompt(text, ratio=0.3):
+def model_compress_variants(text, ratios, deadline=None):
+    """Compress text to each of ratios; Selective Context scores it only once"""
+    if windowed:
+        scored = ScoredText(text, *windowed.score(text, deadline))
+        return [scored.compress(ratio) for ratio in ratios]
+    return [model_compress(text, ratio, deadline) for ratio in ratios]
+
+def model_compress_to_fit(text, max_tokens, url, deadline=None):
+    """
+    Compress text just enough to fit in max_tokens, counted for the site at url
+    Returns:
+        (compressed text, share of the text dropped)
+    """
+    if windowed:
+        # Least informative units are dropped one by one, each taking its
+        # token count off the total, until the text fits
+        scored = ScoredText(text, *windowed.score(text, deadline))
+        return scored.fit(max_tokens, lambda texts: count_tokens_batch(texts, url)[0])
+    # PCToolkit compresses to a ratio, so aim for the share of tokens that fits
+    (original_tokens,), _ = count_tokens_batch([text], url)
+    ratio = max(0.0, 1 - max_tokens / original_tokens) if original_tokens else 0.0
+    return (model_compress(text, ratio, deadline) if ratio else text), ratio
+
+def compress_prompt(text, ratio=0.3, url=None, use_model=None, deadline=None, max_tokens=None):
     """
     Compress a prompt using PCToolkit
     Args:
         text: Original prompt text
-        ratio: Compression ratio (0.3 means compress to 30% of original length)
+        ratio: Share of the prompt to remove (0.3 removes about 30%)
+        url: Page the prompt came from, selects how tokens are counted
+        use_model: run the model tier; by default whenever a worker is ready
+        deadline: Deadline after which the simple compression is returned
+            instead of waiting for the model
+        max_tokens: compress just enough to fit in this many tokens instead
+            of by ratio; target_ratio then reports the share dropped
     Returns:
         dict with original, compressed text, and compression stats
     """
-    if not compressor:
-        # Simple fallback compression using basic text shortening
-        fallback_compressed = simple_compress(text, ratio)
-        original_length = len(text)
-        compressed_length = len(fallback_compressed)
-        original_tokens = count_tokens(text)
-        compressed_tokens = count_tokens(fallback_compressed)
-        
-        char_ratio = (original_length - compressed_length) / original_length * 100 if original_length > 0 else 0
-        token_ratio = (original_tokens - compressed_tokens) / original_tokens * 100 if original_tokens > 0 else 0
-        
-        return {
-            'original': text,
-            'compressed': fallback_compressed,
-            'compression_ratio': round(char_ratio, 2),
-            'token_compression_ratio': round(token_ratio, 2),
-            'original_length': original_length,
-            'compressed_length': compressed_length,
-            'original_tokens': original_tokens,
-            'compressed_tokens': compressed_tokens,
-            'method': 'simple_fallback',
-            'target_ratio': ratio,
-            'success': True,
-            'tiktoken_available': TIKTOKEN_AVAILABLE,
-            'note': 'PCToolkit not available, using simple compression'
-        }
+    if use_model is None:
+        use_model = model_ready()
+    if not use_model:
+        result = fallback_result(text, ratio, url, model_unavailable_note(), max_tokens)
+        return fit_report(result, max_tokens) if max_tokens is not None else result
     
     try:
-        # Compress the prompt
-        compressed_result = compressor.compressgo(text, ratio)
-        
-        # Calculate compression statistics
-        original_length = len(text)
-        compressed_length = len(compressed_result)
-        original_tokens = count_tokens(text)
-        compressed_tokens = count_tokens(compressed_result)
-        
-        char_ratio = (original_length - compressed_length) / original_length * 100
-        token_ratio = (original_tokens - compressed_tokens) / original_tokens * 100 if original_tokens > 0 else 0
-        
-        return {
-            'original': text,
-            'compressed': compressed_result,
-            'compression_ratio': round(char_ratio, 2),
-            'token_compression_ratio': round(token_ratio, 2),
-            'original_length': original_length,
-            'compressed_length': compressed_length,
-            'original_tokens': original_tokens,
-            'compressed_tokens': compressed_tokens,
-            'method': 'SCCompressor',
-            'target_ratio': ratio,
-            'success': True,
-            'tiktoken_available': TIKTOKEN_AVAILABLE
-        }
+        # Compress the prompt; long ones paragraph by paragraph with PCToolkit,
+        # spread over the model workers
+        if max_tokens is not None:
+            compressed_result, ratio = model_compress_to_fit(text, max_tokens, url, deadline)
+        elif not windowed and len(text) >= MIN_SEGMENTED_LENGTH:
+            compressed_result = compress_segments(
+                lambda paragraph: model_compress(paragraph, ratio, deadline), text,
+                segment_cache, (MODEL_METHOD, compressor_version(), ratio), compressor.size
+            )
+        else:
+            compressed_result = model_compress(text, ratio, deadline)
+        result = scored_result(text, compressed_result, ratio, url)
+    except DeadlineExceeded as e:
+        logger.info(f"Model compression abandoned: {e}")
+        result = fallback_result(text, ratio, url, 'Compression model missed the deadline', max_tokens)
+        result['abandoned_tiers'] = ['model']
     except Exception as e:
         logger.error(f"Compression failed: {e}")
-        original_tokens = count_tokens(text)
-        return {
-            'original': text,
-            'compressed': text,
-            'compression_ratio': 0,
-            'token_compression_ratio': 0,
-            'original_length': len(text),
-            'compressed_length': len(text),
-            'original_tokens': original_tokens,
-            'compressed_tokens': original_tokens,
-            'method': 'failed',
-            'target_ratio': ratio,
-            'success': False,
-            'tiktoken_available': TIKTOKEN_AVAILABLE,
-            'error': str(e)
-        }
+        result = failed_result(text, ratio, url, e)
+    return fit_report(result, max_tokens) if max_tokens is not None else result
+
+def compress_prompt_variants(text, ratios, url=None, use_model=None, deadline=None):
+    """
+    Compress a prompt to each of several ratios, scoring it with the model once
+    Returns:
+        list of compress_prompt results, in the order of ratios
+    """
+    if use_model is None:
+        use_model = model_ready()
+    if not use_model:
+        return [fallback_result(text, ratio, url, model_unavailable_note()) for ratio in ratios]
+    
+    try:
+        compressed = model_compress_variants(text, ratios, deadline)
+        return [scored_result(text, variant, ratio, url) for variant, ratio in zip(compressed, ratios)]
+    except DeadlineExceeded as e:
+        logger.info(f"Model compression abandoned: {e}")
+        note = 'Compression model missed the deadline'
+        return [dict(fallback_result(text, ratio, url, note), abandoned_tiers=['model']) for ratio in ratios]
+    except Exception as e:
+        logger.error(f"Compression failed: {e}")
+        return [failed_result(text, ratio, url, e) for ratio in ratios]
+
+def result_cache_key(text, target, url, use_model):
+    """Result cache key for compressing text to target, a ratio or ('max_tokens', n)"""
+    try:
+        tokenizer = tokenizer_registry.counter_for_url(url).name
+    except Exception:
+        tokenizer = 'char_estimate'
+    # A new compressor release invalidates results cached on disk, and
+    # results from before the model was ready are not served once it is
+    method = f'{MODEL_METHOD}/{compressor_version()}' if use_model else fallback_method()
+    return cache_key(text, target, method, tokenizer)
+
+def cacheable_result(result):
+    """Failed compressions, and fallbacks for a model that missed the deadline, are retried"""
+    return result['success'] and not result['abandoned_tiers']
+
+def cached_compress_prompt(text, ratio=0.3, url=None, use_cache=True, deadline=None, max_tokens=None):
+    """
+    compress_prompt through the result cache, within an optional Deadline
+    Returns:
+        (compress_prompt result, cache status: 'hit', 'miss', 'coalesced' or 'bypass');
+        the result reports the tier that produced it and the budget used
+    """
+    deadline = deadline or Deadline()
+    use_model = model_ready()
+    key = result_cache_key(text, ratio if max_tokens is None else ('max_tokens', max_tokens), url, use_model)
+    result, cache_status = result_cache.get_or_compute(
+        key, lambda: compress_prompt(text, ratio, url, use_model, deadline, max_tokens), use_cache,
+        cacheable=cacheable_result, wait=deadline.remaining()
+    )
+    tier = 'cache' if cache_status == 'hit' else result['tier']
+    return dict(result, **deadline.report(tier, result['abandoned_tiers'])), cache_status
+
+def cached_compress_variants(text, ratios, url=None, use_cache=True, deadline=None):
+    """
+    cached_compress_prompt for several ratios; those not cached yet are
+    compressed together from one scoring pass, and cached one by one
+    Returns:
+        (list of results, list of cache statuses), in the order of ratios
+    """
+    deadline = deadline or Deadline()
+    use_model = model_ready()
+    keys = [result_cache_key(text, ratio, url, use_model) for ratio in ratios]
+    results = [result_cache.get(key) if use_cache else None for key in keys]
+    missing = [index for index, result in enumerate(results) if result is None]
+    if missing:
+        computed = compress_prompt_variants(text, [ratios[index] for index in missing], url, use_model, deadline)
+        for index, result in zip(missing, computed):
+            results[index] = result
+            if use_cache and cacheable_result(result):
+                result_cache.put(keys[index], result)
+    statuses = ['bypass' if not use_cache else 'miss' if index in missing else 'hit' for index in range(len(ratios))]
+    return [
+        dict(result, **deadline.report('cache' if status == 'hit' else result['tier'], result['abandoned_tiers']))
+        for result, status in zip(results, statuses)
+    ], statuses
+
+def json_response(body, status=200, headers=None):
+    """Flask response for a (body, status, headers) triple of the handlers below"""
+    response = jsonify(body)
+    response.status_code = status
+    response.headers.update(headers or {})
+    return response
 
 @app.route('/log-message', methods=['POST'])
 def log_message():
+    return json_response(*log_message_response(request.get_json(silent=True), request.headers))
+
+def log_message_response(data, headers, deadline=None):
+    """
+    Log and compress a message from the extension
+    Returns:
+        (JSON body, status code, response headers)
+    """
     try:
-        data = request.get_json()
         if not data or 'message' not in data:
-            return jsonify({'error': 'No message provided'}), 400
+            return {'error': 'No message provided'}, 400, {}
         
         message = data['message']
         url = data.get('url', 'unknown')
         timestamp = datetime.now().isoformat()
         compression_ratio = data.get('compression_ratio', 0.3)  # Default compression ratio
+        max_tokens, error = parse_max_tokens(data)
+        if error:
+            return {'error': error}, 400, {}
         
         # Extract the original user prompt if the message contains both original and modified
         user_prompt = message
@@ -212,7 +537,10 @@ def log_message():
         logger.info(f'⏰ Timestamp: {timestamp}')
         
         # Perform prompt compression
-        compression_result = compress_prompt(user_prompt, compression_ratio)
+        compression_result, cache_status = cached_compress_prompt(
+            user_prompt, compression_ratio, url, not bypass_requested(headers),
+            deadline or deadline_for_request(headers, url), max_tokens
+        )
         
         # Console log the compression results
         print("\n" + "="*80)
@@ -224,6 +552,9 @@ def log_message():
         print(f"📦 Compressed Length: {compression_result['compressed_length']} chars")
         print(f"📊 Compression Ratio: {compression_result['compression_ratio']}%")
         print(f"🔧 Method: {compression_result['method']}")
+        print(f"💾 Cache: {cache_status}")
+        print(f"⏱️ Tier: {compression_result['tier']} in {compression_result['elapsed_ms']} ms "
+              f"of {compression_result['deadline_ms']} ms")
         print()
         print("📝 ORIGINAL PROMPT:")
         print("-" * 40)
@@ -258,63 +589,240 @@ def log_message():
         if len(message_stats['messages']) > 100:
             message_stats['messages'] = message_stats['messages'][-100:]
         
-        return jsonify({
+        return {
             'status': 'success', 
             'message': 'Message logged and compressed successfully', 
             'timestamp': timestamp, 
             'message_length': len(message),
             'compression': compression_result
-        })
+        }, 200, {CACHE_HEADER: cache_status}
         
     except Exception as e:
         logger.error(f'Error logging message: {e}')
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500, {}
 
 @app.route('/messages', methods=['GET'])
 def get_messages():
-    return jsonify({'stats': message_stats, 'recent_messages': message_stats['messages'][-10:]})
+    return jsonify(messages_report())
+
+def messages_report():
+    return {'stats': message_stats, 'recent_messages': message_stats['messages'][-10:]}
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({
+    """Liveness: answers as soon as the server is up, while the model may still load"""
+    return jsonify(health_report())
+
+def health_report():
+    return {
         'status': 'healthy', 
         'service': 'ChatGPT Message Logger with Prompt Compression', 
         'total_messages': message_stats['total_messages'],
         'compression_available': COMPRESSION_AVAILABLE,
         'compressor_initialized': compressor is not None,
-        'compression_method': 'SCCompressor' if compressor else 'none'
-    })
+        'compression_method': MODEL_METHOD if compressor else 'none',
+        'model_runtime': RUNTIME if USE_BATCHED else None,
+        'model_state': model_state(),
+        'model_pool': compressor.stats() if compressor else None,
+        'batcher': batcher.stats() if batcher else None,
+        'windowed': windowed.stats() if windowed else None,
+        'statistical_table': statistical.path if statistical else None,
+        'tokenizer': tokenizer_registry.stats(),
+        'result_cache': result_cache.stats(),
+        'segment_cache': segment_cache.stats()
+    }
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 once a model worker is warmed up or no model is installed, 503 before"""
+    return json_response(*readiness_response())
+
+def readiness_response():
+    state = model_state()
+    ready = state in ('ready', 'unavailable')
+    return {
+        'ready': ready,
+        'state': state,
+        'model_pool': compressor.stats() if compressor else None
+    }, 200 if ready else 503, {}
+
+def parse_max_tokens(data):
+    """(max_tokens from the request body or None, error message or None)"""
+    max_tokens = data.get('max_tokens')
+    if max_tokens is None:
+        return None, None
+    if isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1:
+        return None, 'max_tokens must be a positive integer'
+    return max_tokens, None
 
 @app.route('/compress', methods=['POST'])
 def compress_endpoint():
     """Test endpoint for prompt compression"""
+    return json_response(*compress_response(request.get_json(silent=True), request.headers))
+
+def compress_response(data, headers, deadline=None):
+    """(JSON body, status code, response headers) for POST /compress"""
     try:
-        data = request.get_json()
         if not data or 'text' not in data:
-            return jsonify({'error': 'No text provided'}), 400
+            return {'error': 'No text provided'}, 400, {}
         
         text = data['text']
         ratio = data.get('ratio', 0.3)
+        max_tokens, error = parse_max_tokens(data)
+        if error:
+            return {'error': error}, 400, {}
+        deadline = deadline or deadline_for_request(headers, data.get('url'))
+        if 'ratios' in data:
+            return compress_variants_response(text, data, headers, deadline)
         
-        result = compress_prompt(text, ratio)
+        result, cache_status = cached_compress_prompt(
+            text, ratio, data.get('url'), not bypass_requested(headers), deadline, max_tokens
+        )
         
         # Console log the compression test
         print(f"\n🧪 COMPRESSION TEST:")
         print(f"Original: {result['original']}")
         print(f"Compressed: {result['compressed']}")
         print(f"Ratio: {result['compression_ratio']}%")
+        if max_tokens is not None:
+            print(f"Tokens: {result['compressed_tokens']} of {max_tokens} allowed")
+        print(f"Cache: {cache_status}")
         
-        return jsonify(result)
+        if result.get('retryable'):
+            return result, 503, {CACHE_HEADER: cache_status, 'Retry-After': '1'}
+        return result, 200, {CACHE_HEADER: cache_status}
         
     except Exception as e:
         logger.error(f'Error in compression test: {e}')
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500, {}
+
+def compress_variants_response(text, data, headers, deadline):
+    """/compress response with one compressed variant per ratio in data['ratios']"""
+    ratios = data['ratios']
+    if (not isinstance(ratios, list) or not 0 < len(ratios) <= MAX_VARIANTS
+            or not all(isinstance(ratio, (int, float)) and not isinstance(ratio, bool) for ratio in ratios)):
+        return {'error': f'ratios must be a list of 1 to {MAX_VARIANTS} numbers'}, 400, {}
+    
+    results, statuses = cached_compress_variants(
+        text, ratios, data.get('url'), not bypass_requested(headers), deadline
+    )
+    print(f"\n🧪 COMPRESSION TEST: {len(ratios)} variants")
+    for result, status in zip(results, statuses):
+        print(f"Ratio {result['target_ratio']}: {result['compression_ratio']}% ({status})")
+    
+    # The original text is sent once rather than with every variant
+    body = {
+        'original': text,
+        'variants': [{k: v for k, v in result.items() if k != 'original'} for result in results]
+    }
+    response_headers = {CACHE_HEADER: statuses[0] if len(set(statuses)) == 1 else 'miss'}
+    if any(result.get('retryable') for result in results):
+        return body, 503, dict(response_headers, **{'Retry-After': '1'})
+    return body, 200, response_headers
+
+def batch_item_result(item, deadline, use_cache=True):
+    """cached_compress_prompt result for one /compress/batch item"""
+    ratio = item.get('ratio', 0.3)
+    if isinstance(ratio, bool) or not isinstance(ratio, (int, float)):
+        raise BatchItemError('ratio must be a number')
+    max_tokens, error = parse_max_tokens(item)
+    if error:
+        raise BatchItemError(error)
+    result, cache_status = cached_compress_prompt(
+        item['text'], ratio, item.get('url'), use_cache, deadline, max_tokens
+    )
+    return dict(result, cache=cache_status)
+
+def count_batch_items(items):
+    """Token-count a chunk of batch items together, per site, so their own counts are cached"""
+    texts_by_url = {}
+    for item in items:
+        texts_by_url.setdefault(item.get('url'), []).append(item['text'])
+    for url, texts in texts_by_url.items():
+        count_tokens_batch(texts, url)
+
+def batch_run(items, args, headers):
+    """
+    BatchRun of /compress/batch items with the request's options
+    Returns:
+        (BatchRun, None), or (None, error message) for a bad option
+    """
+    try:
+        concurrency = int(args.get('concurrency', MAX_CONCURRENCY))
+    except ValueError:
+        return None, 'concurrency must be an integer'
+    if concurrency < 1:
+        return None, 'concurrency must be at least 1'
+    # Batch jobs are not interactive: items wait for the model unless a budget is sent
+    budget_ms = requested_budget_ms(headers)
+    use_cache = not bypass_requested(headers)
+    run = BatchRun(
+        items, lambda item, deadline: batch_item_result(item, deadline, use_cache),
+        count_batch_items, concurrency, budget_ms
+    )
+    return run, None
+
+@app.route('/compress/batch', methods=['POST'])
+def compress_batch_endpoint():
+    """
+    Compress a JSON array or NDJSON stream of {id, text, ratio} items,
+    streaming one NDJSON line per item as soon as it is done
+    """
+    if request.mimetype == 'application/json':
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            return jsonify({'error': 'Expected a JSON array of items, or NDJSON'}), 400
+        items = array_items(data)
+    else:
+        # Read line by line while earlier items are compressed
+        items = ndjson_items(request.stream)
+    run, error = batch_run(items, request.args, request.headers)
+    if error:
+        return jsonify({'error': error}), 400
+    return Response(stream_with_context(with_error_event(iter(run))), mimetype='application/x-ndjson')
+
+def stream_run(chunks, args, headers):
+    """
+    StreamRun of a /compress/stream body with the request's options, from
+    its query string and headers
+    Returns:
+        (StreamRun, True for server-sent events, None), or (None, None, error message)
+    """
+    try:
+        ratio = float(args.get('ratio', 0.3))
+    except ValueError:
+        return None, None, 'ratio must be a number'
+    url = args.get('url')
+    use_cache = not bypass_requested(headers)
+    sse = args.get('format') == 'sse' or 'text/event-stream' in headers.get('Accept', '')
+
+    def compress_segment(segment, deadline):
+        result, cache_status = cached_compress_prompt(segment, ratio, url, use_cache, deadline)
+        return dict(result, cache=cache_status)
+
+    # Each segment gets the request's budget, counted from when it is queued
+    return StreamRun(chunks, compress_segment, lambda: deadline_for_request(headers, url)), sse, None
+
+@app.route('/compress/stream', methods=['POST'])
+def compress_stream_endpoint():
+    """
+    Compress a raw, possibly chunked text body segment by segment, streaming
+    the compressed segments as NDJSON, or as server-sent events with ?format=sse
+    """
+    run, sse, error = stream_run(read_chunks(request.stream), request.args, request.headers)
+    if error:
+        return jsonify({'error': error}), 400
+    return Response(stream_with_context(with_error_event(stream_events(run, sse), sse)),
+                    mimetype='text/event-stream' if sse else 'application/x-ndjson')
+
+SERVICE_INFO = {'service': 'ChatGPT Message Logger', 'version': '1.0.0'}
 
 @app.route('/', methods=['GET'])
 def index():
-    return jsonify({'service': 'ChatGPT Message Logger', 'version': '1.0.0'})
+    return jsonify(SERVICE_INFO)
 
 if __name__ == '__main__':
     logger.info('🚀 Starting ChatGPT Message Logger Service...')
     logger.info('📡 Service will run on http://localhost:8002')
-    app.run(host='0.0.0.0', port=8002, debug=True)
+    logger.info('For production, serve with: python3 serve.py message_logger --workers 4')
+    app.run(host='0.0.0.0', port=8002, debug=False)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Dynamic micro-batching in front of the model pool
+
+Concurrent compression requests each wait a few milliseconds so that
+their scoring can run as one padded batch: a batch is sent as soon as it
+holds max_batch items or its oldest item has waited max_wait_ms. While
+every dispatch slot is busy, requests keep queueing, so batches grow with
+load and stay small when the service is idle. A burst that arrives while
+several slots are free, such as the windows of one long prompt, is split
+evenly across them instead of filling one batch at a time.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+from model_pool import PoolBusy
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = int(os.environ.get('SEQUOIA_BATCH_MAX_SIZE', 8))
+MAX_WAIT_MS = float(os.environ.get('SEQUOIA_BATCH_MAX_WAIT_MS', 10))
+# Queueing delays kept for the percentiles in stats()
+DELAY_SAMPLES = 1024
+
+
+class MicroBatcher:
+    """Groups submitted items into batches for run_batch"""
+
+    def __init__(self, run_batch, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS,
+                 concurrency=1, max_pending=None):
+        """
+        Args:
+            run_batch: called with a list of items, returns their results
+                in the same order; an exception fails every item in the batch
+            max_batch: most items in one batch
+            max_wait_ms: longest an item waits for others to join its batch
+            concurrency: batches allowed to run at the same time, e.g. the
+                number of model workers
+            max_pending: queued items past which submit() raises PoolBusy
+        """
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._slots = threading.Semaphore(concurrency)
+        self._closed = False
+        self._running = 0
+        self.batches = 0
+        self.items = 0
+        self.full_batches = 0
+        self.failed_batches = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.batch_sizes = Counter()
+        self._delays = deque(maxlen=DELAY_SAMPLES)
+        threading.Thread(target=self._collect, name='micro-batcher', daemon=True).start()
+
+    def submit(self, item):
+        """Queue item and return a Future for its result; cancel() drops it while still queued"""
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("batcher is closed")
+            if self.max_pending is not None and len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                raise PoolBusy(f"{len(self._pending)} requests are already waiting for a batch")
+            self._pending.append((item, future, time.monotonic()))
+            self._condition.notify()
+        return future
+
+    def call(self, item):
+        """Submit item and wait for its result"""
+        return self.submit(item).result()
+
+    def _collect(self):
+        # Queued items already shared out between free slots, and each one's share
+        shared = 0
+        share = self.max_batch
+        while True:
+            # Waiting for a slot first lets the next batch fill up meanwhile
+            self._slots.acquire()
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    self._slots.release()
+                    return
+                if shared <= 0:
+                    deadline = self._pending[0][2] + self.max_wait
+                    while len(self._pending) < self.max_batch and not self._closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    # Queued items are split evenly between the slots that are free now
+                    free = max(1, self.concurrency - self._running)
+                    share = min(self.max_batch, -(-len(self._pending) // free))
+                    shared = min(len(self._pending), free * share)
+                batch = []
+                while self._pending and shared > 0 and len(batch) < share:
+                    entry = self._pending.popleft()
+                    shared -= 1
+                    # Callers that gave up before their batch left are skipped
+                    if entry[1].set_running_or_notify_cancel():
+                        batch.append(entry)
+                    else:
+                        self.cancelled += 1
+                if not self._pending:
+                    shared = 0
+                if batch:
+                    self._running += 1
+            if not batch:
+                self._slots.release()
+                continue
+            threading.Thread(target=self._dispatch, args=(batch,), name='micro-batch', daemon=True).start()
+
+    def _dispatch(self, batch):
+        started = time.monotonic()
+        try:
+            results = self.run_batch([item for item, _, _ in batch])
+            error = None
+        except Exception as e:
+            results = None
+            error = e
+        finally:
+            with self._condition:
+                self._running -= 1
+            self._slots.release()
+
+        with self._condition:
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            if len(batch) == self.max_batch:
+                self.full_batches += 1
+            if error is not None:
+                self.failed_batches += 1
+            self._delays.extend(started - queued for _, _, queued in batch)
+
+        for index, (_, future, _) in enumerate(batch):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[index])
+
+    def close(self):
+        """Stop taking items; queued items are still run"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            delays = sorted(self._delays)
+            pending = len(self._pending)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            batches = self.batches
+            items = self.items
+            full_batches = self.full_batches
+            failed_batches = self.failed_batches
+            rejected = self.rejected
+            cancelled = self.cancelled
+
+        def delay_ms(q):
+            return round(delays[min(len(delays) - 1, int(len(delays) * q))] * 1000, 2) if delays else 0.0
+
+        return {
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+            'concurrency': self.concurrency,
+            'pending': pending,
+            'batches': batches,
+            'items': items,
+            'full_batches': full_batches,
+            'failed_batches': failed_batches,
+            'rejected': rejected,
+            'cancelled': cancelled,
+            'mean_batch_size': round(items / batches, 2) if batches else 0.0,
+            'batch_sizes': batch_sizes,
+            'queue_delay_ms': {
+                'mean': round(sum(delays) / len(delays) * 1000, 2) if delays else 0.0,
+                'p50': delay_ms(0.5),
+                'p95': delay_ms(0.95),
+                'max': delay_ms(1.0),
+            },
+        }
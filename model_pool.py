@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Pool of worker processes that each hold a preloaded compression model
+
+Model forward passes run in the workers instead of on the Flask request
+threads, so a slow prompt never stalls other users. A bounded number of
+requests may wait for a free worker; past that, calls fail fast with
+PoolBusy so the HTTP layer can shed load. A call that runs past its
+timeout kills its worker, which is then replaced in the background.
+
+A worker only takes calls after its model has loaded and run a warm-up
+call, so callers can check is_ready() and use a cheaper path meanwhile.
+
+Each worker limits torch to its share of the CPU cores, so N workers do
+not each start one thread per core and oversubscribe the machine.
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CPU_COUNT = os.cpu_count() or 1
+POOL_WORKERS = int(os.environ.get('SEQUOIA_MODEL_WORKERS', max(1, CPU_COUNT // 2)))
+# Requests allowed to wait for a worker before new ones are rejected
+POOL_QUEUE_SIZE = int(os.environ.get('SEQUOIA_MODEL_QUEUE', 16))
+POOL_TIMEOUT = float(os.environ.get('SEQUOIA_MODEL_TIMEOUT', 30))
+QUEUE_TIMEOUT = float(os.environ.get('SEQUOIA_MODEL_QUEUE_TIMEOUT', 10))
+STARTUP_TIMEOUT = float(os.environ.get('SEQUOIA_MODEL_STARTUP_TIMEOUT', 300))
+
+
+class PoolError(RuntimeError):
+    """Base class for model pool failures"""
+
+
+class PoolBusy(PoolError):
+    """Every worker is busy and the wait queue is full"""
+
+
+class PoolTimeout(PoolError):
+    """A call ran past its timeout; its worker was restarted"""
+
+
+class PoolUnavailable(PoolError):
+    """No worker could be started"""
+
+
+def load_prompt_compressor(compressor_type='SCCompressor', device='cpu'):
+    """Factory for PCToolkit compressors, imported inside the worker process"""
+    from pctoolkit.compressors import PromptCompressor
+    return PromptCompressor(type=compressor_type, device=device)
+
+
+def cores_per_worker(workers):
+    """Each of workers processes' share of the cores"""
+    return max(1, CPU_COUNT // workers)
+
+
+def limit_threads(threads):
+    """Size the math libraries' thread pools before the model is imported or run"""
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already set once torch has started running work
+        pass
+
+
+def _worker_main(factory, connection, threads, warmup):
+    limit_threads(threads)
+    started = time.monotonic()
+    try:
+        model = factory()
+        loaded = time.monotonic()
+        if warmup is not None:
+            method, args = warmup
+            getattr(model, method)(*args)
+    except Exception as e:
+        connection.send(('error', f"{type(e).__name__}: {e}"))
+        return
+    connection.send(('ready', {
+        'load_seconds': round(loaded - started, 3),
+        'warmup_seconds': round(time.monotonic() - loaded, 3),
+    }))
+
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        method, args, kwargs = message
+        try:
+            connection.send(('ok', getattr(model, method)(*args, **kwargs)))
+        except Exception as e:
+            connection.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, context, factory, threads, warmup):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(factory, child_connection, threads, warmup), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    def wait_ready(self, timeout):
+        if not self.connection.poll(timeout):
+            raise PoolUnavailable(f"worker did not start within {timeout}s")
+        status, value = self.connection.recv()
+        if status != 'ready':
+            raise PoolUnavailable(value)
+        return value
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.connection.send(None)
+            except (OSError, ValueError):
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class ModelPool:
+    """Runs model methods in a pool of preloaded worker processes"""
+
+    def __init__(self, factory, workers=POOL_WORKERS, queue_size=POOL_QUEUE_SIZE,
+                 timeout=POOL_TIMEOUT, queue_timeout=QUEUE_TIMEOUT, threads_per_worker=None,
+                 warmup=None):
+        """
+        Args:
+            factory: picklable, importable callable building the model in
+                each worker (a module-level function, not a lambda)
+            workers: number of worker processes
+            queue_size: calls allowed to wait for a free worker
+            timeout: seconds a single call may run before its worker is killed
+            queue_timeout: seconds a call may wait for a free worker
+            threads_per_worker: torch threads per worker, by default the
+                cores divided evenly between the workers
+            warmup: (method, args) called on each new model before its
+                worker takes calls
+        """
+        self.factory = factory
+        self.size = workers
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.threads = threads_per_worker or cores_per_worker(workers)
+        self.warmup = warmup
+        # Spawned workers start clean instead of inheriting Flask's threads
+        self._context = multiprocessing.get_context('spawn')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.starting = 0
+        self.ready = 0
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.start_errors = 0
+        self.last_start_error = None
+        self.last_startup = None
+        for _ in range(workers):
+            self._start_worker()
+
+    def _start_worker(self):
+        """Start a worker and add it to the idle queue once its model has loaded"""
+        with self._lock:
+            if self._closed:
+                return
+            self.starting += 1
+
+        def start():
+            worker = None
+            try:
+                worker = _Worker(self._context, self.factory, self.threads, self.warmup)
+                startup = worker.wait_ready(STARTUP_TIMEOUT)
+            except Exception as e:
+                logger.error(f"✗ Model worker failed to start: {e}")
+                if worker is not None:
+                    worker.stop(kill=True)
+                with self._lock:
+                    self.starting -= 1
+                    self.start_errors += 1
+                    self.last_start_error = str(e)
+                return
+            with self._lock:
+                self.starting -= 1
+                self.ready += 1
+                self.last_startup = startup
+                closed = self._closed
+            if closed:
+                worker.stop()
+                return
+            self._idle.put(worker)
+            logger.info(f"✓ Model worker {worker.process.pid} ready")
+
+        threading.Thread(target=start, name='model-pool-start', daemon=True).start()
+
+    def _retire(self, worker):
+        """Kill a stuck or crashed worker and start a replacement"""
+        with self._lock:
+            self.ready -= 1
+            self.restarts += 1
+        worker.stop(kill=True)
+        self._start_worker()
+
+    def is_ready(self):
+        """True once at least one worker has loaded and warmed up its model"""
+        with self._lock:
+            return self.ready > 0
+
+    def state(self):
+        """'ready', 'loading' while workers start, or 'failed' when none could start"""
+        with self._lock:
+            if self.ready:
+                return 'ready'
+            return 'loading' if self.starting else 'failed'
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call method on a worker's model and return its result
+
+        Raises:
+            PoolBusy: too many calls are already waiting
+            PoolTimeout: the call ran past the pool timeout
+            PoolUnavailable: no worker is running
+            PoolError: the model raised; the message names its exception
+        """
+        with self._lock:
+            if not self.ready and not self.starting:
+                raise PoolUnavailable("no model worker is running")
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolBusy(f"all {self.size} model workers are busy and the queue is full")
+        try:
+            try:
+                worker = self._idle.get(timeout=self.queue_timeout)
+            except queue.Empty:
+                with self._lock:
+                    self.rejected += 1
+                raise PoolBusy(f"no model worker became free within {self.queue_timeout}s")
+            return self._run(worker, method, args, kwargs)
+        finally:
+            self._slots.release()
+
+    def _run(self, worker, method, args, kwargs):
+        with self._lock:
+            self.busy += 1
+        started = time.monotonic()
+        try:
+            worker.connection.send((method, args, kwargs))
+            if not worker.connection.poll(self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                logger.warning(f"Model call {method} timed out after {self.timeout}s, "
+                               f"restarting worker {worker.process.pid}")
+                self._retire(worker)
+                raise PoolTimeout(f"{method} took longer than {self.timeout}s")
+            status, value = worker.connection.recv()
+        except (EOFError, OSError) as e:
+            logger.error(f"Model worker {worker.process.pid} died: {e}")
+            with self._lock:
+                self.failed += 1
+            self._retire(worker)
+            raise PoolError(f"model worker died during {method}") from e
+        finally:
+            with self._lock:
+                self.busy -= 1
+
+        with self._lock:
+            closed = self._closed
+        if closed:
+            worker.stop()
+        else:
+            self._idle.put(worker)
+        with self._lock:
+            if status == 'ok':
+                self.completed += 1
+            else:
+                self.failed += 1
+        if status != 'ok':
+            raise PoolError(value)
+        logger.debug(f"Model call {method} took {time.monotonic() - started:.3f}s")
+        return value
+
+    def close(self):
+        """Stop every idle worker; busy workers stop when their call returns"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.size,
+                'threads_per_worker': self.threads,
+                'starting': self.starting,
+                'ready': self.ready,
+                'busy': self.busy,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'restarts': self.restarts,
+                'start_errors': self.start_errors,
+                'last_start_error': self.last_start_error,
+                'last_startup': self.last_startup,
+            }
+
+
+class LocalModel:
+    """
+    A model loaded in this process, called like a ModelPool
+
+    Used by the pre-fork server (serve.py): the model is loaded and warmed
+    up once in the master, and every forked web worker calls its shared,
+    copy-on-write view of it directly. Torch's thread pools are started by
+    the warm-up and cannot be resized by a forked worker, so they are sized
+    to one worker's share of the cores before it.
+    """
+
+    def __init__(self, factory, warmup=None, threads=1):
+        """
+        Args:
+            threads: torch threads of each process the model is forked into
+        """
+        limit_threads(threads)
+        started = time.monotonic()
+        self.model = factory()
+        self.load_seconds = round(time.monotonic() - started, 3)
+        started = time.monotonic()
+        if warmup is not None:
+            method, args = warmup
+            getattr(self.model, method)(*args)
+        self.warmup_seconds = round(time.monotonic() - started, 3)
+        self.size = 1
+        self.threads = threads
+        # One forward pass at a time per process; other processes run their own
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def is_ready(self):
+        return True
+
+    def state(self):
+        return 'ready'
+
+    def call(self, method, *args, **kwargs):
+        with self._lock:
+            try:
+                result = getattr(self.model, method)(*args, **kwargs)
+            except Exception:
+                self.failed += 1
+                raise
+            self.completed += 1
+            return result
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {
+            'workers': self.size,
+            'in_process': True,
+            'pid': os.getpid(),
+            'threads_per_worker': self.threads,
+            'ready': 1,
+            'completed': self.completed,
+            'failed': self.failed,
+            'last_startup': {'load_seconds': self.load_seconds, 'warmup_seconds': self.warmup_seconds},
+        }
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Compiled phrase matcher for rule-based prompt compression
+
+Rules are applied in order, each to the text left by the ones before it,
+exactly like a loop of word-bounded replacements, but without scanning
+the prompt once per rule. A single trie-shaped regular expression finds
+the rule phrases present; each stretch of text holding one is rewritten
+by just the rules that can apply there: those whose phrase was found,
+and the later rules their replacements can complete.
+"""
+
+import os
+import re
+
+# Characters that end the stretch of text a chain of rules can rewrite,
+# unless a rule phrase or replacement contains them
+BARRIERS = '\n\r\t.,;:!?()[]{}"'
+
+
+def _trie_insert(trie, phrase):
+    node = trie
+    for char in phrase:
+        node = node.setdefault(char, {})
+    node[''] = True
+
+
+def _trie_to_regex(node):
+    """Turn a character trie into a regex that prefers the longest phrase"""
+    terminal = '' in node
+    branches = [re.escape(char) + _trie_to_regex(child)
+                for char, child in sorted(node.items()) if char]
+
+    if not branches:
+        return ''
+
+    if len(branches) == 1:
+        body = branches[0]
+    else:
+        body = '(?:' + '|'.join(branches) + ')'
+
+    if terminal:
+        # Greedy optional keeps the longer phrase when both match
+        if len(branches) == 1 and len(body) > 1:
+            body = '(?:' + body + ')'
+        return body + '?'
+    return body
+
+
+def build_phrase_regex(phrases):
+    """Build a trie-shaped regex source string matching any of the phrases"""
+    trie = {}
+    for phrase in phrases:
+        if phrase:
+            _trie_insert(trie, phrase)
+    return _trie_to_regex(trie)
+
+
+class PhraseMatcher:
+    """Word-bounded phrase substitution with the semantics of an ordered replace loop"""
+
+    def __init__(self, rules, deletions=(), collapse_whitespace=False):
+        """
+        Args:
+            rules: iterable of (phrase, replacement, match_capitalized),
+                applied in order: each rule sees the text as rewritten by the
+                rules before it, so rules chain ('really very good' becomes
+                'very good', then 'good') and where two rules overlap the
+                earlier one wins. When match_capitalized is true the
+                capitalized form of the phrase is rewritten right after it,
+                with the replacement's first letter capitalized. A phrase
+                that repeats an earlier one is ignored.
+            deletions: phrases removed wherever they appear, ignoring case,
+                once every rule has been applied.
+            collapse_whitespace: squeeze every whitespace run to a single
+                space and trim the ends, like ' '.join(text.split()).
+        """
+        self.collapse_whitespace = collapse_whitespace
+        self.deletions = frozenset(phrase.lower() for phrase in deletions if phrase)
+
+        self.rules = []
+        for phrase, replacement, match_capitalized in rules:
+            self.rules.append((phrase, replacement))
+            if match_capitalized:
+                self.rules.append((phrase.capitalize(), _capitalize_first(replacement)))
+        order = {}
+        for index, (phrase, _) in enumerate(self.rules):
+            if phrase:
+                order.setdefault(phrase, index)
+        self.rules = [self.rules[index] for index in sorted(order.values())]
+        self._order = {phrase: index for index, (phrase, _) in enumerate(self.rules)}
+        # Filled in as rules are first hit, so building a matcher stays cheap
+        self._patterns = {}
+        self._enables = {}
+        self._reach = {}
+
+        rule_source = build_phrase_regex(self._order)
+        # Zero-width, so rule phrases overlapping a longer one are found too
+        self.probe = re.compile(r'(?<!\w)(?=(' + rule_source + r')(?!\w))') if rule_source else None
+        # Rules never rewrite across a character no phrase or replacement contains
+        used = set(''.join(phrase + replacement for phrase, replacement in self.rules))
+        barriers = ''.join(char for char in BARRIERS if char not in used)
+        if barriers:
+            self._barrier = re.compile('[' + re.escape(barriers) + ']')
+            self._last_barrier = re.compile('(?s:.*)[' + re.escape(barriers) + ']')
+        else:
+            self._barrier = self._last_barrier = None
+
+        alternatives = []
+        if collapse_whitespace:
+            # Single spaces are already collapsed, so leave them alone
+            alternatives.append(r'(?P<ws>[^\S ]\s*| \s+)')
+        delete_source = build_phrase_regex(self.deletions)
+        if delete_source:
+            deletion = r'(?i:' + delete_source + r')(?!\w)'
+            if collapse_whitespace:
+                # Whitespace after a deletion that follows whitespace is folded
+                # into it so it leaves no gap; after punctuation it is kept,
+                # so 'one-indeed two' does not become 'one-two'
+                alternatives.append(r'(?<!\S)' + deletion + r'\s*')
+            alternatives.append(r'(?<!\w)' + deletion)
+        self.cleanup = re.compile('|'.join(alternatives)) if alternatives else None
+
+        # Whether a text has anything to rewrite at all
+        sources = [pattern.pattern for pattern in (self.probe, self.cleanup) if pattern is not None]
+        self.pattern = re.compile('|'.join(sources)) if sources else None
+
+    def __len__(self):
+        return len(self.rules) + len(self.deletions)
+
+    def sub(self, text):
+        """Apply every rule in order, then the deletions and whitespace collapse"""
+        if self.pattern is None or not text:
+            return text
+        edits = self._rule_edits(text)
+        compressed = apply_edits(text, edits) if edits else text
+        if self.cleanup is not None:
+            compressed = self.cleanup.sub(self._tidy, compressed)
+        if self.collapse_whitespace:
+            compressed = compressed.strip()
+        return compressed
+
+    def rewrite(self, text, strip=True):
+        """
+        Like sub(), but also report which spans changed
+
+        With strip=False the ends are left untrimmed even when collapsing
+        whitespace, so rewrites of consecutive pieces of a text can be
+        concatenated and trimmed once with strip_edits().
+
+        Returns:
+            (compressed, edits) where edits are ordered, non-overlapping
+            (start, end, replacement) spans of text and
+            apply_edits(text, edits) == compressed
+        """
+        if self.pattern is None or not text:
+            return text, []
+
+        edits = self._rule_edits(text)
+        if self.cleanup is not None:
+            rewritten = apply_edits(text, edits) if edits else text
+            cleanup = []
+            for match in self.cleanup.finditer(rewritten):
+                replacement = self._tidy(match)
+                if replacement != match.group(0):
+                    cleanup.append((match.start(), match.end(), replacement))
+            edits = compose_edits(text, edits, cleanup)
+
+        if self.collapse_whitespace and strip:
+            edits = strip_edits(text, edits)
+        return apply_edits(text, edits), edits
+
+    def _tidy(self, match):
+        return ' ' if match.lastgroup == 'ws' else ''
+
+    def _rule_edits(self, text):
+        """
+        Edits made by the rules. A phrase no other rule can interact with is
+        replaced where it was found; around the others, the stretch of text
+        between barriers is rewritten rule by rule.
+        """
+        if self.probe is None:
+            return []
+        hits = [(hit.start(), hit.group(1)) for hit in self.probe.finditer(text)]
+        edits = []
+        start = end = 0
+        # Phrases found in the stretch being gathered, if any
+        phrases = None
+        for number, (position, phrase) in enumerate(hits):
+            if phrases is not None:
+                if position < end:
+                    phrases.add(phrase)
+                    continue
+                self._rewrite_piece(text, start, end, phrases, edits)
+                phrases = None
+            following = hits[number + 1][0] if number + 1 < len(hits) else len(text)
+            if len(self._reachable(phrase)) == 1 and position + len(phrase) <= following:
+                replacement = self.rules[self._order[phrase]][1]
+                if replacement != phrase:
+                    edits.append((position, position + len(phrase), replacement))
+                continue
+            start, end = self._piece(text, position, end)
+            phrases = {phrase}
+            # Phrases already replaced in this stretch are redone along with it
+            while edits and edits[-1][0] >= start:
+                phrases.add(text[edits[-1][0]:edits[-1][1]])
+                edits.pop()
+        if phrases is not None:
+            self._rewrite_piece(text, start, end, phrases, edits)
+        return edits
+
+    def _piece(self, text, position, floor):
+        """Bounds of the stretch between barriers around position, which is past floor"""
+        if self._barrier is None:
+            return 0, len(text)
+        before = self._last_barrier.match(text, floor, position)
+        after = self._barrier.search(text, position)
+        return (before.end() if before else floor), (after.start() if after else len(text))
+
+    def _rewrite_piece(self, text, start, end, phrases, edits):
+        piece = text[start:end]
+        rewritten = piece
+        candidates = set()
+        for phrase in phrases:
+            candidates |= self._reachable(phrase)
+        for index in sorted(candidates):
+            if self.rules[index][0] in rewritten:
+                pattern, replacement = self._rule_pattern(index)
+                rewritten = pattern.sub(replacement, rewritten)
+        if rewritten == piece:
+            return
+        prefix = len(os.path.commonprefix([piece, rewritten]))
+        suffix = len(os.path.commonprefix([piece[prefix:][::-1], rewritten[prefix:][::-1]]))
+        edits.append((start + prefix, end - suffix, rewritten[prefix:len(rewritten) - suffix]))
+
+    def _rule_pattern(self, index):
+        compiled = self._patterns.get(index)
+        if compiled is None:
+            phrase, replacement = self.rules[index]
+            if _is_word(phrase, 0):
+                # Same as a leading (?<!\w), but the literal first character lets re skip ahead
+                source = re.escape(phrase[0]) + r'(?<!\w\w)' + re.escape(phrase[1:])
+            else:
+                source = r'(?<!\w)' + re.escape(phrase)
+            compiled = (re.compile(source + r'(?!\w)'), replacement.replace('\\', r'\\'))
+            self._patterns[index] = compiled
+        return compiled
+
+    def _reachable(self, phrase):
+        """
+        Rules that may apply where phrase is the longest rule phrase found:
+        those whose phrase starts it, and the later rules their replacements
+        may complete
+        """
+        reach = self._reach.get(phrase)
+        if reach is None:
+            pending = [index for shorter, index in self._order.items()
+                       if phrase.startswith(shorter) and not _is_word(phrase, len(shorter))]
+            reach = set()
+            while pending:
+                index = pending.pop()
+                if index not in reach:
+                    reach.add(index)
+                    pending.extend(self._enabled(index))
+            reach = self._reach[phrase] = frozenset(reach)
+        return reach
+
+    def _enabled(self, index):
+        """Later rules that the replacement of rule index may make match"""
+        enabled = self._enables.get(index)
+        if enabled is None:
+            replacement = self.rules[index][1]
+            enabled = self._enables[index] = [
+                later for later in range(index + 1, len(self.rules))
+                if _may_complete(self.rules[later][0], replacement)
+            ]
+        return enabled
+
+
+def apply_edits(text, edits):
+    """Apply ordered, non-overlapping (start, end, replacement) edits to text"""
+    pieces = []
+    pos = 0
+    for start, end, replacement in edits:
+        pieces.append(text[pos:start])
+        pieces.append(replacement)
+        pos = end
+    pieces.append(text[pos:])
+    return ''.join(pieces)
+
+
+def strip_edits(text, edits):
+    """Extend edits so the rewritten text has no leading or trailing whitespace"""
+    # Segments cover all of text; None marks an untouched stretch
+    segments = []
+    pos = 0
+    for start, end, replacement in edits:
+        if pos < start:
+            segments.append((pos, start, None))
+        segments.append((start, end, replacement))
+        pos = end
+    if pos < len(text):
+        segments.append((pos, len(text), None))
+
+    head = []
+    while segments:
+        start, end, replacement = segments.pop(0)
+        current = text[start:end] if replacement is None else replacement
+        stripped = current.lstrip()
+        if replacement is None:
+            cut = start + len(current) - len(stripped)
+            if cut > start:
+                head.append((start, cut, ''))
+            if cut < end:
+                segments.insert(0, (cut, end, None))
+                break
+        elif stripped:
+            segments.insert(0, (start, end, stripped))
+            break
+        else:
+            head.append((start, end, ''))
+
+    tail = []
+    while segments:
+        start, end, replacement = segments.pop()
+        current = text[start:end] if replacement is None else replacement
+        stripped = current.rstrip()
+        if replacement is None:
+            cut = start + len(stripped)
+            if cut < end:
+                tail.insert(0, (cut, end, ''))
+            if cut > start:
+                segments.append((start, cut, None))
+                break
+        elif stripped:
+            segments.append((start, end, stripped))
+            break
+        else:
+            tail.insert(0, (start, end, ''))
+
+    return [edit for edit in head + segments + tail
+            if edit[2] is not None and edit[2] != text[edit[0]:edit[1]]]
+
+
+def compose_edits(text, first, second):
+    """
+    Edits of text with the effect of applying first, then second to the
+    result; both are ordered, non-overlapping (start, end, replacement) lists
+    """
+    if not first or not second:
+        return first or second
+
+    middle = apply_edits(text, first)
+    edits = []
+    i = j = 0
+    # Length change of the first edits before first[i], mapping text to middle
+    shift = 0
+    while i < len(first) or j < len(second):
+        if i < len(first):
+            start, end, replacement = first[i]
+            first_start = start + shift
+            first_end = first_start + len(replacement)
+        if j < len(second) and (i == len(first) or second[j][1] < first_start):
+            start, end, replacement = second[j]
+            edits.append((start - shift, end - shift, replacement))
+            j += 1
+        elif j == len(second) or first_end < second[j][0]:
+            edits.append(first[i])
+            shift += len(replacement) - (end - start)
+            i += 1
+        else:
+            # Edits of both lists that touch become one edit of text
+            cluster_start = min(first_start, second[j][0])
+            original_start = cluster_start - shift
+            cluster_end = cluster_start
+            inner = []
+            while True:
+                if i < len(first) and first[i][0] + shift <= cluster_end:
+                    start, end, replacement = first[i]
+                    cluster_end = max(cluster_end, start + shift + len(replacement))
+                    shift += len(replacement) - (end - start)
+                    i += 1
+                elif j < len(second) and second[j][0] <= cluster_end:
+                    start, end, replacement = second[j]
+                    cluster_end = max(cluster_end, end)
+                    inner.append((start - cluster_start, end - cluster_start, replacement))
+                    j += 1
+                else:
+                    break
+            original_end = cluster_end - shift
+            replacement = apply_edits(middle[cluster_start:cluster_end], inner)
+            if replacement != text[original_start:original_end]:
+                edits.append((original_start, original_end, replacement))
+    return edits
+
+
+def _is_word(text, index):
+    """Whether text[index] is a word character; False past either end"""
+    return 0 <= index < len(text) and (text[index].isalnum() or text[index] == '_')
+
+
+def _may_complete(phrase, replacement):
+    """
+    Whether phrase may match text overlapping replacement, once it is
+    written between two non-word characters as rule replacements are
+    """
+    if not replacement:
+        # Joins its neighbours
+        return True
+    # The phrase starts at or before the replacement
+    at = phrase.find(replacement[0])
+    while at != -1:
+        if _lines_up(phrase, replacement, at, 0):
+            return True
+        at = phrase.find(replacement[0], at + 1)
+    # The phrase starts inside the replacement
+    offset = replacement.find(phrase[0], 1)
+    while offset != -1:
+        if _lines_up(phrase, replacement, 0, offset):
+            return True
+        offset = replacement.find(phrase[0], offset + 1)
+    return False
+
+
+def _lines_up(phrase, replacement, at, offset):
+    """Whether phrase[at] can sit on replacement[offset] as a word-bounded match"""
+    length = min(len(phrase) - at, len(replacement) - offset)
+    if phrase[at:at + length] != replacement[offset:offset + length]:
+        return False
+    # Outside the replacement the characters next to it are non-word ones
+    if _is_word(phrase, at - 1) or _is_word(phrase, at + len(replacement) - offset):
+        return False
+    # Inside it, the phrase still needs its word bounds
+    phrase_end = offset + len(phrase) - at
+    return not _is_word(replacement, offset - 1) and not _is_word(replacement, phrase_end)
+
+
+def _capitalize_first(text):
+    """Uppercase the first character without touching the rest (keeps 'AI', 'API')"""
+    return text[:1].upper() + text[1:]
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Versioned rule packs for rule-based compression
+
+A rule pack is a JSON (or YAML, when PyYAML is installed) file in the rules/
+directory, one per language or target site. Each pack compiles into an
+immutable PhraseMatcher. The registry swaps freshly compiled packs in on
+SIGHUP or when a pack file changes, so rules can be edited without a
+restart. Compiling the bundled pack takes a few milliseconds; workers
+forked from a pre-loading master (serve.py) share its compiled packs.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import signal
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+from rule_matcher import PhraseMatcher
+
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+RULES_DIR = os.environ.get(
+    'SEQUOIA_RULES_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules')
+)
+DEFAULT_PACK = 'en'
+PACK_EXTENSIONS = ('.json', '.yaml', '.yml')
+# Compiled matchers were once pickled here; nothing reads them any more
+STALE_MATCHER_CACHE = os.path.join(
+    os.environ.get('SEQUOIA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'sequoia')),
+    'rules'
+)
+
+# Bump whenever PhraseMatcher output changes, so rewrites cached under the
+# pack digest are not reused
+MATCHER_FORMAT = 3
+
+CompiledRulePack = namedtuple(
+    'CompiledRulePack',
+    ['name', 'version', 'language', 'sites', 'digest', 'matcher', 'path']
+)
+
+
+def read_pack_file(path):
+    """Read a rule pack file, returning its raw bytes and parsed contents"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    if path.endswith('.json'):
+        pack = json.loads(raw.decode('utf-8'))
+    elif YAML_AVAILABLE:
+        pack = yaml.safe_load(raw)
+    else:
+        raise ValueError(f"PyYAML is required to load {path}")
+
+    if not isinstance(pack, dict):
+        raise ValueError(f"Rule pack {path} must be a mapping")
+    pack.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    return raw, pack
+
+
+def pack_digest(raw):
+    """Content hash of a rule pack, also covering the matcher format"""
+    return hashlib.sha256(f"{MATCHER_FORMAT}:".encode() + raw).hexdigest()
+
+
+def build_matcher(pack):
+    """Compile a parsed rule pack into a PhraseMatcher"""
+    rules = []
+    for group in pack.get('rules', []):
+        match_capitalized = group.get('match_capitalized', False)
+        for phrase, replacement in group.get('phrases', {}).items():
+            rules.append((phrase, replacement, match_capitalized))
+
+    return PhraseMatcher(
+        rules,
+        deletions=pack.get('deletions', []),
+        collapse_whitespace=pack.get('collapse_whitespace', True),
+    )
+
+
+def compile_rule_pack(path):
+    """Load and compile a rule pack"""
+    raw, pack = read_pack_file(path)
+    return CompiledRulePack(
+        name=pack['name'],
+        version=str(pack.get('version', '0')),
+        language=pack.get('language'),
+        sites=tuple(pack.get('sites', [])),
+        digest=pack_digest(raw),
+        matcher=build_matcher(pack),
+        path=path,
+    )
+
+
+class RulePackRegistry:
+    """Compiled rule packs, hot-swapped when the pack files change"""
+
+    def __init__(self, directory=RULES_DIR, default=DEFAULT_PACK):
+        self.directory = directory
+        self.default = default
+        # (packs by name, pack name by site, file signatures) - replaced as a whole
+        self._state = ({}, {}, {})
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        if os.path.abspath(directory) != os.path.abspath(STALE_MATCHER_CACHE):
+            shutil.rmtree(STALE_MATCHER_CACHE, ignore_errors=True)
+        self.reload()
+
+    def _pack_files(self):
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            logger.warning(f"Rule pack directory {self.directory} not found")
+            return []
+        return [os.path.join(self.directory, name) for name in names
+                if name.endswith(PACK_EXTENSIONS)]
+
+    def _signatures(self):
+        signatures = {}
+        for path in self._pack_files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signatures[path] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def reload(self):
+        """Recompile changed packs and swap them in; returns True if anything changed"""
+        with self._reload_lock:
+            old_packs, _, old_signatures = self._state
+            old_by_path = {pack.path: pack for pack in old_packs.values()}
+            signatures = self._signatures()
+
+            packs = {}
+            for path, signature in signatures.items():
+                pack = old_by_path.get(path)
+                if pack is None or old_signatures.get(path) != signature:
+                    try:
+                        pack = compile_rule_pack(path)
+                        logger.info(f"✓ Loaded rule pack {pack.name} v{pack.version} "
+                                    f"({len(pack.matcher)} rules)")
+                    except Exception as e:
+                        # Keep serving the previous version of a broken pack
+                        logger.error(f"Failed to load rule pack {path}: {e}")
+                        if pack is None:
+                            continue
+                packs[pack.name] = pack
+
+            sites = {}
+            for pack in packs.values():
+                for site in pack.sites:
+                    sites[site.lower()] = pack.name
+
+            changed = signatures != old_signatures
+            self._state = (packs, sites, signatures)
+            return changed
+
+    def get(self, name=None):
+        """Return the named pack, falling back to the default pack"""
+        packs = self._state[0]
+        pack = packs.get(name or self.default) or packs.get(self.default)
+        if pack is None:
+            raise LookupError(f"No rule pack named {name or self.default!r} is loaded")
+        return pack
+
+    def for_url(self, url):
+        """Pick the pack registered for the site of url, or the default pack"""
+        packs, sites, _ = self._state
+        host = urlparse(url).hostname if url and '://' in url else None
+        while host:
+            if host in sites:
+                return packs[sites[host]]
+            host = host.partition('.')[2]
+        return self.get()
+
+    def describe(self):
+        """Summary of the loaded packs for status endpoints"""
+        return [
+            {'name': pack.name, 'version': pack.version, 'language': pack.language,
+             'sites': list(pack.sites), 'digest': pack.digest[:12], 'rules': len(pack.matcher)}
+            for pack in self._state[0].values()
+        ]
+
+    def watch(self, interval=2.0):
+        """Poll the pack directory in the background and reload on changes"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                if self._signatures() != self._state[2]:
+                    self.reload()
+
+        self._watcher = threading.Thread(target=poll, name='rule-pack-watcher', daemon=True)
+        self._watcher.start()
+
+    def install_signal_handler(self):
+        """Reload packs on SIGHUP (no-op where SIGHUP or signals are unavailable)"""
+        if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+            return
+
+        def on_sighup(signum, frame):
+            logger.info("SIGHUP received, reloading rule packs")
+            threading.Thread(target=self.reload, name='rule-pack-reload', daemon=True).start()
+
+        signal.signal(signal.SIGHUP, on_sighup)
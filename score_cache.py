@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Cache of Selective Context token scores for repeated text
+
+Users paste the same system prompts, boilerplate and documents into many
+conversations. Scoring is the expensive part of Selective Context, and the
+scores of a window of text do not depend on the ratio or on anything
+outside the window and its context, so they are cached by a hash of the
+scored text and the scoring model. A later request with another ratio, or
+with the same document inside different surrounding text, only sends the
+windows it has not seen to the model (see windowed_compression).
+
+Scores are kept in compact arrays and the cache is bounded by bytes.
+"""
+
+import hashlib
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+SCORE_CACHE_MB = float(os.environ.get('SEQUOIA_SCORE_CACHE_MB', 64))
+# Dictionary, key and array headers kept per entry
+ENTRY_OVERHEAD = 256
+
+
+class ScoreCache:
+    """Thread-safe LRU of (offsets, self_info) per scored window, bounded in bytes"""
+
+    def __init__(self, max_bytes=SCORE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.hit_tokens = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(model_id, text, start=0):
+        """Key for the scores of text[start:] when text is scored as a whole"""
+        digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16)
+        digest.update(f'\0{model_id}\0{start}'.encode())
+        return digest.digest()
+
+    def get(self, key):
+        """(offsets, self_info) stored under key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.hit_tokens += len(entry[1])
+        flat_offsets, self_info = entry
+        return list(zip(flat_offsets[0::2], flat_offsets[1::2])), list(self_info)
+
+    def put(self, key, scored):
+        offsets, self_info = scored
+        entry = (array('q', [position for span in offsets for position in span]), array('d', self_info))
+        size = ENTRY_OVERHEAD + entry[0].itemsize * len(entry[0]) + entry[1].itemsize * len(entry[1])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= self._size(previous)
+            self._entries[key] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+                self.evictions += 1
+
+    @staticmethod
+    def _size(entry):
+        return ENTRY_OVERHEAD + entry[0].itemsize * len(entry[0]) + entry[1].itemsize * len(entry[1])
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': int(self.max_bytes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'hit_tokens': self.hit_tokens,
+                'evictions': self.evictions,
+            }
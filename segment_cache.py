@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Segment-level incremental compression for long prompts
+
+A long prompt is split into sentences (or paragraphs) and each segment's
+compressed form is cached by a hash of its content. When a user edits one
+sentence of a pasted document and resends it, only the changed segments
+are compressed again and the rest come from the cache, so the work done
+scales with the size of the edit rather than the size of the document.
+
+Rule pack phrases never span a sentence or paragraph break, so rewriting
+segment by segment gives exactly the same text as rewriting the whole
+prompt. Token counts are summed over chunks cut where GPT-style
+tokenizers always split (see token_accounting), so cached per-chunk
+counts add up to the exact total.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from rule_matcher import strip_edits
+from token_accounting import is_piece_boundary
+
+SEGMENT_CACHE_SIZE = int(os.environ.get('SEQUOIA_SEGMENT_CACHE_SIZE', 16384))
+# Shorter prompts are cheaper to compress whole than to split and look up
+MIN_SEGMENTED_LENGTH = 2048
+# Sentences are grouped into segments of at least this many characters,
+# since looking up each short sentence costs more than rewriting it
+MIN_SEGMENT_LENGTH = 512
+
+# Threads compressing the paragraphs of long prompts, shared by all requests
+PARAGRAPH_THREADS = int(os.environ.get('SEQUOIA_PARAGRAPH_THREADS', 8))
+
+_paragraphs = ThreadPoolExecutor(max_workers=PARAGRAPH_THREADS, thread_name_prefix='paragraph')
+
+# Every sentence or paragraph break ends one of these; a single literal
+# prefix lets the regex engine skip ahead, unlike a lookbehind
+BREAK_CANDIDATE = re.compile(r'[.!?\n]\s+(?=\S)')
+
+
+class SegmentCache:
+    """Thread-safe LRU of per-segment results keyed by (namespace, content hash)"""
+
+    def __init__(self, max_entries=SEGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(namespace, segment):
+        digest = hashlib.blake2b(segment.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        return namespace, digest
+
+    def get_or_compute(self, namespace, segment, compute):
+        key = self.key(namespace, segment)
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = compute(segment)
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def segment_spans(text, sentences=True, min_length=MIN_SEGMENT_LENGTH):
+    """
+    (start, end) of each segment; the whitespace between segments is left out
+
+    Segments break at whitespace containing a blank line and, when
+    sentences is true, at whitespace after sentence-ending punctuation
+    once the segment is at least min_length long. Breaks only depend on
+    the current paragraph, so an edit never moves the segments of other
+    paragraphs.
+    """
+    spans = []
+    pos = 0
+    for match in BREAK_CANDIDATE.finditer(text):
+        start, end = match.span()
+        if text[start] != '\n':
+            start += 1
+        while start > pos and text[start - 1].isspace():
+            start -= 1
+        if start == pos:
+            # Whitespace at the very beginning of the text
+            continue
+        if text.count('\n', start, end) >= 2 or (
+                sentences and start - pos >= min_length and text[start - 1] in '.!?'):
+            spans.append((pos, start))
+            pos = end
+    spans.append((pos, len(text)))
+    return spans
+
+
+def rewrite_segments(matcher, text, cache, namespace):
+    """
+    matcher.rewrite(text), built from cached rewrites of each segment
+
+    Each segment is rewritten together with the whitespace that follows
+    it, so whitespace collapsing and deletions that swallow the following
+    space behave exactly as in a whole-text pass.
+
+    Returns:
+        (compressed, edits) as returned by matcher.rewrite(text)
+    """
+    spans = segment_spans(text)
+    starts = [start for start, _ in spans] + [len(text)]
+    rewrite = lambda unit: matcher.rewrite(unit, strip=False)
+
+    pieces = []
+    edits = []
+    for start, end in zip(starts, starts[1:]):
+        compressed, unit_edits = cache.get_or_compute(namespace, text[start:end], rewrite)
+        pieces.append(compressed)
+        edits.extend((start + s, start + e, replacement) for s, e, replacement in unit_edits)
+
+    compressed = ''.join(pieces)
+    if matcher.collapse_whitespace:
+        compressed = compressed.strip()
+        edits = strip_edits(text, edits)
+    return compressed, edits
+
+
+def count_segments(count_tokens, text, cache, namespace):
+    """
+    Token count of text as the sum of cached counts of its segments
+
+    Only exact for tokenizers whose pieces never span a space after a
+    word, i.e. counters with incremental = True.
+    """
+    cuts = [0]
+    spans = segment_spans(text)
+    for (_, end), (start, _) in zip(spans, spans[1:]):
+        # Breaks start with a space or end with a line break, either of
+        # which always begins a new piece
+        if is_piece_boundary(text, end):
+            cuts.append(end)
+        elif is_piece_boundary(text, start):
+            cuts.append(start)
+    cuts.append(len(text))
+    return sum(cache.get_or_compute(namespace, text[cuts[i]:cuts[i + 1]], count_tokens)
+               for i in range(len(cuts) - 1))
+
+
+def compress_segments(compress, text, cache, namespace, concurrency=1):
+    """
+    Compress each paragraph on its own and stitch them back together
+
+    Used for model-based compressors, whose output depends on the whole
+    input: compressing per paragraph trades a little context for only
+    running the model on paragraphs that changed. Up to concurrency
+    paragraphs are compressed at once, e.g. one per model worker.
+    """
+    spans = segment_spans(text, sentences=False)
+    if concurrency > 1 and len(spans) > 1:
+        compressed = _compress_concurrently(compress, text, spans, cache, namespace, concurrency)
+    else:
+        compressed = [cache.get_or_compute(namespace, text[start:end], compress) for start, end in spans]
+    pieces = []
+    for i, ((start, end), paragraph) in enumerate(zip(spans, compressed)):
+        if i:
+            pieces.append(text[spans[i - 1][1]:start])
+        pieces.append(paragraph)
+    return ''.join(pieces)
+
+
+def _compress_concurrently(compress, text, spans, cache, namespace, concurrency):
+    """Compressed paragraphs in text order, at most concurrency submitted at once"""
+    pending = deque()
+    compressed = []
+    try:
+        for start, end in spans:
+            pending.append(_paragraphs.submit(cache.get_or_compute, namespace, text[start:end], compress))
+            if len(pending) >= concurrency:
+                compressed.append(pending.popleft().result())
+        while pending:
+            compressed.append(pending.popleft().result())
+    finally:
+        # A paragraph failed, e.g. past the deadline: the rest are not started
+        for future in pending:
+            future.cancel()
+    return compressed
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Selective Context compression with batched self-information scoring
+
+This is the algorithm behind PCToolkit's SCCompressor: a causal language
+model (GPT-2) scores every token by its self-information -log p(token |
+preceding text), tokens are grouped into lexical units, and the units
+carrying the least information are dropped until the requested share of
+the prompt is gone.
+
+PCToolkit scores one prompt per forward pass. Here self_info_batch() scores
+several texts in one padded batch, which the model pool's micro-batcher
+uses to amortise the forward pass across the windows of concurrent
+requests; the cut itself is made by compress_scored() in the web process. Texts longer
+than the model context are scored in consecutive context-sized chunks.
+
+The scoring model runs in one of several runtimes, chosen per deployment
+with SEQUOIA_SC_RUNTIME:
+    fp32       the PyTorch model as published
+    int8       PyTorch with int8 dynamic quantization of the linear layers
+    onnx       ONNX Runtime on CPU, from export_scorer.py
+    onnx-int8  ONNX Runtime with int8 weights, from export_scorer.py
+
+Only the scorer needs torch and transformers; the unit splitting and
+selection below are plain Python.
+"""
+
+import os
+import re
+
+from compression_cache import CACHE_DIR
+
+MODEL_NAME = os.environ.get('SEQUOIA_SC_MODEL', 'gpt2')
+RUNTIMES = ('fp32', 'int8', 'onnx', 'onnx-int8')
+RUNTIME = os.environ.get('SEQUOIA_SC_RUNTIME', 'fp32')
+ONNX_DIR = os.environ.get('SEQUOIA_SC_ONNX_DIR', os.path.join(CACHE_DIR, 'scorer'))
+# Rows of one padded forward pass; bounds activation memory for long texts
+MAX_ROWS_PER_PASS = int(os.environ.get('SEQUOIA_SC_MAX_ROWS', 16))
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n\s*')
+# Phrases end at punctuation, and a new one starts before a function word,
+# approximating the noun-phrase chunks spaCy gives the original
+PHRASE_BREAK = re.compile(
+    r'(?<=[,;:.!?()\[\]"])\s+|\n\s*|\s+(?=(?:the|a|an|of|to|in|on|at|for|with|by|from|and|or|but|'
+    r'that|which|who|is|are|was|were|be|been|it|this|these|those|as|if|so|because)\b)',
+    re.IGNORECASE
+)
+WORD_BREAK = re.compile(r'\s+')
+LEVELS = {'sentence': SENTENCE_END, 'phrase': PHRASE_BREAK, 'token': WORD_BREAK}
+
+
+def lexical_units(text, level='phrase'):
+    """
+    Split text into lexical units at the given level
+
+    Returns:
+        list of (start, end) spans covering text, each unit keeping the
+        whitespace that follows it
+    """
+    units = []
+    start = 0
+    for match in LEVELS[level].finditer(text):
+        if match.end() > start and match.start() > start:
+            units.append((start, match.end()))
+            start = match.end()
+    if start < len(text):
+        units.append((start, len(text)))
+    return units
+
+
+def percentile(values, q):
+    """q-th percentile of values with linear interpolation, as numpy computes it"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def unit_scores(units, offsets, self_info):
+    """Sum token self-information over the unit holding each token's last character"""
+    scores = [0.0] * len(units)
+    unit = 0
+    for (start, end), info in zip(offsets, self_info):
+        if end <= start:
+            continue
+        while unit < len(units) - 1 and units[unit][1] < end:
+            unit += 1
+        scores[unit] += info
+    return scores
+
+
+def select_units(text, units, scores, ratio):
+    """Drop the ratio share of units with the least information and join the rest"""
+    if not units or ratio <= 0:
+        return text
+    threshold = percentile(scores, ratio * 100)
+    kept = [text[start:end] for (start, end), score in zip(units, scores) if score >= threshold]
+    return ''.join(kept).strip()
+
+
+def compress_scored(text, offsets, self_info, ratio, level='phrase'):
+    """Compress text given its tokens' character offsets and self-information"""
+    units = lexical_units(text, level)
+    return select_units(text, units, unit_scores(units, offsets, self_info), ratio)
+
+
+class ScoredText:
+    """A text with its lexical units scored once, compressed to any ratio or token budget"""
+
+    def __init__(self, text, offsets, self_info, level='phrase'):
+        self.text = text
+        self.units = lexical_units(text, level)
+        self.scores = unit_scores(self.units, offsets, self_info)
+
+    @classmethod
+    def from_scores(cls, text, units, scores):
+        """ScoredText of units already scored some other way"""
+        scored = cls.__new__(cls)
+        scored.text = text
+        scored.units = units
+        scored.scores = scores
+        return scored
+
+    def compress(self, ratio):
+        return select_units(self.text, self.units, self.scores, ratio)
+
+    def fit(self, max_tokens, count_batch):
+        """
+        Drop the least informative units until the text fits in max_tokens
+
+        Args:
+            count_batch: returns the token counts of a list of texts
+        Returns:
+            (compressed text, share of units dropped)
+        """
+        pieces = [self.text[start:end] for start, end in self.units]
+        if not pieces:
+            return self.text, 0.0
+        # Tokens per unit, so that dropping one updates the total without recounting
+        unit_tokens = count_batch(pieces)
+        total = sum(unit_tokens)
+        order = sorted(range(len(pieces)), key=lambda index: self.scores[index])
+        kept = [True] * len(pieces)
+        dropped = 0
+        while True:
+            while total > max_tokens and dropped < len(order):
+                kept[order[dropped]] = False
+                total -= unit_tokens[order[dropped]]
+                dropped += 1
+            if not dropped:
+                compressed = self.text
+            else:
+                compressed = ''.join(piece for piece, keep in zip(pieces, kept) if keep).strip()
+            # Units joined up can tokenize differently; recount and drop more if over
+            (total,) = count_batch([compressed])
+            if total <= max_tokens or dropped == len(order):
+                return compressed, dropped / len(pieces)
+
+
+def onnx_path(model_name, quantized, directory=ONNX_DIR):
+    """Where export_scorer.py writes the ONNX export of model_name"""
+    name = model_name.strip('/').replace('/', '--')
+    return os.path.join(directory, f"{name}.int8.onnx" if quantized else f"{name}.onnx")
+
+
+def quantize_int8(model):
+    """
+    int8 dynamic quantization of a causal LM's linear layers
+
+    GPT-2 implements its projections as transformers' Conv1D, which
+    quantize_dynamic does not recognise, so those become nn.Linear first.
+    The output head stays fp32: it shares its weights with the token
+    embeddings, so quantizing it would cost accuracy and save no memory.
+    """
+    import torch
+    try:
+        from transformers.pytorch_utils import Conv1D
+    except ImportError:
+        from transformers.modeling_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                # Conv1D computes x @ weight + bias with weight shaped (in, out)
+                linear = torch.nn.Linear(child.weight.shape[0], child.weight.shape[1])
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(parent, name, linear)
+
+    output_head = model.get_output_embeddings()
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and module is not output_head
+    }
+    return torch.ao.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8)
+
+
+class SelectiveContext:
+    """Selective Context compressor whose scoring runs in padded batches"""
+
+    def __init__(self, model_name=MODEL_NAME, device='cpu', level='phrase', runtime=RUNTIME, onnx_dir=ONNX_DIR):
+        import torch
+        from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+        if runtime not in RUNTIMES:
+            raise ValueError(f"unknown scorer runtime {runtime!r}, expected one of {', '.join(RUNTIMES)}")
+        self.torch = torch
+        self.model_name = model_name
+        self.device = device
+        self.level = level
+        self.runtime = runtime
+        # The fast tokenizer reports character offsets for each token
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        self.context_length = AutoConfig.from_pretrained(model_name).max_position_embeddings
+        self.bos_id = self.tokenizer.bos_token_id
+        self.pad_id = self.tokenizer.eos_token_id
+        self.model = None
+        self.session = None
+
+        if runtime.startswith('onnx'):
+            import onnxruntime
+            path = onnx_path(model_name, runtime == 'onnx-int8', onnx_dir)
+            if not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"{path} not found, export it with: python3 export_scorer.py --model {model_name}"
+                )
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = torch.get_num_threads()
+            options.inter_op_num_threads = 1
+            self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        else:
+            model = AutoModelForCausalLM.from_pretrained(model_name).eval()
+            if runtime == 'int8':
+                # Quantized kernels only run on the CPU
+                model = quantize_int8(model)
+                self.device = 'cpu'
+            self.model = model.to(self.device)
+
+    def _logits(self, input_ids, attention_mask):
+        """Next-token logits for a padded batch, from whichever runtime is loaded"""
+        if self.session is not None:
+            logits, = self.session.run(
+                ['logits'], {'input_ids': input_ids.numpy(), 'attention_mask': attention_mask.numpy()}
+            )
+            return self.torch.from_numpy(logits)
+        with self.torch.inference_mode():
+            return self.model(
+                input_ids=input_ids.to(self.device), attention_mask=attention_mask.to(self.device)
+            ).logits
+
+    def self_info_batch(self, texts):
+        """
+        Score every token of several texts in shared forward passes
+
+        Returns:
+            list of (offsets, self_info) per text, where offsets are the
+            tokens' character spans and self_info their -log p in nats
+        """
+        encodings = [
+            self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+            for text in texts
+        ]
+        # One row per context-sized chunk, each chunk predicted after a BOS token
+        chunk = self.context_length - 1
+        rows = []
+        for index, encoding in enumerate(encodings):
+            ids = encoding['input_ids']
+            for start in range(0, len(ids), chunk):
+                rows.append((index, start, ids[start:start + chunk]))
+        # Similar lengths share a pass, so little of each batch is padding
+        rows.sort(key=lambda row: len(row[2]))
+
+        self_info = [[0.0] * len(encoding['input_ids']) for encoding in encodings]
+        torch = self.torch
+        for first in range(0, len(rows), MAX_ROWS_PER_PASS):
+            group = rows[first:first + MAX_ROWS_PER_PASS]
+            width = len(group[-1][2]) + 1
+            input_ids = torch.full((len(group), width), self.pad_id, dtype=torch.long)
+            attention_mask = torch.zeros((len(group), width), dtype=torch.long)
+            for row, (_, _, ids) in enumerate(group):
+                input_ids[row, :len(ids) + 1] = torch.tensor([self.bos_id] + ids)
+                attention_mask[row, :len(ids) + 1] = 1
+            logits = self._logits(input_ids, attention_mask)
+            log_probs = torch.log_softmax(logits[:, :-1].float(), dim=-1)
+            token_info = -log_probs.gather(-1, input_ids[:, 1:].to(logits.device).unsqueeze(-1)).squeeze(-1)
+            token_info = token_info.cpu().tolist()
+            for row, (index, start, ids) in enumerate(group):
+                self_info[index][start:start + len(ids)] = token_info[row][:len(ids)]
+
+        return [
+            (encoding['offset_mapping'], info) for encoding, info in zip(encodings, self_info)
+        ]
+
+    def compress_batch(self, texts, ratios):
+        """Compress each text, removing its ratio share of lexical units"""
+        return [
+            compress_scored(text, offsets, self_info, ratio, self.level)
+            for text, ratio, (offsets, self_info) in zip(texts, ratios, self.self_info_batch(texts))
+        ]
+
+    def compressgo(self, text, ratio=0.3):
+        """Same call as PCToolkit's PromptCompressor"""
+        return self.compress_batch([text], [ratio])[0]
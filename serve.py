@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Production server for the compression services
+
+Runs a service under gunicorn with pre-forked workers instead of Flask's
+development server. The master process imports the service and preloads
+everything the workers share (tokenizers, rule packs, the warmed-up model),
+then freezes the garbage collector so those objects stay in pages shared
+copy-on-write with every forked worker instead of being copied into each.
+Each worker serves requests on a few threads and gets its share of the
+CPU cores for model inference.
+
+Run with: python3 serve.py [message_logger|improved|asgi] --workers 4 [--bind 0.0.0.0:8002]
+
+Reloading:
+    kill -HUP <master pid>    restart the workers gracefully, finishing
+                              in-flight requests (same code and model)
+    kill -USR2 <master pid>   start a new master with new code alongside the
+                              old one, then kill -QUIT the old master
+"""
+
+import argparse
+import gc
+import importlib
+import importlib.util
+import logging
+import os
+import sys
+
+from model_pool import CPU_COUNT
+
+SERVICES = {
+    'message_logger': 'message_logger_service',
+    'improved': 'improved_compression_service',
+    'asgi': 'asgi_service',
+}
+# Services that are ASGI apps, served by uvicorn workers instead of threads
+ASGI_SERVICES = {'asgi'}
+DEFAULT_WORKERS = int(os.environ.get('SEQUOIA_WEB_WORKERS', min(4, CPU_COUNT)))
+DEFAULT_THREADS = int(os.environ.get('SEQUOIA_WEB_THREADS', 4))
+DEFAULT_BIND = os.environ.get('SEQUOIA_BIND', '0.0.0.0:8002')
+# Seconds a worker may take to finish its requests on reload or shutdown
+GRACEFUL_TIMEOUT = int(os.environ.get('SEQUOIA_GRACEFUL_TIMEOUT', 30))
+
+logger = logging.getLogger(__name__)
+
+
+def load_service(name, workers):
+    """Import a service in pre-fork mode and preload what its workers share"""
+    # Read by the services at import, so they leave model loading to preload()
+    os.environ['SEQUOIA_PREFORK'] = '1'
+    service = importlib.import_module(SERVICES[name])
+    service.preload(workers)
+    # Everything allocated so far lives for the whole process; keeping it out
+    # of collections stops the workers from touching, and so copying, its pages
+    gc.collect()
+    gc.freeze()
+    logger.info(f"✓ Preloaded {SERVICES[name]} ({gc.get_freeze_count()} objects frozen)")
+    return service
+
+
+def build_server(service, workers, threads, bind, asgi=False):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            settings = {
+                'bind': bind,
+                'workers': workers,
+                'threads': threads,
+                'worker_class': 'uvicorn.workers.UvicornWorker' if asgi else 'gthread',
+                # The app is already imported; workers fork from this process
+                'preload_app': True,
+                'graceful_timeout': GRACEFUL_TIMEOUT,
+                'post_worker_init': lambda worker: service.post_fork(workers),
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return service.app
+
+    return Server()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('service', nargs='?', default='message_logger', choices=sorted(SERVICES))
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='web worker processes')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help='request threads per worker (ASGI workers use SEQUOIA_ASGI_THREADS)')
+    parser.add_argument('--bind', default=DEFAULT_BIND, help='host:port to listen on')
+    args = parser.parse_args()
+
+    if importlib.util.find_spec('gunicorn') is None:
+        print("❌ gunicorn is not installed")
+        print("Install with: pip3 install gunicorn")
+        return 1
+    asgi = args.service in ASGI_SERVICES
+    if asgi and importlib.util.find_spec('uvicorn') is None:
+        print("❌ uvicorn is not installed")
+        print("Install with: pip3 install uvicorn")
+        return 1
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    service = load_service(args.service, args.workers)
+    logger.info(f"🚀 Serving {SERVICES[args.service]} on {args.bind} with {args.workers} workers "
+                f"x {args.threads} threads")
+    build_server(service, args.workers, args.threads, args.bind, asgi).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Statistical token importance from precomputed unigram or IDF tables
+
+A middle tier between the rules, which take microseconds and compress
+little, and Selective Context, which takes seconds. Each token's
+importance is looked up in a table over tiktoken ids: its unigram
+self-information -log p(token), or its inverse document frequency, counted
+once over a corpus by build_stat_table.py. Scoring a prompt is one encode
+and a few array operations. Lexical units are then cut and selected as
+Selective Context does, so the requested ratio means the same thing.
+
+Tables are float32 .npy files loaded with mmap, so they cost no load time
+and forked workers share one copy. The UTF-8 length of every token, needed
+to map tokens back to characters, is written next to them and mapped too.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+import tokenizer_registry
+from compression_cache import CACHE_DIR
+from selective_context import ScoredText, lexical_units
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('unigram', 'idf')
+ENCODING = os.environ.get('SEQUOIA_STAT_ENCODING', 'cl100k_base')
+TABLE_DIR = os.path.join(CACHE_DIR, 'tables')
+
+
+def table_path(encoding_name=ENCODING, kind='unigram', directory=TABLE_DIR):
+    """Where build_stat_table.py writes the table of kind for encoding_name"""
+    return os.path.join(directory, f"{encoding_name}.{kind}.npy")
+
+
+def lengths_path(encoding_name=ENCODING, directory=TABLE_DIR):
+    """Where build_stat_table.py writes the token byte lengths of encoding_name"""
+    return os.path.join(directory, f"{encoding_name}.lengths.npy")
+
+
+TABLE_PATH = os.environ.get('SEQUOIA_STAT_TABLE', table_path())
+
+
+def build_table(documents, n_vocab, kind='unigram'):
+    """
+    Importance of every token id from a corpus
+
+    Args:
+        documents: token id sequences, one per document
+        n_vocab: size of the encoding's vocabulary
+        kind: 'unigram' for -log p(token) with add-one smoothing, or 'idf'
+            for log((documents + 1) / (documents containing the token + 1))
+    Returns:
+        float32 array of length n_vocab
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    counts = np.zeros(n_vocab, dtype=np.int64)
+    total_documents = 0
+    for ids in documents:
+        ids = np.asarray(ids, dtype=np.int64)
+        counts += np.bincount(np.unique(ids) if kind == 'idf' else ids, minlength=n_vocab)[:n_vocab]
+        total_documents += 1
+    if kind == 'idf':
+        table = np.log((total_documents + 1) / (counts + 1))
+    else:
+        table = np.log(counts.sum() + n_vocab) - np.log(counts + 1)
+    return table.astype(np.float32)
+
+
+def token_byte_lengths(encoder):
+    """UTF-8 length of every token id's bytes; 0 for ids the encoder does not use"""
+    lengths = np.zeros(encoder.n_vocab, dtype=np.int64)
+    for token in range(encoder.n_vocab):
+        try:
+            lengths[token] = len(encoder.decode_single_token_bytes(token))
+        except KeyError:
+            pass
+    return lengths
+
+
+def load_byte_lengths(encoder, directory=TABLE_DIR):
+    """
+    Token byte lengths of encoder, memory-mapped from the file
+    build_stat_table.py writes; computed when it is missing or stale
+    """
+    path = lengths_path(encoder.name, directory)
+    if os.path.exists(path):
+        lengths = np.load(path, mmap_mode='r')
+        if len(lengths) == encoder.n_vocab:
+            return lengths
+    logger.warning(f"⚠️ No token lengths at {path}, computing them (rerun build_stat_table.py)")
+    return token_byte_lengths(encoder)
+
+
+class StatisticalScorer:
+    """Scores and compresses prompts with a memory-mapped importance table"""
+
+    def __init__(self, path=TABLE_PATH, encoder=None, level='phrase'):
+        """
+        Args:
+            path: table from build_stat_table.py
+            encoder: tiktoken encoding the table was built for; by default
+                SEQUOIA_STAT_ENCODING
+        """
+        self.path = path
+        self.level = level
+        self.table = np.load(path, mmap_mode='r')
+        self.encoder = encoder or tokenizer_registry.get_encoder(ENCODING)
+        if len(self.table) != self.encoder.n_vocab:
+            raise ValueError(
+                f"{path} has {len(self.table)} entries but {self.encoder.name} has {self.encoder.n_vocab} tokens"
+            )
+        self.token_lengths = load_byte_lengths(self.encoder, os.path.dirname(os.path.abspath(path)))
+
+    def self_info(self, text):
+        """
+        Tokens of text and their importance
+
+        Returns:
+            (starts, ends, info) arrays: the character span and table value of
+            each token
+        """
+        ids = np.asarray(self.encoder.encode_ordinary(text), dtype=np.int64)
+        if not len(ids):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.float32)
+        # Token byte offsets, mapped to characters by counting the UTF-8
+        # lead bytes before them
+        byte_ends = np.cumsum(self.token_lengths[ids])
+        raw = np.frombuffer(text.encode('utf-8', 'surrogatepass'), dtype=np.uint8)
+        characters = np.cumsum((raw & 0xC0) != 0x80)
+        ends = characters[np.minimum(byte_ends, len(raw)) - 1]
+        starts = np.concatenate(([0], ends[:-1]))
+        return starts, ends, self.table[ids]
+
+    def scored(self, text):
+        """ScoredText of text, for compressing to ratios or to a token budget"""
+        units = lexical_units(text, self.level)
+        if not units:
+            return ScoredText.from_scores(text, units, [])
+        _, ends, info = self.self_info(text)
+        # Each token counts towards the unit holding its last character
+        unit_ends = np.array([end for _, end in units])
+        unit_of_token = np.minimum(np.searchsorted(unit_ends, ends), len(units) - 1)
+        scores = np.bincount(unit_of_token, weights=info, minlength=len(units))
+        return ScoredText.from_scores(text, units, scores.tolist())
+
+    def compress(self, text, ratio):
+        """Drop the ratio share of lexical units that carry the least information"""
+        return self.scored(text).compress(ratio)
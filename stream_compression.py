@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Streaming compression of very large pastes
+
+POST /compress/stream takes the prompt as a raw, possibly chunked body
+and answers with compressed segments as they are ready, instead of
+reading a multi-megabyte JSON body, compressing it whole and echoing it
+back. The body is decoded incrementally and cut at sentence boundaries
+into segments of at most SEGMENT_CHARS characters. Up to IN_FLIGHT
+segments are compressed at once, and their results are sent in text
+order, so memory stays bounded by a few segments and one read, whatever
+the size of the paste. When the client goes away, segments not started
+are dropped and the deadlines of running ones are cancelled. A failure
+part way ends the response with an error event.
+
+Like model windows, segments end after sentences picked by their content
+(see windowed_compression.ends_window), so a document pasted again is cut
+into the same segments and they come from the result cache.
+"""
+
+import codecs
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+from deadline import Deadline, RequestCancelled
+from selective_context import SENTENCE_END
+from windowed_compression import ends_window
+
+logger = logging.getLogger(__name__)
+
+# Longest segment compressed at once
+SEGMENT_CHARS = int(os.environ.get('SEQUOIA_STREAM_SEGMENT_CHARS', 4000))
+# Shortest segment that may end at a content-defined cut
+MIN_SEGMENT_CHARS = int(os.environ.get('SEQUOIA_STREAM_MIN_SEGMENT_CHARS', 1000))
+# Segments of one stream compressed at once
+IN_FLIGHT = int(os.environ.get('SEQUOIA_STREAM_IN_FLIGHT', 4))
+# Bytes read from the request body at a time
+READ_BYTES = 64 * 1024
+
+_segments = ThreadPoolExecutor(max_workers=int(os.environ.get('SEQUOIA_STREAM_THREADS', 8)),
+                               thread_name_prefix='stream-segment')
+
+
+class Segmenter:
+    """Cuts streamed text into segments at sentence boundaries"""
+
+    def __init__(self, max_chars=SEGMENT_CHARS, min_chars=MIN_SEGMENT_CHARS):
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.buffer = ''
+        # UTF-8 characters may be split across reads
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    def feed(self, data):
+        """Add bytes or text; returns the segments completed by it"""
+        self.buffer += self.decoder.decode(data) if isinstance(data, bytes) else data
+        segments = []
+        # Holding more than a segment, so the cut is not at a truncated sentence
+        while len(self.buffer) > self.max_chars:
+            segments.append(self._take(self._cut()))
+        return segments
+
+    def finish(self):
+        """The remaining segments, once the input has ended"""
+        segments = self.feed(self.decoder.decode(b'', final=True))
+        if self.buffer:
+            segments.append(self._take(len(self.buffer)))
+        return segments
+
+    def _take(self, length):
+        segment, self.buffer = self.buffer[:length], self.buffer[length:]
+        return segment
+
+    def _cut(self):
+        """End of the next segment: a content-defined sentence end, the last sentence end, or a space"""
+        previous = 0
+        last = 0
+        for match in SENTENCE_END.finditer(self.buffer, 0, self.max_chars):
+            if match.end() >= self.min_chars and ends_window(self.buffer[previous:match.end()]):
+                return match.end()
+            previous = last = match.end()
+        if last:
+            return last
+        space = self.buffer.rfind(' ', 0, self.max_chars)
+        return space + 1 if space > 0 else self.max_chars
+
+
+def read_chunks(stream, size=READ_BYTES):
+    """Bytes of a file-like request body, size at a time"""
+    while True:
+        data = stream.read(size)
+        if not data:
+            return
+        yield data
+
+
+class StreamRun:
+    """
+    One stream's segments, compressed a few at a time; iterating yields
+    (segment, result) in text order
+    """
+
+    def __init__(self, chunks, compress_segment, new_deadline=Deadline, in_flight=IN_FLIGHT, segmenter=None):
+        """
+        Args:
+            chunks: bytes or text pieces of the input, e.g. read_chunks()
+            compress_segment: compress_segment(segment, deadline) returns the
+                compression result dict of a segment
+            new_deadline: returns the deadline of a segment as it is queued
+            in_flight: segments compressed ahead of the one being sent
+        """
+        self.chunks = iter(chunks)
+        self.compress_segment = compress_segment
+        self.new_deadline = new_deadline
+        self.in_flight = in_flight
+        self.segmenter = segmenter or Segmenter()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self.cancelled = False
+
+    def __iter__(self):
+        reading = True
+        # Segments cut but not submitted yet: one read can complete many
+        backlog = deque()
+        try:
+            while True:
+                while len(self._pending) < self.in_flight and (backlog or reading):
+                    # Read only once the segments read so far are taken, bounding memory
+                    if not backlog:
+                        try:
+                            backlog.extend(self.segmenter.feed(next(self.chunks)))
+                        except StopIteration:
+                            reading = False
+                            backlog.extend(self.segmenter.finish())
+                        continue
+                    with self._lock:
+                        if self.cancelled:
+                            raise RequestCancelled('The stream was cancelled')
+                        segment = backlog.popleft()
+                        deadline = self.new_deadline()
+                        future = _segments.submit(self.compress_segment, segment, deadline)
+                        self._pending.append((segment, future, deadline))
+                if not self._pending:
+                    if self.cancelled:
+                        raise RequestCancelled('The stream was cancelled')
+                    return
+                segment, future, _ = self._pending[0]
+                try:
+                    result = future.result()
+                except CancelledError:
+                    raise RequestCancelled('The stream was cancelled') from None
+                with self._lock:
+                    self._pending.popleft()
+                yield segment, result
+        finally:
+            # Closed early when the client went away
+            self.cancel()
+
+    def cancel(self):
+        """Drop the segments not started and give up on the running ones; safe from any thread"""
+        with self._lock:
+            self.cancelled = True
+            for _, future, deadline in self._pending:
+                future.cancel()
+                deadline.cancel()
+
+
+class StreamTotals:
+    """Running totals of a compressed stream, for its final event"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.segments = 0
+        self.original_length = 0
+        self.compressed_length = 0
+        self.original_tokens = 0
+        self.compressed_tokens = 0
+        self.tiers = {}
+
+    def add(self, segment, compressed, result):
+        self.segments += 1
+        self.original_length += len(segment)
+        self.compressed_length += len(compressed)
+        self.original_tokens += result.get('original_tokens', 0)
+        self.compressed_tokens += result.get('compressed_tokens', 0)
+        self.tiers[result['tier']] = self.tiers.get(result['tier'], 0) + 1
+
+    def report(self):
+        return {
+            'done': True,
+            'segments': self.segments,
+            'original_length': self.original_length,
+            'compressed_length': self.compressed_length,
+            'compression_ratio': round((1 - self.compressed_length / self.original_length) * 100, 2)
+            if self.original_length else 0,
+            'original_tokens': self.original_tokens,
+            'compressed_tokens': self.compressed_tokens,
+            'token_compression_ratio': round((1 - self.compressed_tokens / self.original_tokens) * 100, 2)
+            if self.original_tokens else 0,
+            'tiers': self.tiers,
+            'elapsed_ms': round((time.monotonic() - self.started) * 1000, 2),
+        }
+
+
+def stream_events(results, sse=False):
+    """
+    Output lines for (segment, result) pairs: one event per segment with
+    its compressed text, then a 'done' event with the totals
+    """
+    totals = StreamTotals()
+    for index, (segment, result) in enumerate(results):
+        # Compressors strip the text; keep the line and paragraph breaks between segments
+        compressed = result['compressed'].rstrip() + segment[len(segment.rstrip()):]
+        totals.add(segment, compressed, result)
+        event = {'index': index, 'compressed': compressed}
+        event.update((key, result[key]) for key in (
+            'original_length', 'original_tokens', 'compressed_tokens', 'method', 'tier', 'cache', 'success', 'error'
+        ) if key in result)
+        yield format_event(event, sse)
+    yield format_event(totals.report(), sse)
+
+
+def format_event(fields, sse=False, event=None):
+    """An NDJSON line, or a server-sent event named event: by default 'segment', or 'done' for the totals"""
+    data = json.dumps(fields)
+    if sse:
+        return f"event: {event or ('done' if fields.get('done') else 'segment')}\ndata: {data}\n\n"
+    return data + '\n'
+
+
+def with_error_event(lines, sse=False):
+    """
+    Lines of a streamed response, ending with an error event if producing
+    them fails: the 200 has been sent, so that is how the client learns the
+    response is incomplete
+    """
+    try:
+        yield from lines
+    except RequestCancelled as e:
+        # The client went away; there is nobody to tell
+        logger.info(f"Streamed response cancelled: {e}")
+    except Exception as e:
+        logger.error(f"❌ Streamed response failed: {e}")
+        yield format_event({'error': f'{type(e).__name__}: {e}'}, sse, 'error')
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Tests for the ASGI variant of the message logger service
+
+Requests are driven straight through the ASGI callable, so no server is
+needed. The service is imported in pre-fork mode, which leaves the model
+unloaded and serves the fallback tiers.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+os.environ.setdefault('SEQUOIA_PREFORK', '1')
+
+import asgi_service
+import message_logger_service
+from deadline import DEADLINE_HEADER, MAX_DEADLINE_MS, RequestCancelled
+
+PROMPT = "Could you please explain, in a few simple sentences, how the Lisbon office migrated its accounts? " * 3
+
+
+async def call(path, method='GET', body=None, headers=None, disconnect=None):
+    """
+    One request through the app; returns (status, headers, JSON body, or
+    the list of NDJSON lines), or None when the client disconnects once
+    disconnect (an asyncio.Event) is set. A list body is sent in chunks.
+    """
+    if not isinstance(body, list):
+        body = [body if isinstance(body, bytes) else json.dumps(body).encode() if body is not None else b'']
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': True} for chunk in body]
+    messages[-1]['more_body'] = False
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await (disconnect or asyncio.Event()).wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+        'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+    }
+    await asgi_service.app(scope, receive, send)
+    if not sent:
+        return None
+    start, responses = sent[0], sent[1:]
+    payload = b''.join(response['body'] for response in responses)
+    if dict(start['headers'])[b'content-type'] == b'application/x-ndjson':
+        return start['status'], dict(start['headers']), [json.loads(line) for line in payload.splitlines()]
+    return start['status'], dict(start['headers']), json.loads(payload)
+
+
+def test_same_json_as_flask():
+    """Compression results, errors and reports have the Flask service's schema"""
+    headers = {'X-Sequoia-Cache': 'bypass'}
+    status, raw_headers, body = asyncio.run(call('/compress', 'POST', {'text': PROMPT, 'ratio': 0.4}, headers))
+    flask = message_logger_service.app.test_client().post('/compress', json={'text': PROMPT, 'ratio': 0.4},
+                                                          headers=headers)
+    assert status == flask.status_code == 200 and raw_headers[b'x-sequoia-cache'] == b'bypass'
+    assert set(body) == set(flask.get_json()) and body['compressed'] == flask.get_json()['compressed']
+    assert raw_headers[b'access-control-allow-origin'] == b'*'
+
+    status, _, body = asyncio.run(call('/log-message', 'POST', {'text': PROMPT}))
+    assert status == 400 and body == {'error': 'No message provided'}
+    status, _, body = asyncio.run(call('/health'))
+    assert status == 200 and set(message_logger_service.health_report()) < set(body)
+    assert asyncio.run(call('/compress'))[0] == 405 and asyncio.run(call('/nowhere'))[0] == 404
+
+
+def test_batch_streams_ndjson():
+    """/compress/batch takes NDJSON or a JSON array and answers one line per item"""
+    items = [{'id': 'a', 'text': PROMPT, 'ratio': 0.5}, {'id': 'b'}]
+    body = b'\n'.join(json.dumps(item).encode() for item in items)
+    status, _, lines = asyncio.run(call('/compress/batch?concurrency=2', 'POST', body))
+    assert status == 200 and sorted(line['id'] for line in lines) == ['a', 'b']
+    by_id = {line['id']: line for line in lines}
+    assert by_id['a']['compressed'] and by_id['b']['error'] == 'item has no text'
+
+    status, _, lines = asyncio.run(call('/compress/batch', 'POST', json.dumps(items).encode(),
+                                        {'Content-Type': 'application/json'}))
+    assert status == 200 and len(lines) == 2
+    assert asyncio.run(call('/compress/batch?concurrency=0', 'POST', body))[0] == 400
+    # The batch's deadline header is capped like the other endpoints'; no header means no limit
+    assert message_logger_service.batch_run([], {}, {DEADLINE_HEADER: '1e12'})[0].budget_ms == MAX_DEADLINE_MS
+    assert message_logger_service.batch_run([], {}, {DEADLINE_HEADER: 'nan'})[0].budget_ms is None
+
+
+def test_batch_answers_before_the_upload_ends():
+    """NDJSON items start as their lines arrive, so a result can come back mid-upload"""
+    async def scenario():
+        first_result = asyncio.Event()
+        messages = [
+            {'type': 'http.request', 'body': json.dumps({'id': 'a', 'text': PROMPT}).encode() + b'\n{"id": ',
+             'more_body': True},
+            {'type': 'http.request', 'body': b'"b", "text": "x"}', 'more_body': False},
+        ]
+        lines = []
+
+        async def receive():
+            if len(messages) == 1:
+                # The rest of the body is only sent once a result is back
+                await first_result.wait()
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message.get('body'):
+                lines.append(json.loads(message['body']))
+                first_result.set()
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/compress/batch',
+                 'query_string': b'concurrency=1', 'headers': []}
+        await asyncio.wait_for(asgi_service.app(scope, receive, send), 10)
+        return lines
+
+    lines = asyncio.run(scenario())
+    assert [line['id'] for line in lines] == ['a', 'b'] and all('compressed' in line for line in lines)
+    assert list(asgi_service.body_lines([b'a\nb', b'c', b'\n', b'd\n\ne'])) == [b'a', b'bc', b'd', b'', b'e']
+
+
+def test_stream_compresses_a_chunked_body():
+    """/compress/stream reads the body in chunks and sends the segments in order"""
+    text = (PROMPT + "\n\n") * 60
+    data = text.encode()
+    chunks = [data[start:start + 1000] for start in range(0, len(data), 1000)]
+    status, raw_headers, lines = asyncio.run(call('/compress/stream?ratio=0.5', 'POST', chunks))
+    assert status == 200 and raw_headers[b'content-type'] == b'application/x-ndjson'
+    assert [line['index'] for line in lines[:-1]] == list(range(len(lines) - 1)) and len(lines) > 3
+    assert lines[-1]['done'] and lines[-1]['original_length'] == len(text)
+    assert 0 < len(''.join(line['compressed'] for line in lines[:-1])) < len(text)
+
+
+def test_stream_cut_off_by_a_disconnect_is_not_finished():
+    """The text read before the client went away is not compressed as if the body had ended"""
+    compressed = []
+    original = message_logger_service.cached_compress_prompt
+
+    def recording(text, *args):
+        compressed.append(text)
+        return original(text, *args)
+
+    async def scenario():
+        messages = [{'type': 'http.request', 'body': PROMPT.encode(), 'more_body': True}]
+        disconnect = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            disconnect.set()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            pass
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/compress/stream', 'query_string': b'', 'headers': []}
+        await asgi_service.app(scope, receive, send)
+        return disconnect.is_set()
+
+    cancelled = asgi_service.counters['cancelled']
+    message_logger_service.cached_compress_prompt = recording
+    try:
+        assert asyncio.run(scenario())
+    finally:
+        message_logger_service.cached_compress_prompt = original
+    time.sleep(0.1)
+    assert compressed == [] and asgi_service.counters['cancelled'] == cancelled + 1
+
+
+def test_stream_failure_is_reported_in_the_stream():
+    """Both services end a stream that fails after the 200 with an error line"""
+    def failing(text, *args):
+        raise RuntimeError("disk full")
+
+    original = message_logger_service.cached_compress_prompt
+    message_logger_service.cached_compress_prompt = failing
+    try:
+        status, _, lines = asyncio.run(call('/compress/stream', 'POST', [PROMPT.encode()]))
+        flask = message_logger_service.app.test_client().post('/compress/stream?format=sse', data=PROMPT)
+        flask_events = flask.get_data(as_text=True)
+    finally:
+        message_logger_service.cached_compress_prompt = original
+    assert status == 200 and lines == [{'error': 'RuntimeError: disk full'}]
+    assert flask.status_code == 200
+    assert flask_events == 'event: error\ndata: {"error": "RuntimeError: disk full"}\n\n'
+
+
+def test_reports_answer_while_compressions_are_busy():
+    """/health answers at once while every compression thread is taken"""
+    release = threading.Event()
+
+    def slow(data, headers, deadline):
+        release.wait(10)
+        return {'compressed': data['text']}, 200, {}
+
+    async def scenario():
+        busy = [asyncio.ensure_future(call('/compress', 'POST', {'text': 'x'}))
+                for _ in range(asgi_service.COMPRESS_THREADS + 2)]
+        await asyncio.sleep(0.1)
+        started = time.monotonic()
+        status, _, health = await call('/health')
+        elapsed = time.monotonic() - started
+        release.set()
+        results = await asyncio.gather(*busy)
+        return status, health, elapsed, results
+
+    original = asgi_service.COMPRESSIONS['/compress']
+    asgi_service.COMPRESSIONS['/compress'] = slow
+    try:
+        status, health, elapsed, results = asyncio.run(scenario())
+    finally:
+        asgi_service.COMPRESSIONS['/compress'] = original
+    assert status == 200 and elapsed < 1
+    assert health['asgi']['in_flight'] == asgi_service.COMPRESS_THREADS + 2
+    assert all(result[0] == 200 for result in results)
+
+
+def test_reports_run_off_the_event_loop():
+    """/health queries the disk cache on another thread, so the loop keeps serving"""
+    threads = []
+
+    def report():
+        threads.append(threading.current_thread())
+        return {'status': 'healthy'}, 200, {}
+
+    original = asgi_service.REPORTS['/health']
+    asgi_service.REPORTS['/health'] = report
+    try:
+        assert asyncio.run(call('/health'))[0] == 200
+    finally:
+        asgi_service.REPORTS['/health'] = original
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_disconnect_cancels_the_request():
+    """A client that goes away cancels its deadline, waking the blocked compression"""
+    outcome = Future()
+
+    def blocked(data, headers, deadline):
+        try:
+            deadline.wait(Future())
+        except RequestCancelled as e:
+            outcome.set_result(e)
+            raise
+
+    async def scenario():
+        disconnect = asyncio.Event()
+        request = asyncio.ensure_future(call('/compress', 'POST', {'text': 'x'}, disconnect=disconnect))
+        await asyncio.sleep(0.1)
+        disconnect.set()
+        return await request
+
+    cancelled = asgi_service.counters['cancelled']
+    original = asgi_service.COMPRESSIONS['/compress']
+    asgi_service.COMPRESSIONS['/compress'] = blocked
+    try:
+        assert asyncio.run(scenario()) is None
+    finally:
+        asgi_service.COMPRESSIONS['/compress'] = original
+    assert isinstance(outcome.result(timeout=5), RequestCancelled)
+    assert asgi_service.counters['cancelled'] == cancelled + 1
+
+
+if __name__ == "__main__":
+    tests = [
+        test_same_json_as_flask,
+        test_batch_streams_ndjson,
+        test_batch_answers_before_the_upload_ends,
+        test_stream_compresses_a_chunked_body,
+        test_stream_cut_off_by_a_disconnect_is_not_finished,
+        test_stream_failure_is_reported_in_the_stream,
+        test_reports_answer_while_compressions_are_busy,
+        test_reports_run_off_the_event_loop,
+        test_disconnect_cancels_the_request,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ ASGI service tests passed!")
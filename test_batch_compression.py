@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for batch compression with streamed results
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+from batch_compression import BatchRun, array_items, ndjson_items
+from deadline import RequestCancelled
+
+
+def upper(item, deadline):
+    """Stand-in compressor: sleeps for the item's delay, then upper-cases it"""
+    time.sleep(item.get('delay', 0))
+    if item['text'] == 'boom':
+        raise RuntimeError('model failed')
+    return {'compressed': item['text'].upper()}
+
+
+def test_results_stream_as_items_finish():
+    """A slow item does not hold back the lines of quicker ones after it"""
+    items = [{'id': 'slow', 'text': 'a', 'delay': 0.3}, {'id': 'quick', 'text': 'b'}, {'id': 'c', 'text': 'c'}]
+    lines = [json.loads(line) for line in BatchRun(array_items(items), upper)]
+    assert [line['id'] for line in lines][-1] == 'slow'
+    assert {line['index']: line['compressed'] for line in lines} == {0: 'A', 1: 'B', 2: 'C'}
+
+
+def test_errors_stay_with_their_item():
+    """Malformed lines, missing text and compressor errors each produce one error line"""
+    body = b'{"id": 1, "text": "ok"}\n\nnot json\n{"id": 2}\n[1]\n{"id": 3, "text": "boom"}\n'
+    lines = {line['index']: line for line in map(json.loads, BatchRun(ndjson_items(body.splitlines()), upper))}
+    assert lines[0] == {'compressed': 'OK', 'id': 1, 'index': 0}
+    assert 'not valid JSON' in lines[1]['error'] and lines[1]['id'] is None
+    assert lines[2]['error'] == 'item has no text' and lines[2]['id'] == 2
+    assert lines[3]['error'] == 'item must be a JSON object'
+    assert lines[4]['error'] == 'RuntimeError: model failed' and lines[4]['id'] == 3
+
+
+def test_concurrency_cap_and_batched_counting():
+    """At most concurrency items run at once, and each chunk is prepared in one call"""
+    lock = threading.Lock()
+    running = [0, 0]
+    chunks = []
+
+    def tracked(item, deadline):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return {}
+
+    items = array_items([{'text': str(n)} for n in range(20)])
+    lines = list(BatchRun(items, tracked, prepare=lambda chunk: chunks.append(len(chunk)), concurrency=3))
+    assert len(lines) == 20 and running[1] <= 3
+    assert chunks[0] == 3 and sum(chunks) == 20
+
+
+def test_cancel_stops_the_batch():
+    """Closing the stream cancels the deadlines of running items and starts no more"""
+    started = []
+    outcomes = []
+
+    def blocked(item, deadline):
+        started.append(item['id'])
+        try:
+            deadline.wait(Future())
+        except RequestCancelled:
+            outcomes.append('cancelled')
+        return {}
+
+    run = BatchRun(array_items([{'id': n, 'text': 'x'} for n in range(10)]), blocked, concurrency=2)
+    lines = iter(run)
+    threading.Timer(0.1, run.cancel).start()
+    assert list(lines) == []
+    deadline = time.monotonic() + 5
+    while len(outcomes) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert outcomes == ['cancelled', 'cancelled'] and len(started) == 2
+
+
+if __name__ == "__main__":
+    tests = [
+        test_results_stream_as_items_finish,
+        test_errors_stay_with_their_item,
+        test_concurrency_cap_and_batched_counting,
+        test_cancel_stops_the_batch,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Batch compression tests passed!")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests for the token-budget fallback compression
+"""
+
+import os
+import re
+
+os.environ.setdefault('SEQUOIA_PREFORK', '1')
+
+import message_logger_service
+from budget_compression import compress_to_budget, split_words, token_budget, word_importance
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+PROMPT = (
+    "Could you please explain how the Lisbon office migrated 4,200 accounts in March 2023? "
+    "Basically, the migration was really very slow, and the team had to reconcile the duplicated "
+    "invoices by hand before the cutover. "
+)
+
+
+def count_batch(texts, calls=None):
+    """Stand-in tokenizer: words and punctuation marks"""
+    if calls is not None:
+        calls.append(len(texts))
+    return [len(TOKEN.findall(text)) for text in texts]
+
+
+def test_words_and_importance():
+    """Words join back to the text, filler scores lowest, names and numbers highest"""
+    words = split_words(PROMPT)
+    assert ''.join(words) == PROMPT
+    buckets = dict(zip((word.strip(' ,.?') for word in words), word_importance(words)))
+    assert buckets['the'] == buckets['please'] == buckets['Basically'] == 0
+    assert buckets['Lisbon'] > buckets['office'] and buckets['4,200'] > buckets['office']
+    assert buckets['reconcile'] > buckets['hand']
+
+
+def test_budget_is_met_exactly():
+    """The result fits the budget and uses nearly all of it, keeping the key words"""
+    text = PROMPT * 5
+    original = count_batch([text])[0]
+    for ratio in (0.1, 0.3, 0.5, 0.8):
+        budget = token_budget(original, ratio)
+        compressed, tokens = compress_to_budget(text, budget, count_batch)
+        assert tokens == count_batch([compressed])[0]
+        assert budget - 3 <= tokens <= budget
+    compressed, _ = compress_to_budget(text, token_budget(original, 0.6), count_batch)
+    assert 'Lisbon' in compressed and '2023' in compressed and 'please' not in compressed
+    assert compress_to_budget(text, original, count_batch) == (text, original)
+    assert compress_to_budget(text, 0, count_batch) == ('', 0)
+    # A word larger than the whole budget is kept rather than emptying the prompt
+    assert compress_to_budget("4,200! Lisbon-Madrid", 2, count_batch) == ("4,200!", 4)
+
+
+def test_each_distinct_word_is_counted_once():
+    """Counting is one batch of distinct words and one check of the result"""
+    calls = []
+    text = PROMPT * 200
+    compress_to_budget(text, 100, lambda texts: count_batch(texts, calls))
+    assert len(calls) == 2 and calls[0] == len(set(split_words(text)))
+
+
+def test_results_say_when_they_are_over_budget():
+    """A word kept over the budget is reported, and a budget of 0 empties the prompt"""
+    word = "Supercalifragilisticexpialidocious"
+    result = message_logger_service.simple_compress_result(word, 0.5, None, 'test', max_tokens=1)
+    assert result['compressed'] == word and result['compressed_tokens'] > result['token_budget'] == 1
+    assert result['within_budget'] is False
+    result = message_logger_service.simple_compress_result(PROMPT, 0.5, None, 'test', max_tokens=0)
+    assert result['compressed'] == '' and result['compressed_tokens'] == 0
+    assert result['within_budget'] is True
+    result = message_logger_service.simple_compress_result(PROMPT, 0.5, None, 'test')
+    assert result['within_budget'] and result['compressed_tokens'] <= result['token_budget']
+
+
+if __name__ == "__main__":
+    tests = [
+        test_words_and_importance,
+        test_budget_is_met_exactly,
+        test_each_distinct_word_is_counted_once,
+        test_results_say_when_they_are_over_budget,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Budget compression tests passed!")
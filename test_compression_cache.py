@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Tests for the compression result cache
+"""
+
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import compression_cache
+from compression_cache import CompressionCache, DiskCache, bypass_requested, cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_key_covers_parameters():
+    """Any change to the text or a parameter gives a different key"""
+    key = cache_key("hello", 0.3, "SCCompressor", "cl100k_base")
+    assert key == cache_key("hello", 0.3, "SCCompressor", "cl100k_base")
+    assert key != cache_key("hello ", 0.3, "SCCompressor", "cl100k_base")
+    assert key != cache_key("hello", 0.5, "SCCompressor", "cl100k_base")
+    assert key != cache_key("hello", 0.3, "SCCompressor", "claude_approx")
+
+
+def test_lru_eviction_and_ttl():
+    """Least recently used entries are evicted first and entries expire after the TTL"""
+    clock = FakeClock()
+    cache = CompressionCache(max_entries=2, ttl=10, clock=clock)
+    cache.put("a", {"compressed": "A"})
+    cache.put("b", {"compressed": "B"})
+    assert cache.get("a") == {"compressed": "A"}
+    cache.put("c", {"compressed": "C"})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    clock.now = 11
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['expirations']) == (2, 2, 1, 1)
+
+
+def test_get_or_compute():
+    """Results are computed once, unless bypassed or rejected as uncacheable"""
+    cache = CompressionCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"success": len(calls) > 1}
+
+    assert cache.get_or_compute("k", compute, cacheable=lambda r: r["success"])[1] == "miss"
+    assert cache.get_or_compute("k", compute, cacheable=lambda r: r["success"])[1] == "miss"
+    result, status = cache.get_or_compute("k", compute)
+    assert status == "hit" and result == {"success": True}
+    result["success"] = False
+    assert cache.get_or_compute("k", compute)[0] == {"success": True}
+    assert cache.get_or_compute("k", compute, use_cache=False)[1] == "bypass"
+    assert len(calls) == 3
+
+    assert bypass_requested({"X-Sequoia-Cache": "Bypass"})
+    assert not bypass_requested({})
+
+
+def test_concurrent_misses_are_coalesced():
+    """Identical requests arriving together share one computation"""
+    cache = CompressionCache()
+    calls = []
+    release = threading.Event()
+
+    def compute(success=True):
+        calls.append(1)
+        release.wait(5)
+        return {"success": success}
+
+    with ThreadPoolExecutor(5) as pool:
+        requests = [pool.submit(cache.get_or_compute, "k", compute) for _ in range(5)]
+        time.sleep(0.1)
+        assert cache.stats()['in_flight'] == 1
+        release.set()
+        statuses = sorted(request.result()[1] for request in requests)
+    assert statuses == ["coalesced"] * 4 + ["miss"] and len(calls) == 1
+    assert cache.stats()['coalesced'] == 4 and cache.stats()['in_flight'] == 0
+
+    # A request that cannot wait as long as the first one computes its own result,
+    # and results that are not cacheable are not shared
+    release.clear()
+    calls.clear()
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(cache.get_or_compute, "slow", compute)
+        time.sleep(0.05)
+        impatient = pool.submit(cache.get_or_compute, "slow", lambda: {"success": True}, wait=0.05)
+        assert impatient.result()[1] == "miss"
+        release.set()
+        first.result()
+    assert cache.stats()['coalesce_timeouts'] == 1
+
+    release.clear()
+    uncacheable = lambda: cache.get_or_compute("bad", lambda: compute(False), cacheable=lambda r: r["success"])
+    with ThreadPoolExecutor(2) as pool:
+        requests = [pool.submit(uncacheable) for _ in range(2)]
+        time.sleep(0.05)
+        release.set()
+        assert [request.result()[1] for request in requests] == ["miss", "miss"]
+
+
+class SlowDisk:
+    """Stand-in disk tier whose reads take a while and are counted"""
+
+    def __init__(self):
+        self.reads = 0
+
+    def get(self, key):
+        self.reads += 1
+        time.sleep(0.1)
+        return None
+
+    def put(self, key, value):
+        pass
+
+
+def test_misses_join_the_flight_before_reading_disk():
+    """Requests missing together never compute twice, however slow the disk tier is"""
+    disk = SlowDisk()
+    cache = CompressionCache(backing=disk)
+    calls = []
+    with ThreadPoolExecutor(5) as pool:
+        requests = [pool.submit(cache.get_or_compute, "k", lambda: calls.append(1) or {"success": True})
+                    for _ in range(5)]
+        statuses = sorted(request.result()[1] for request in requests)
+    assert statuses == ["coalesced"] * 4 + ["miss"] and len(calls) == 1 and disk.reads == 1
+
+
+def test_results_are_stored_for_the_tier_that_ran():
+    """A result is stored under result_key, e.g. without the library when it failed"""
+    cache = CompressionCache()
+    result_key = lambda result: "with-library" if result["with_library"] else "rules-only"
+    result, status = cache.get_or_compute("with-library", lambda: {"with_library": False}, result_key=result_key)
+    assert status == "miss" and cache.get("with-library") is None
+    assert cache.get("rules-only") == {"with_library": False}
+
+
+def test_disk_tier_survives_restart():
+    """A new process with an empty memory cache is served from disk"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = f"{directory}/results.sqlite3"
+        CompressionCache(backing=DiskCache(path)).put("k", {"compressed": "ünïcode"})
+
+        cache = CompressionCache(backing=DiskCache(path))
+        assert cache.get("k") == {"compressed": "ünïcode"}
+        assert cache.stats()['misses'] == 1 and cache.stats()['disk']['hits'] == 1
+        assert cache.get("k") is not None and cache.stats()['hits'] == 1
+
+
+def test_disk_schema_change_drops_entries():
+    """Opening a database written with another schema version starts empty"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = f"{directory}/results.sqlite3"
+        DiskCache(path).put("k", {"compressed": "x"})
+        connection = sqlite3.connect(path)
+        connection.execute("UPDATE meta SET value = '0' WHERE key = 'schema_version'")
+        connection.commit()
+        connection.close()
+        assert DiskCache(path).get("k") is None
+
+
+def test_disk_size_eviction():
+    """Past max_bytes the least recently read entries are evicted"""
+    clock = FakeClock()
+    with tempfile.TemporaryDirectory() as directory:
+        disk = DiskCache(f"{directory}/results.sqlite3", max_bytes=2000, clock=clock)
+        for i in range(compression_cache.EVICTION_CHECK_INTERVAL):
+            clock.now += compression_cache.TOUCH_INTERVAL + 1
+            disk.put(f"key{i}", {"compressed": "x" * 50})
+            disk.get("key0")
+        stats = disk.stats()
+        assert stats['bytes'] <= 2000 and stats['evictions'] > 0
+        assert disk.get("key0") is not None
+        assert disk.get("key1") is None
+
+
+if __name__ == "__main__":
+    tests = [
+        test_cache_key_covers_parameters,
+        test_lru_eviction_and_ttl,
+        test_get_or_compute,
+        test_concurrent_misses_are_coalesced,
+        test_misses_join_the_flight_before_reading_disk,
+        test_results_are_stored_for_the_tier_that_ran,
+        test_disk_tier_survives_restart,
+        test_disk_schema_change_drops_entries,
+        test_disk_size_eviction,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Compression cache tests passed!")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for request deadlines and abandoning slow tiers
+"""
+
+import os
+import threading
+import time
+
+from deadline import (
+    DEADLINE_HEADER, DEFAULT_DEADLINE_MS, MAX_DEADLINE_MS, Deadline, DeadlineExceeded, deadline_for_request,
+    requested_budget_ms, run_with_deadline,
+)
+from micro_batcher import MicroBatcher
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_deadline_budget():
+    """Budgets come from the header or the site default, and report the time used"""
+    clock = FakeClock()
+    deadline = Deadline(250, clock)
+    assert deadline.remaining() == 0.25 and not deadline.expired
+    clock.now += 0.1
+    assert deadline.report('rules') == {
+        'tier': 'rules', 'abandoned_tiers': [], 'deadline_ms': 250, 'elapsed_ms': 100.0
+    }
+    clock.now += 0.2
+    assert deadline.expired and deadline.remaining() == 0
+    assert Deadline().remaining() is None and not Deadline().expired
+
+    assert deadline_for_request({DEADLINE_HEADER: '300'}, None).budget_ms == 300
+    assert deadline_for_request({DEADLINE_HEADER: '-5'}, None).budget_ms == 0
+    assert deadline_for_request({DEADLINE_HEADER: '1e12'}, None).budget_ms == MAX_DEADLINE_MS
+    assert deadline_for_request({DEADLINE_HEADER: 'nan'}, None).budget_ms == DEFAULT_DEADLINE_MS
+    # Without the header, batch items have no limit
+    assert requested_budget_ms({}) is None and requested_budget_ms({DEADLINE_HEADER: 'inf'}) == MAX_DEADLINE_MS
+    os.environ['SEQUOIA_DEADLINE_MS_GROK'] = '750'
+    try:
+        assert deadline_for_request({DEADLINE_HEADER: 'soon'}, 'https://grok.com/chat').budget_ms == 750
+        assert deadline_for_request({}, 'https://chatgpt.com/').budget_ms != 750
+    finally:
+        del os.environ['SEQUOIA_DEADLINE_MS_GROK']
+
+
+def test_slow_tiers_are_abandoned():
+    """A slow call past the deadline raises DeadlineExceeded, and a queued batch item is dropped"""
+    assert run_with_deadline(lambda x: x * 2, Deadline(1000), 21) == 42
+    started = time.monotonic()
+    try:
+        run_with_deadline(time.sleep, Deadline(50), 1)
+        assert False, "expected DeadlineExceeded"
+    except DeadlineExceeded:
+        pass
+    assert time.monotonic() - started < 0.5
+
+    release = threading.Event()
+    batches = []
+
+    def run_batch(items):
+        batches.append(items)
+        release.wait(5)
+        return items
+
+    batcher = MicroBatcher(run_batch, max_batch=1, max_wait_ms=0)
+    running = batcher.submit('first')
+    time.sleep(0.1)
+    try:
+        Deadline(50).wait(batcher.submit('late'))
+        assert False, "expected DeadlineExceeded"
+    except DeadlineExceeded:
+        pass
+    release.set()
+    assert running.result(timeout=5) == 'first'
+    assert batcher.submit('next').result(timeout=5) == 'next'
+    assert batches == [['first'], ['next']]
+    assert batcher.stats()['cancelled'] == 1
+    batcher.close()
+
+
+if __name__ == "__main__":
+    tests = [
+        test_deadline_budget,
+        test_slow_tiers_are_abandoned,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Deadline tests passed!")
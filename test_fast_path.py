@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Tests for the incompressible-input fast path
+"""
+
+from fast_path import FastPath, classify
+from rule_matcher import PhraseMatcher
+
+PYTHON_CODE = "def foo(x):\n    if x == 1:\n        return 2\n    return x * 3\n"
+PYTHON_TRACE = (
+    'Traceback (most recent call last):\n'
+    '  File "app.py", line 3, in <module>\n'
+    '    main()\n'
+    '  File "app.py", line 2, in main\n'
+    '    raise ValueError("bad")\n'
+    'ValueError: bad\n'
+)
+JAVA_TRACE = (
+    'Exception in thread "main" java.lang.NullPointerException\n'
+    '\tat com.example.Foo.bar(Foo.java:10)\n'
+    '\tat com.example.Main.main(Main.java:5)\n'
+)
+
+
+def test_classify():
+    """Each kind of incompressible input is recognised, prose is not"""
+    assert classify(PYTHON_CODE) == 'code'
+    assert classify("const f = () => {\n  let y = 1;\n  return y;\n};") == 'code'
+    assert classify(PYTHON_TRACE) == 'stack_trace'
+    assert classify(JAVA_TRACE) == 'stack_trace'
+    assert classify("https://example.com/a?b=c\nhttps://example.org/") == 'url'
+    assert classify("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==") == 'base64'
+    assert classify("Пожалуйста, объясните, как работают нейронные сети.") == 'non_english'
+    assert classify("Пожалуйста, объясните, как работают нейронные сети.", language='ru') is None
+
+    assert classify("I would like to know more about neural networks. Could you please explain?") is None
+    assert classify("Why does this fail?\n\nfor i in range(10):\n    print(i)\n\nI am really confused.") is None
+    assert classify("Check https://example.com for details please") is None
+    assert classify("I ❤️ the “café” down the street") is None
+
+
+def test_fast_path_skips_and_counts():
+    """Classified inputs, rule-free inputs and known misses are skipped and counted"""
+    matcher = PhraseMatcher([("I am", "I'm", True)], deletions=["basically"])
+    fast_path = FastPath()
+    params = ('en', 'cl100k_base')
+
+    assert fast_path.check(PYTHON_CODE, params) == 'code'
+    assert fast_path.check("The report covers revenue.", params, matcher=matcher) == 'no_rule_hits'
+    assert fast_path.check("I am here.", params, matcher=matcher) is None
+    assert fast_path.check("I am here.", params) is None
+
+    fast_path.remember("I am here.", params)
+    assert fast_path.check("I am here.", params) == 'negative_cache'
+    assert fast_path.check("I am here.", ('en', 'o200k_base')) is None
+
+    stats = fast_path.stats()
+    assert stats['checked'] == 6 and stats['skipped'] == 3
+    assert stats['skipped_by_reason'] == {'code': 1, 'no_rule_hits': 1, 'negative_cache': 1}
+    assert stats['skipped_chars'] == len(PYTHON_CODE) + len("The report covers revenue.") + len("I am here.")
+
+
+if __name__ == "__main__":
+    tests = [
+        test_classify,
+        test_fast_path_skips_and_counts,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Fast path tests passed!")
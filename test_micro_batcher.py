@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for micro-batching and the Selective Context unit selection
+"""
+
+import threading
+import time
+
+from micro_batcher import MicroBatcher
+from model_pool import PoolBusy
+from selective_context import lexical_units, percentile, select_units, unit_scores
+
+
+def test_concurrent_items_share_a_batch():
+    """Items submitted together run as one batch, and each gets its own result"""
+    batches = []
+
+    def run_batch(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(run_batch, max_batch=4, max_wait_ms=200)
+    futures = [batcher.submit(i) for i in range(6)]
+    assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6, 8, 10]
+    # A full batch goes at once, the rest after max_wait_ms
+    assert batches == [[0, 1, 2, 3], [4, 5]]
+
+    stats = batcher.stats()
+    assert stats['batches'] == 2 and stats['items'] == 6 and stats['full_batches'] == 1
+    assert stats['batch_sizes'] == {2: 1, 4: 1}
+    assert stats['queue_delay_ms']['max'] >= 150
+    batcher.close()
+
+
+def test_burst_is_spread_over_free_slots():
+    """A burst arriving while every slot is free is split evenly between them"""
+    batches = []
+
+    def run_batch(items):
+        batches.append(len(items))
+        time.sleep(0.05)
+        return items
+
+    batcher = MicroBatcher(run_batch, max_batch=8, max_wait_ms=100, concurrency=4)
+    futures = [batcher.submit(i) for i in range(8)]
+    assert [future.result(timeout=5) for future in futures] == list(range(8))
+    assert batches == [2, 2, 2, 2]
+    batcher.close()
+
+
+def test_errors_and_backpressure():
+    """A failing batch fails its items, and a full queue rejects new items"""
+    release = threading.Event()
+
+    def run_batch(items):
+        release.wait(5)
+        if 'bad' in items:
+            raise ValueError("bad batch")
+        return items
+
+    batcher = MicroBatcher(run_batch, max_batch=1, max_wait_ms=0, max_pending=1)
+    running = batcher.submit('bad')
+    time.sleep(0.1)
+    waiting = batcher.submit('good')
+    try:
+        batcher.submit('rejected')
+        assert False, "expected PoolBusy"
+    except PoolBusy:
+        pass
+    release.set()
+    try:
+        running.result(timeout=5)
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    assert waiting.result(timeout=5) == 'good'
+    assert batcher.stats()['rejected'] == 1 and batcher.stats()['failed_batches'] == 1
+    batcher.close()
+
+
+def test_selective_context_selection():
+    """Units cover the text, token scores add up per unit, and low scorers are dropped"""
+    text = "The cat sat on the mat, and then it slept."
+    units = lexical_units(text, 'phrase')
+    assert ''.join(text[start:end] for start, end in units) == text
+    assert [text[start:end].strip() for start, end in units] == [
+        "The cat sat", "on", "the mat,", "and then", "it slept."
+    ]
+    assert lexical_units(text, 'sentence') == [(0, len(text))]
+
+    offsets = [(text.index(word), text.index(word) + len(word)) for word in ("cat", "mat", "slept")]
+    scores = unit_scores(units, offsets, [5.0, 1.0, 3.0])
+    assert scores == [5.0, 0.0, 1.0, 0.0, 3.0]
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert select_units(text, units, scores, 0.4) == "The cat sat the mat, it slept."
+    assert select_units(text, units, scores, 0) == text
+
+
+if __name__ == "__main__":
+    tests = [
+        test_concurrent_items_share_a_batch,
+        test_burst_is_spread_over_free_slots,
+        test_errors_and_backpressure,
+        test_selective_context_selection,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Micro-batcher tests passed!")
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Tests for the model worker pool, using a stand-in model
+"""
+
+import os
+import threading
+import time
+
+os.environ.setdefault('SEQUOIA_PREFORK', '1')
+
+import message_logger_service
+from model_pool import LocalModel, ModelPool, PoolBusy, PoolError, PoolTimeout
+
+
+class EchoModel:
+    """Stand-in for a compressor: fast, slow and failing methods"""
+
+    def compressgo(self, text, ratio):
+        return f"{text[:int(len(text) * ratio)]}|{os.getpid()}"
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return os.getpid()
+
+    def fail(self):
+        raise ValueError("bad input")
+
+
+def make_echo_model():
+    return EchoModel()
+
+
+def wait_ready(pool, count, timeout=60):
+    deadline = time.monotonic() + timeout
+    while pool.stats()['ready'] < count:
+        assert time.monotonic() < deadline, pool.stats()
+        time.sleep(0.05)
+
+
+def test_calls_run_in_workers():
+    """Calls run in other processes, in parallel, and model errors are reported"""
+    pool = ModelPool(make_echo_model, workers=2, queue_size=2, timeout=10)
+    try:
+        wait_ready(pool, 2)
+        compressed, pid = pool.call('compressgo', "abcdefghij", 0.3).split('|')
+        assert compressed == "abc" and int(pid) != os.getpid()
+
+        pids = []
+        threads = [threading.Thread(target=lambda: pids.append(pool.call('sleep', 0.5))) for _ in range(2)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.monotonic() - start < 0.9
+        assert len(set(pids)) == 2
+
+        try:
+            pool.call('fail')
+            assert False, "expected PoolError"
+        except PoolError as e:
+            assert "ValueError: bad input" in str(e)
+        assert pool.stats()['completed'] == 3 and pool.stats()['failed'] == 1
+    finally:
+        pool.close()
+
+
+def test_backpressure_and_timeouts():
+    """A full queue rejects calls, and a stuck call restarts its worker"""
+    pool = ModelPool(make_echo_model, workers=1, queue_size=0, timeout=0.5, queue_timeout=0.1)
+    try:
+        wait_ready(pool, 1)
+        busy = threading.Thread(target=lambda: pool.call('sleep', 0.3))
+        busy.start()
+        time.sleep(0.1)
+        try:
+            pool.call('compressgo', "text", 0.5)
+            assert False, "expected PoolBusy"
+        except PoolBusy:
+            pass
+        busy.join()
+
+        try:
+            pool.call('sleep', 5)
+            assert False, "expected PoolTimeout"
+        except PoolTimeout:
+            pass
+        wait_ready(pool, 1)
+        assert pool.call('compressgo', "text", 0.5).startswith("te|")
+        stats = pool.stats()
+        assert stats['rejected'] == 1 and stats['timeouts'] == 1 and stats['restarts'] == 1
+    finally:
+        pool.close()
+
+
+def test_warmup_before_ready():
+    """Workers run the warm-up call before taking requests, and a failing warm-up fails the pool"""
+    pool = ModelPool(make_echo_model, workers=1, warmup=('sleep', (0.3,)))
+    try:
+        assert pool.state() == 'loading' and not pool.is_ready()
+        wait_ready(pool, 1)
+        assert pool.state() == 'ready'
+        assert pool.stats()['last_startup']['warmup_seconds'] >= 0.3
+    finally:
+        pool.close()
+
+    pool = ModelPool(make_echo_model, workers=1, warmup=('fail', ()))
+    try:
+        deadline = time.monotonic() + 60
+        while pool.state() == 'loading':
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        assert pool.state() == 'failed'
+        assert "ValueError: bad input" in pool.stats()['last_start_error']
+    finally:
+        pool.close()
+
+
+def test_local_model_is_shared_with_forked_workers():
+    """A model loaded before fork answers in the child without loading again"""
+    model = LocalModel(make_echo_model, warmup=('sleep', (0,)), threads=2)
+    # Sized before the warm-up, since forked workers cannot resize torch's pools
+    assert os.environ['OMP_NUM_THREADS'] == '2' and model.stats()['threads_per_worker'] == 2
+    assert model.is_ready() and model.call('compressgo', 'abcd', 0.5) == f"ab|{os.getpid()}"
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write_end, model.call('compressgo', 'abcd', 0.5).encode())
+        os._exit(0)
+    os.close(write_end)
+    result = os.read(read_end, 100).decode()
+    os.waitpid(pid, 0)
+    assert result == f"ab|{pid}"
+    try:
+        model.call('fail')
+    except ValueError:
+        pass
+    assert model.stats()['completed'] == 1 and model.stats()['failed'] == 1
+
+
+def test_service_compresses_in_a_worker_forked_after_preload():
+    """The pre-fork server's sequence: preload in the master, fork, compress in the worker"""
+    text = "Could you please explain how the Lisbon office migrated its accounts in March? " * 3
+    message_logger_service.preload(workers=2)
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            message_logger_service.post_fork(2)
+            result = message_logger_service.compress_prompt(text, 0.5)
+            os.write(write_end, result['compressed'].encode() if result['success'] else b'failed')
+        finally:
+            os._exit(0)
+    os.close(write_end)
+    compressed = os.read(read_end, 10000).decode()
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    assert compressed and compressed != 'failed' and len(compressed) < len(text)
+
+
+if __name__ == "__main__":
+    tests = [
+        test_calls_run_in_workers,
+        test_backpressure_and_timeouts,
+        test_warmup_before_ready,
+        test_local_model_is_shared_with_forked_workers,
+        test_service_compresses_in_a_worker_forked_after_preload,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Model pool tests passed!")
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Tests for the compiled phrase matcher used by rule-based compression
+"""
+
+import os
+import random
+import re
+
+from rule_matcher import PhraseMatcher, apply_edits, compose_edits
+from rule_packs import RULES_DIR, build_matcher, read_pack_file
+
+RULES = [
+    ("I am", "I'm", True),
+    ("I would", "I'd", True),
+    ("do not", "don't", True),
+    ("is not", "isn't", True),
+    ("I would like to", "I want to", True),
+    ("really very", "very", False),
+    ("very good", "good", False),
+    ("in order to", "to", False),
+    ("artificial intelligence", "AI", True),
+    ("application programming interface", "API", True),
+]
+
+
+def test_basic_substitutions():
+    """Each rule is applied wherever its phrase appears"""
+    matcher = PhraseMatcher(RULES)
+    assert matcher.sub("I am here in order to help") == "I'm here to help"
+    assert matcher.sub("this is very good") == "this is good"
+    assert matcher.sub("we do not know") == "we don't know"
+
+
+def test_capitalized_variants():
+    """Capitalized phrases get capitalized replacements, acronyms stay intact"""
+    matcher = PhraseMatcher(RULES)
+    assert matcher.sub("Do not stop") == "Don't stop"
+    assert matcher.sub("Artificial intelligence rocks") == "AI rocks"
+    assert matcher.sub("Application programming interface docs") == "API docs"
+    # Rules without capitalized variants only match their exact form
+    assert matcher.sub("Very good") == "Very good"
+
+
+def test_rules_apply_in_order():
+    """Earlier rules win where rules overlap, and later rules see their output"""
+    matcher = PhraseMatcher(RULES)
+    assert matcher.sub("I would like to learn") == "I'd like to learn"
+    assert matcher.sub("I would say so") == "I'd say so"
+    assert matcher.sub("It is really very good.") == "It is good."
+    assert PhraseMatcher(RULES[4:]).sub("I would like to learn") == "I want to learn"
+
+
+def test_word_boundaries():
+    """Phrases only match whole words"""
+    matcher = PhraseMatcher(RULES)
+    assert matcher.sub("This is nothing") == "This is nothing"
+    assert matcher.sub("this is notable") == "this is notable"
+    assert matcher.sub("redo not now") == "redo not now"
+    assert matcher.sub("(do not)") == "(don't)"
+
+
+def test_deletions_and_whitespace():
+    """Fillers are removed case-insensitively and whitespace is collapsed"""
+    matcher = PhraseMatcher(RULES, deletions=["basically", "of course", "honestly"],
+                            collapse_whitespace=True)
+    assert matcher.sub("  Basically,  I am\n\nhere ") == ", I'm here"
+    assert matcher.sub("it is OF COURSE very good") == "it is good"
+    assert matcher.sub("we know honestly\n\nNext") == "we know Next"
+    assert matcher.sub("basicallyness stays") == "basicallyness stays"
+
+
+def test_replacements_respect_deletions():
+    """A rule never emits a phrase that deletions would remove"""
+    matcher = PhraseMatcher([("very honestly", "honestly", False)],
+                            deletions=["honestly"], collapse_whitespace=True)
+    assert matcher.sub("I am very honestly sure") == "I am sure"
+
+
+def replace_loop(text, pack, original=False):
+    """
+    The replace-per-rule loop the matcher replaced. Unless original is
+    set, phrases only match whole words and capitalized replacements keep
+    acronyms intact, the two intended differences from the old loop.
+    """
+    capitalize = str.capitalize if original else lambda phrase: phrase[:1].upper() + phrase[1:]
+    compressed = text
+    for group in pack['rules']:
+        for phrase, replacement in group['phrases'].items():
+            forms = [(phrase, replacement)]
+            if group['match_capitalized']:
+                forms.append((phrase.capitalize(), capitalize(replacement)))
+            for phrase, replacement in forms:
+                if phrase not in compressed:
+                    continue
+                if original:
+                    compressed = compressed.replace(phrase, replacement)
+                else:
+                    compressed = re.sub(r'(?<!\w)' + re.escape(phrase) + r'(?!\w)',
+                                        lambda match: replacement, compressed)
+    for filler in pack['deletions']:
+        compressed = re.sub(r'\b' + re.escape(filler) + r'\b', '', compressed, flags=re.IGNORECASE)
+    return ' '.join(compressed.split())
+
+
+EN_PACK = read_pack_file(os.path.join(RULES_DIR, 'en.json'))[1]
+
+PROMPTS = [
+    "It is really very good.",
+    "I would like to know more about how it works.",
+    "I am wondering if you could help me understand more about neural networks.",
+    "Could you please explain, in order to learn more about machine learning, what it is?",
+    "Basically, I would appreciate if you could make the user interface very simple.",
+    "Honestly, it would be great if we do not have to do this again.  Of course it is not very hard.",
+    "I have been thinking: would it be possible to make it very fast? I was hoping that you will.",
+    "We are really quite sure they will not mind.\n\nIt is, of course, very very important.",
+]
+
+
+def test_same_output_as_the_replace_loop():
+    """The bundled pack rewrites prompts exactly like the old replace loop"""
+    matcher = build_matcher(EN_PACK)
+    for prompt in PROMPTS:
+        assert matcher.sub(prompt) == replace_loop(prompt, EN_PACK, original=True), prompt
+
+
+def test_intended_differences_from_the_replace_loop():
+    """Only whole words are rewritten, and acronyms stay capitalized"""
+    matcher = build_matcher(EN_PACK)
+    assert replace_loop("The summit is near", EN_PACK, original=True) == "The summit's near"
+    assert matcher.sub("The summit is near") == "The summit is near"
+    assert replace_loop("Machine learning helps", EN_PACK, original=True) == "Ml helps"
+    assert matcher.sub("Machine learning helps") == "ML helps"
+
+
+def test_random_text_matches_the_ordered_loop():
+    """Any mix of rule phrases, fillers and punctuation gives the ordered loop's output"""
+    matcher = build_matcher(EN_PACK)
+    words = set()
+    for group in EN_PACK['rules']:
+        for phrase, replacement in group['phrases'].items():
+            words.update(phrase.split() + replacement.split() + [phrase.split()[0].capitalize()])
+    words = sorted(words) + EN_PACK['deletions'] + [',', '.', '\n', 'x', "I'd"]
+    # Not only spaces: fillers after punctuation keep the space that follows them
+    separators = [' '] * 6 + ['-', '/', "'", ',', ', ', '  ']
+    rng = random.Random(5)
+    for _ in range(3000):
+        text = ''.join(rng.choice(separators) + rng.choice(words) for _ in range(rng.randint(0, 20)))[1:]
+        compressed, edits = matcher.rewrite(text)
+        assert compressed == matcher.sub(text) == replace_loop(text, EN_PACK), text
+        assert apply_edits(text, edits) == compressed
+
+
+def test_fillers_after_punctuation_keep_the_space():
+    """Deleting a filler right after punctuation does not join the words around it"""
+    matcher = build_matcher(EN_PACK)
+    for text in ('Learn/definitely computer science', 'one-indeed two', 'Go, basically now'):
+        assert matcher.sub(text) == matcher.rewrite(text)[0] == replace_loop(text, EN_PACK), text
+    assert matcher.sub('one-indeed two') == 'one- two'
+
+
+def test_compose_edits():
+    """Composed edits have the effect of applying both lists in turn"""
+    rng = random.Random(3)
+
+    def random_edits(text):
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 6))))
+        return [(cuts[k], cuts[k + 1], ''.join(rng.choice('ab ') for _ in range(rng.randint(0, 3))))
+                for k in range(0, len(cuts) - 1, 2)]
+
+    for _ in range(3000):
+        text = ''.join(rng.choice('abcd ') for _ in range(rng.randint(0, 20)))
+        first = random_edits(text)
+        middle = apply_edits(text, first)
+        second = random_edits(middle)
+        edits = compose_edits(text, first, second)
+        assert apply_edits(text, edits) == apply_edits(middle, second)
+        assert all(start <= end <= following for (start, end, _), (following, _, _) in zip(edits, edits[1:]))
+
+
+def test_empty_inputs():
+    """Empty text and empty rule sets are handled"""
+    assert PhraseMatcher(RULES).sub("") == ""
+    assert PhraseMatcher([]).sub("I am here") == "I am here"
+
+
+if __name__ == "__main__":
+    tests = [
+        test_basic_substitutions,
+        test_capitalized_variants,
+        test_rules_apply_in_order,
+        test_word_boundaries,
+        test_deletions_and_whitespace,
+        test_replacements_respect_deletions,
+        test_same_output_as_the_replace_loop,
+        test_intended_differences_from_the_replace_loop,
+        test_random_text_matches_the_ordered_loop,
+        test_fillers_after_punctuation_keep_the_space,
+        test_compose_edits,
+        test_empty_inputs,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Rule matcher tests passed!")
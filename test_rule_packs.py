@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Tests for rule pack loading, site selection and hot reloading
+"""
+
+import json
+import os
+import tempfile
+
+from rule_packs import RULES_DIR, RulePackRegistry, compile_rule_pack
+
+GROK_PACK = {
+    "name": "grok",
+    "version": "0.1.0",
+    "sites": ["grok.com"],
+    "rules": [{"group": "greetings", "match_capitalized": True, "phrases": {"hello there": "hi"}}],
+}
+
+
+def write_pack(directory, filename, pack):
+    path = os.path.join(directory, filename)
+    with open(path, 'w') as f:
+        json.dump(pack, f)
+    return path
+
+
+def test_default_pack_compresses():
+    """The bundled English pack reproduces the built-in rules"""
+    pack = compile_rule_pack(os.path.join(RULES_DIR, 'en.json'))
+    assert pack.name == 'en'
+    compressed = pack.matcher.sub("Basically, I would like to learn about artificial intelligence.")
+    assert compressed == ", I'd like to learn about AI."
+
+
+def test_site_selection_and_reload():
+    """Packs are picked by site and swapped in when their file changes"""
+    with tempfile.TemporaryDirectory() as rules_dir:
+        write_pack(rules_dir, 'en.json', {"name": "en", "rules": []})
+        registry = RulePackRegistry(rules_dir)
+        assert registry.for_url('https://grok.com/chat').name == 'en'
+
+        path = write_pack(rules_dir, 'grok.json', GROK_PACK)
+        assert registry.reload()
+        assert registry.for_url('https://grok.com/chat').name == 'grok'
+        assert registry.for_url('https://chat.openai.com/c/1').name == 'en'
+        assert registry.for_url(None).name == 'en'
+        assert registry.for_url('https://grok.com/').matcher.sub("Hello there friend") == "Hi friend"
+
+        # A broken edit keeps the previously compiled version in service
+        with open(path, 'w') as f:
+            f.write('{"name": "grok", ')
+        registry.reload()
+        assert registry.get('grok').version == '0.1.0'
+
+
+if __name__ == "__main__":
+    tests = [
+        test_default_pack_compresses,
+        test_site_selection_and_reload,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Rule pack tests passed!")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for the Selective Context score cache
+"""
+
+from score_cache import ENTRY_OVERHEAD, ScoreCache
+
+
+def scores(count):
+    return [(i * 4, i * 4 + 3) for i in range(count)], [i / 3 for i in range(count)]
+
+
+def test_scores_round_trip_with_hit_rate():
+    """Stored scores come back exactly, keyed by text, model and window start"""
+    cache = ScoreCache()
+    key = cache.key('gpt2/fp32', "Some window text.", 0)
+    assert key != cache.key('gpt2/int8', "Some window text.", 0)
+    assert key != cache.key('gpt2/fp32', "Some window text.", 5)
+    assert cache.get(key) is None
+    cache.put(key, scores(10))
+    assert cache.get(key) == scores(10)
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['hit_rate'] == 0.5
+    assert stats['hit_tokens'] == 10
+
+
+def test_memory_is_bounded():
+    """The least recently used windows are evicted to stay within max_bytes"""
+    entry_bytes = ENTRY_OVERHEAD + 24 * 100
+    cache = ScoreCache(max_bytes=3 * entry_bytes)
+    keys = [cache.key('m', f"window {i}") for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, scores(100))
+    cache.get(keys[0])
+    cache.put(keys[3], scores(100))
+    assert cache.get(keys[1]) is None and cache.get(keys[0]) is not None
+    stats = cache.stats()
+    assert stats['entries'] == 3 and stats['bytes'] == 3 * entry_bytes and stats['evictions'] == 1
+    # A window too large for the whole cache is not kept
+    cache.put(cache.key('m', "huge"), scores(1000))
+    assert cache.stats()['entries'] == 3
+
+
+if __name__ == "__main__":
+    tests = [
+        test_scores_round_trip_with_hit_rate,
+        test_memory_is_bounded,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Score cache tests passed!")
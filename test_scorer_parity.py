@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Parity of the in-repo Selective Context with a reference implementation
+and PCToolkit's SCCompressor, and of the quantized and ONNX scorer
+runtimes with fp32
+
+Uses a small randomly initialised GPT-2 and tokenizer built on the spot,
+so no model download is needed. Needs torch and transformers, and
+onnx/onnxruntime for the ONNX runtimes; skipped without them. The
+comparison with SCCompressor needs PCToolkit and the real model.
+"""
+
+import re
+import tempfile
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+
+from selective_context import MODEL_NAME, SelectiveContext, lexical_units
+
+PROMPTS = [
+    "Could you please explain how neural networks learn from examples?",
+    "I am planning a trip to Japan in April, what should I pack for it?",
+    "The quarterly report covers revenue, churn and hiring across all regions. " * 12,
+    "Short one.",
+]
+TOKENIZER_CORPUS = PROMPTS * 20 + ["the quick brown fox jumps over the lazy dog"] * 20
+
+
+def build_tiny_model(directory):
+    """Save a two-layer GPT-2 with a small byte-level BPE vocabulary to directory"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import GPT2Config, GPT2LMHeadModel, GPT2TokenizerFast
+
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train_from_iterator(TOKENIZER_CORPUS, trainers.BpeTrainer(
+        vocab_size=400, special_tokens=['<|endoftext|>'],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    ))
+    tokenizer = GPT2TokenizerFast(
+        tokenizer_object=bpe, bos_token='<|endoftext|>', eos_token='<|endoftext|>'
+    )
+    tokenizer.save_pretrained(directory)
+
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=len(tokenizer), n_positions=64, n_embd=64, n_layer=2, n_head=2,
+        bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id
+    )
+    GPT2LMHeadModel(config).save_pretrained(directory)
+
+
+def self_info_difference(scorer, baseline):
+    """Mean and largest absolute difference in token self-information over PROMPTS"""
+    differences = []
+    for (offsets, info), (base_offsets, base_info) in zip(
+            scorer.self_info_batch(PROMPTS), baseline.self_info_batch(PROMPTS)):
+        assert offsets == base_offsets
+        differences.extend(abs(a - b) for a, b in zip(info, base_info))
+    return sum(differences) / len(differences), max(differences)
+
+
+def reference_compress(directory, text, ratio):
+    """
+    Selective Context done the plain way: one unbatched forward pass,
+    each lexical unit scored by the tokens ending in it, and the units
+    below the ratio percentile of those scores dropped
+    """
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(directory, use_fast=True)
+    model = AutoModelForCausalLM.from_pretrained(directory).eval()
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+    input_ids = torch.tensor([[tokenizer.bos_token_id] + encoding['input_ids']])
+    with torch.no_grad():
+        log_probs = torch.log_softmax(model(input_ids).logits[0, :-1], dim=-1)
+    info = -log_probs[torch.arange(len(encoding['input_ids'])), input_ids[0, 1:]]
+
+    units = lexical_units(text)
+    scores = np.zeros(len(units))
+    for (start, end), token_info in zip(encoding['offset_mapping'], info.tolist()):
+        if end > start:
+            holder = next((k for k, (_, unit_end) in enumerate(units) if unit_end >= end), len(units) - 1)
+            scores[holder] += token_info
+    threshold = np.percentile(scores, ratio * 100)
+    return ''.join(text[start:end] for (start, end), score in zip(units, scores) if score >= threshold).strip()
+
+
+def test_compression_matches_a_reference_selective_context():
+    """Batched scoring and unit selection keep the units the plain algorithm keeps"""
+    with tempfile.TemporaryDirectory() as directory:
+        build_tiny_model(directory)
+        scorer = SelectiveContext(directory, runtime='fp32')
+        # Prompts within the tiny model's context, which the reference does not chunk
+        prompts = [prompt for prompt in PROMPTS if len(scorer.tokenizer(prompt)['input_ids']) < 63]
+        assert len(prompts) >= 2
+        for prompt in prompts:
+            for ratio in (0.2, 0.4, 0.6):
+                assert scorer.compressgo(prompt, ratio) == reference_compress(directory, prompt, ratio)
+
+
+def test_compression_agrees_with_pctoolkit_sccompressor():
+    """With the real model, the in-repo backend keeps nearly the words SCCompressor keeps"""
+    pytest.importorskip('pctoolkit')
+    from model_pool import load_prompt_compressor
+
+    reference = load_prompt_compressor('SCCompressor', 'cpu')
+    scorer = SelectiveContext(MODEL_NAME, runtime='fp32')
+    words = lambda text: set(re.findall(r"\w+", text.lower()))
+    for prompt in PROMPTS[:3]:
+        expected = reference.compressgo(prompt, 0.4)
+        expected = expected.get('compressed_prompt', expected) if isinstance(expected, dict) else expected
+        kept, expected = words(scorer.compressgo(prompt, 0.4)), words(expected)
+        assert len(kept & expected) / max(1, len(kept | expected)) >= 0.8, prompt
+
+
+def test_batched_scores_match_single_prompts():
+    """Padding and chunking past the context do not change a prompt's scores"""
+    with tempfile.TemporaryDirectory() as directory:
+        build_tiny_model(directory)
+        scorer = SelectiveContext(directory, runtime='fp32')
+        batched = scorer.self_info_batch(PROMPTS)
+        for prompt, (offsets, info) in zip(PROMPTS, batched):
+            single_offsets, single_info = scorer.self_info_batch([prompt])[0]
+            assert offsets == single_offsets
+            assert max(abs(a - b) for a, b in zip(info, single_info)) < 1e-4
+
+
+def test_int8_matches_fp32():
+    """Dynamic int8 quantization stays close to the fp32 scores"""
+    with tempfile.TemporaryDirectory() as directory:
+        build_tiny_model(directory)
+        baseline = SelectiveContext(directory, runtime='fp32')
+        quantized = SelectiveContext(directory, runtime='int8')
+        mean, largest = self_info_difference(quantized, baseline)
+        assert mean < 0.05 and largest < 0.25
+
+
+def test_onnx_matches_fp32():
+    """The ONNX export scores like PyTorch, and its int8 copy stays close"""
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    from export_scorer import export_onnx
+
+    with tempfile.TemporaryDirectory() as directory:
+        build_tiny_model(directory)
+        export_onnx(directory, directory)
+        baseline = SelectiveContext(directory, runtime='fp32')
+
+        exported = SelectiveContext(directory, runtime='onnx', onnx_dir=directory)
+        mean, largest = self_info_difference(exported, baseline)
+        assert largest < 1e-3
+
+        quantized = SelectiveContext(directory, runtime='onnx-int8', onnx_dir=directory)
+        mean, largest = self_info_difference(quantized, baseline)
+        assert mean < 0.05 and largest < 0.25
+
+
+if __name__ == "__main__":
+    tests = [
+        test_compression_matches_a_reference_selective_context,
+        test_compression_agrees_with_pctoolkit_sccompressor,
+        test_batched_scores_match_single_prompts,
+        test_int8_matches_fp32,
+        test_onnx_matches_fp32,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Scorer parity tests passed!")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests that segment-level compression matches compressing the whole prompt
+"""
+
+import random
+import threading
+import time
+
+from rule_matcher import PhraseMatcher, apply_edits
+from segment_cache import SegmentCache, compress_segments, count_segments, rewrite_segments, segment_spans
+from test_token_accounting import MATCHER, WORDS, count_tokens
+
+SENTENCES = WORDS + ["Basically.", "Done!", "Why?", "\n\n", "\n \n ", "I am.", "honestly."]
+
+
+def random_document(rng, max_words=60):
+    return rng.choice([' ', '', '\n', ' \n\n']).join(
+        rng.choice(SENTENCES) for _ in range(rng.randint(0, max_words))
+    )
+
+
+def test_segment_spans():
+    """Segments break after sentences and at blank lines, leaving the whitespace between them out"""
+    text = "One. Two!  Three\n\n  Four?\nFive"
+    segments = [text[start:end] for start, end in segment_spans(text, min_length=0)]
+    assert segments == ["One.", "Two!", "Three", "Four?", "Five"]
+    segments = [text[start:end] for start, end in segment_spans(text, sentences=False)]
+    assert segments == ["One. Two!  Three", "Four?\nFive"]
+    assert segment_spans("  \n\nOne.") == [(0, 8)]
+
+
+def test_rewrite_segments_matches_whole_text():
+    """Stitched segment rewrites equal a whole-text rewrite, with or without whitespace collapse"""
+    rng = random.Random(17)
+    plain = PhraseMatcher([("I am", "I'm", True)], deletions=["basically"])
+    for matcher in (MATCHER, plain):
+        cache = SegmentCache()
+        for _ in range(3000):
+            text = random_document(rng)
+            compressed, edits = rewrite_segments(matcher, text, cache, 'rules')
+            assert compressed == matcher.rewrite(text)[0]
+            assert apply_edits(text, edits) == compressed
+    assert cache.hits > 0
+
+
+def test_count_segments_matches_full_encode():
+    """Summed segment counts equal the token count of the whole text"""
+    rng = random.Random(19)
+    cache = SegmentCache()
+    for _ in range(3000):
+        text = random_document(rng)
+        assert count_segments(count_tokens, text, cache, 'tokens') == count_tokens(text)
+
+
+def test_only_changed_paragraphs_are_recompressed():
+    """Resending an edited document only compresses the edited paragraph again"""
+    paragraphs = [f"Paragraph {i} talks about topic {i}." for i in range(20)]
+    calls = []
+
+    def compress(paragraph):
+        calls.append(paragraph)
+        return paragraph.upper()
+
+    cache = SegmentCache()
+    text = "\n\n".join(paragraphs)
+    assert compress_segments(compress, text, cache, 'model') == text.upper()
+    assert len(calls) == 20
+
+    paragraphs[7] = "Paragraph 7 was edited."
+    edited = "\n\n".join(paragraphs)
+    assert compress_segments(compress, edited, cache, 'model') == edited.upper()
+    assert calls[20:] == ["Paragraph 7 was edited."]
+
+
+def test_paragraphs_compress_concurrently_up_to_the_limit():
+    """Paragraphs are compressed at once, never more than concurrency, in text order"""
+    paragraphs = [f"Paragraph {i} talks about topic {i}." for i in range(12)]
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def compress(paragraph):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return paragraph.upper()
+
+    text = "\n\n".join(paragraphs)
+    assert compress_segments(compress, text, SegmentCache(), 'model', concurrency=3) == text.upper()
+    assert 1 < peak[0] <= 3
+
+
+if __name__ == "__main__":
+    tests = [
+        test_segment_spans,
+        test_rewrite_segments_matches_whole_text,
+        test_count_segments_matches_full_encode,
+        test_only_changed_paragraphs_are_recompressed,
+        test_paragraphs_compress_concurrently_up_to_the_limit,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Segment cache tests passed!")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Tests for the statistical token importance scorer
+
+Uses a small byte-level tiktoken encoding built on the spot, so no
+vocabulary download is needed.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import tiktoken
+
+from selective_context import lexical_units
+from statistical_scorer import StatisticalScorer, build_table, lengths_path, token_byte_lengths
+
+CORPUS = [
+    "the report is in the folder and the folder is on the desk",
+    "the cat is on the mat and the dog is in the garden",
+    "please send the report to the team before the meeting",
+]
+MERGES = [b"th", b"the", b" the", b"in", b" in", b"is", b" is", b"on", b" on", b"an", b"and", b" and"]
+
+
+def tiny_encoding():
+    """Byte-level BPE with a few English merges"""
+    ranks = {bytes([byte]): byte for byte in range(256)}
+    for merge in MERGES:
+        ranks[merge] = len(ranks)
+    return tiktoken.Encoding(
+        'tiny', pat_str=r"""'s|'t| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""",
+        mergeable_ranks=ranks, special_tokens={}
+    )
+
+
+def build_scorer(directory, kind='unigram', lengths=True):
+    """A scorer over a table written like build_stat_table.py does"""
+    encoder = tiny_encoding()
+    path = os.path.join(directory, f'tiny.{kind}.npy')
+    np.save(path, build_table([encoder.encode_ordinary(text) for text in CORPUS], encoder.n_vocab, kind))
+    if lengths:
+        np.save(lengths_path('tiny', directory), token_byte_lengths(encoder))
+    return StatisticalScorer(path, encoder)
+
+
+def test_table_is_memory_mapped_and_ranks_common_tokens_low():
+    """Frequent tokens carry less information than rare ones, in both table kinds"""
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in ('unigram', 'idf'):
+            scorer = build_scorer(directory, kind)
+            assert isinstance(scorer.table, np.memmap) and scorer.table.dtype == np.float32
+            the, = scorer.encoder.encode_ordinary(" the")
+            z, = scorer.encoder.encode_ordinary("z")
+            assert scorer.table[the] < scorer.table[z]
+
+
+def test_token_lengths_are_memory_mapped_from_next_to_the_table():
+    """Lengths written by build_stat_table.py are mapped; without them they are computed"""
+    with tempfile.TemporaryDirectory() as directory:
+        scorer = build_scorer(directory)
+        assert isinstance(scorer.token_lengths, np.memmap)
+        computed = token_byte_lengths(scorer.encoder)
+        assert np.array_equal(scorer.token_lengths, computed)
+    with tempfile.TemporaryDirectory() as directory:
+        scorer = build_scorer(directory, lengths=False)
+        assert not isinstance(scorer.token_lengths, np.memmap)
+        assert np.array_equal(scorer.token_lengths, computed)
+
+
+def test_token_spans_match_the_encoder():
+    """Vectorized character offsets agree with tiktoken's, including multi-byte text"""
+    with tempfile.TemporaryDirectory() as directory:
+        scorer = build_scorer(directory)
+        assert all(len(array) == 0 for array in scorer.self_info(""))
+        for text in ("the cat is on the mat", "naïve café — déjà vu ✓ 日本語 is fine"):
+            starts, ends, info = scorer.self_info(text)
+            tokens = scorer.encoder.encode_ordinary(text)
+            _, expected = scorer.encoder.decode_with_offsets(tokens)
+            assert len(starts) == len(info) == len(tokens) and ends[-1] == len(text)
+            # A token starting inside a character may be placed at either edge of it
+            raw = text.encode('utf-8')
+            byte_starts = np.cumsum(scorer.token_lengths[tokens]) - scorer.token_lengths[tokens]
+            for token, byte_start in enumerate(byte_starts):
+                if raw[byte_start] & 0xC0 != 0x80:
+                    assert starts[token] == expected[token]
+
+
+def test_compression_respects_the_ratio():
+    """The requested share of lexical units is dropped, the least informative first"""
+    with tempfile.TemporaryDirectory() as directory:
+        scorer = build_scorer(directory)
+        text = ("The zebra quartet played jazz in the park, and the crowd in the park was quiet. "
+                "Then the zebra quartet left the park for the night. ") * 3
+        units = lexical_units(text, 'phrase')
+        for ratio in (0.0, 0.25, 0.5, 0.75):
+            scored = scorer.scored(text)
+            kept = sum(score >= np.percentile(scored.scores, ratio * 100) for score in scored.scores)
+            assert abs((len(units) - kept) / len(units) - ratio) < 0.15
+            compressed = scorer.compress(text, ratio)
+            assert len(compressed) <= len(text)
+        assert scorer.compress(text, 0) == text
+        assert 'zebra' in scorer.compress(text, 0.5)
+
+
+if __name__ == "__main__":
+    tests = [
+        test_table_is_memory_mapped_and_ranks_common_tokens_low,
+        test_token_lengths_are_memory_mapped_from_next_to_the_table,
+        test_token_spans_match_the_encoder,
+        test_compression_respects_the_ratio,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Statistical scorer tests passed!")
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Tests for streaming compression of large pastes
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+from deadline import RequestCancelled
+from stream_compression import Segmenter, StreamRun, stream_events, with_error_event
+
+SENTENCES = [f"Sentence number {n} talks about the migration of account {n * 7}." for n in range(400)]
+TEXT = ' '.join(SENTENCES[:200]) + '\n\n' + ' '.join(SENTENCES[200:])
+
+
+def segments_of(text, chunk_size, max_chars=600, min_chars=150):
+    segmenter = Segmenter(max_chars, min_chars)
+    data = text.encode('utf-8')
+    segments = []
+    for start in range(0, len(data), chunk_size):
+        segments += segmenter.feed(data[start:start + chunk_size])
+    return segments + segmenter.finish()
+
+
+def test_segments_follow_sentences_and_content():
+    """Segments rejoin to the text, end at sentence ends, and realign after new text in front"""
+    segments = segments_of(TEXT, 97)
+    assert ''.join(segments) == TEXT and all(len(segment) <= 600 for segment in segments)
+    assert all(segment.rstrip().endswith('.') for segment in segments)
+    shifted = segments_of("A new opening paragraph was added here. " * 5 + TEXT, 1000)
+    assert len(set(segments[-10:]) & set(shifted)) == 10
+    # Multi-byte characters split across reads decode intact
+    accented = "Café déjà vu, naïve façade. " * 100
+    assert ''.join(segments_of(accented, 7)) == accented
+
+
+def test_segments_are_sent_in_order_with_bounded_reads():
+    """Results come back in text order; the body is only read a few segments ahead"""
+    read = []
+    sent = []
+
+    def chunks():
+        data = TEXT.encode()
+        for start in range(0, len(data), 200):
+            read.append(start)
+            yield data[start:start + 200]
+
+    def slow_upper(segment, deadline):
+        time.sleep(0.01 if len(segment) % 2 else 0.03)
+        return {'compressed': segment.strip().upper(), 'tier': 'rules'}
+
+    for segment, result in StreamRun(chunks(), slow_upper, in_flight=3, segmenter=Segmenter(600, 150)):
+        sent.append(segment)
+        # At most in_flight segments and one read of 200 bytes ahead of what was sent
+        assert len(''.join(sent)) + 4 * 600 + 200 >= read[-1]
+        assert result['compressed'] == segment.strip().upper()
+    assert ''.join(sent) == TEXT
+
+
+def test_one_large_read_stays_within_in_flight():
+    """Segments cut from a single large read are submitted in_flight at a time"""
+    lock = threading.Lock()
+    outstanding = [0, 0]
+    sent = []
+
+    def counted(segment, deadline):
+        with lock:
+            outstanding[0] += 1
+            outstanding[1] = max(outstanding[1], outstanding[0])
+        time.sleep(0.005)
+        with lock:
+            outstanding[0] -= 1
+        return {'compressed': segment, 'tier': 'rules'}
+
+    run = StreamRun([TEXT.encode()], counted, in_flight=3, segmenter=Segmenter(600, 150))
+    for segment, _ in run:
+        sent.append(segment)
+        # Submitted, not only running: the ones waiting for a thread count too
+        assert len(run._pending) <= 3
+    assert ''.join(sent) == TEXT and len(sent) > 10 and outstanding[1] <= 3
+
+
+def test_cancel_gives_up_on_running_segments():
+    """Cancelling drops queued segments and cancels the deadlines of running ones"""
+    started = threading.Event()
+    outcomes = []
+
+    def blocked(segment, deadline):
+        started.set()
+        try:
+            deadline.wait(Future())
+        except RequestCancelled as e:
+            outcomes.append(e)
+        return {'compressed': segment, 'tier': 'fallback'}
+
+    run = StreamRun([TEXT], blocked, segmenter=Segmenter(600, 150))
+    threading.Timer(0.1, run.cancel).start()
+    sent = []
+    try:
+        for segment, _ in run:
+            sent.append(segment)
+        assert False, "a cancelled stream goes on"
+    except RequestCancelled:
+        pass
+    # Running segments return early; the rest never start
+    assert started.is_set() and outcomes and len(sent) <= len(outcomes) < len(segments_of(TEXT, len(TEXT)))
+
+    # Input that stops because the client went away is not finished as if it had ended
+    def cut_off():
+        yield TEXT[:300]
+        raise RequestCancelled('The client disconnected')
+
+    compressed = []
+    try:
+        for segment, _ in StreamRun(cut_off(), lambda segment, deadline: compressed.append(segment) or {}):
+            pass
+        assert False, "a cut-off stream ends normally"
+    except RequestCancelled:
+        pass
+    assert compressed == []
+
+
+def test_events_rebuild_the_compressed_text():
+    """Segment events keep the breaks between segments and end with the totals"""
+    results = [("One two three.\n\n", {'compressed': 'One three.', 'tier': 'model', 'original_tokens': 4,
+                                       'compressed_tokens': 3}),
+               ("Four five.", {'compressed': 'Four.', 'tier': 'fallback', 'original_tokens': 3,
+                               'compressed_tokens': 2})]
+    lines = [json.loads(line) for line in stream_events(results)]
+    assert ''.join(line['compressed'] for line in lines[:-1]) == "One three.\n\nFour."
+    assert lines[-1]['done'] and lines[-1]['segments'] == 2 and lines[-1]['compressed_tokens'] == 5
+    assert lines[-1]['tiers'] == {'model': 1, 'fallback': 1}
+    events = list(stream_events(results, sse=True))
+    assert events[0].startswith('event: segment\ndata: {') and events[-1].startswith('event: done\n')
+
+
+def test_failure_ends_with_an_error_event():
+    """A stream that fails part way says so in its last line; a cancelled one just stops"""
+    def failing(error):
+        yield "One two three.", {'compressed': 'One three.', 'tier': 'model'}
+        raise error
+
+    lines = list(with_error_event(stream_events(failing(ValueError("model crashed")))))
+    assert json.loads(lines[0])['index'] == 0
+    assert json.loads(lines[-1]) == {'error': 'ValueError: model crashed'} and len(lines) == 2
+    events = list(with_error_event(stream_events(failing(ValueError("model crashed")), sse=True), sse=True))
+    assert events[-1] == 'event: error\ndata: {"error": "ValueError: model crashed"}\n\n'
+    assert len(list(with_error_event(stream_events(failing(RequestCancelled("gone")))))) == 1
+
+
+if __name__ == "__main__":
+    tests = [
+        test_segments_follow_sentences_and_content,
+        test_segments_are_sent_in_order_with_bounded_reads,
+        test_one_large_read_stays_within_in_flight,
+        test_cancel_gives_up_on_running_segments,
+        test_events_rebuild_the_compressed_text,
+        test_failure_ends_with_an_error_event,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Stream compression tests passed!")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Tests that incremental token accounting matches a full re-encode
+"""
+
+import random
+
+import tiktoken
+
+from rule_matcher import PhraseMatcher, apply_edits
+from token_accounting import count_after_edits, diff_edits
+
+# The cl100k_base pre-tokenizer pattern; the vocabulary below is a small
+# byte-level BPE so the test runs without downloading the real one
+CL100K_PATTERN = (
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+|"""
+    r""" ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|\s+(?!\S)|\s"""
+)
+MERGES = [b" t", b" th", b" the", b"he", b"in", b" I", b"'m", b" a", b" am",
+          b"  ", b"\n\n", b" \n", b".\n", b" v", b" ve", b" ver", b" very"]
+
+
+def make_encoding():
+    ranks = {bytes([i]): i for i in range(256)}
+    for merge in MERGES:
+        for k in range(2, len(merge) + 1):
+            ranks.setdefault(merge[:k], len(ranks))
+    return tiktoken.Encoding("test_cl100k", pat_str=CL100K_PATTERN,
+                             mergeable_ranks=ranks, special_tokens={})
+
+
+ENCODING = make_encoding()
+
+
+def count_tokens(text):
+    return len(ENCODING.encode_ordinary(text))
+
+
+def windowed_count(text, edits):
+    """count_after_edits with the full-encode fallback disabled"""
+    return count_after_edits(count_tokens, text, count_tokens(text), edits, max_coverage=float('inf'))
+
+
+MATCHER = PhraseMatcher(
+    [("I am", "I'm", True), ("very good", "good", False), ("in order to", "to", False)],
+    deletions=["basically", "honestly"],
+    collapse_whitespace=True,
+)
+
+WORDS = ["I", "am", "very", "good", "in", "order", "to", "basically", "Honestly",
+         "the", "cat's", "12345", ".", ",", "\n\n", "\t", "  ", "x.y", ""]
+
+
+def random_text(rng, max_words=16):
+    return rng.choice([' ', '', '\n']).join(
+        rng.choice(WORDS) for _ in range(rng.randint(0, max_words))
+    )
+
+
+def test_rule_edits_match_full_encode():
+    """Counting only the rewritten windows gives the full re-encode count"""
+    rng = random.Random(7)
+    for _ in range(5000):
+        text = random_text(rng)
+        compressed, edits = MATCHER.rewrite(text)
+        assert compressed == MATCHER.sub(text)
+        assert windowed_count(text, edits) == count_tokens(compressed)
+
+
+def test_arbitrary_edits_match_full_encode():
+    """Any set of non-overlapping edits is accounted for exactly"""
+    rng = random.Random(11)
+    alphabet = list("ab .,\n'1") + [" the", "I", "  "]
+    for _ in range(5000):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 6))))
+        edits = [(cuts[k], cuts[k + 1], ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 3))))
+                 for k in range(0, len(cuts) - 1, 2)]
+        changed = apply_edits(text, edits)
+        assert windowed_count(text, edits) == count_tokens(changed)
+
+
+def test_diff_edits():
+    """diff_edits turns any rewrite into one edit of the original"""
+    rng = random.Random(13)
+    for _ in range(2000):
+        original, changed = random_text(rng), random_text(rng)
+        edits = diff_edits(original, changed)
+        assert apply_edits(original, edits) == changed
+        assert windowed_count(original, edits) == count_tokens(changed)
+    assert diff_edits("same", "same") == []
+
+
+def test_dense_edits_fall_back_to_full_encode():
+    """Dense edits still give the exact count via a single full encode"""
+    text = "I am very good. " * 50
+    compressed, edits = MATCHER.rewrite(text)
+    assert count_after_edits(count_tokens, text, count_tokens(text), edits) == count_tokens(compressed)
+
+
+if __name__ == "__main__":
+    tests = [
+        test_rule_edits_match_full_encode,
+        test_arbitrary_edits_match_full_encode,
+        test_diff_edits,
+        test_dense_edits_fall_back_to_full_encode,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Token accounting tests passed!")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Tests for the token count cache and per-site token counting profiles
+"""
+
+import sys
+
+import tiktoken
+
+import tokenizer_registry
+from tokenizer_registry import MIN_CACHED_LENGTH, CountCache
+
+# One token per byte, so the tests run without downloading a vocabulary
+BYTES = tiktoken.Encoding("test_bytes", pat_str=r"\S+|\s+",
+                          mergeable_ranks={bytes([i]): i for i in range(256)}, special_tokens={})
+tokenizer_registry._encoding_names[BYTES.name] = BYTES.name
+tokenizer_registry._encoders[BYTES.name] = BYTES
+
+LONG = ["a" * MIN_CACHED_LENGTH, "b " * MIN_CACHED_LENGTH, "c\n" * MIN_CACHED_LENGTH]
+
+
+def with_count_cache(max_entries, test):
+    """Run test with an empty count cache of max_entries"""
+    saved = tokenizer_registry.count_cache
+    tokenizer_registry.count_cache = cache = CountCache(max_entries)
+    try:
+        test(cache)
+    finally:
+        tokenizer_registry.count_cache = saved
+
+
+def test_count_cache_evicts_least_recently_used():
+    """The cache keeps the most recently used counts and tracks hits and misses"""
+    cache = CountCache(max_entries=2)
+    keys = [CountCache.key(BYTES.name, text) for text in LONG]
+    cache.put(keys[0], 1)
+    cache.put(keys[1], 2)
+    assert cache.get(keys[0]) == 1
+    cache.put(keys[2], 3)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == 1 and cache.get(keys[2]) == 3
+    assert cache.stats() == {'entries': 2, 'max_entries': 2, 'hits': 3, 'misses': 1, 'hit_rate': 0.75}
+    assert CountCache.key('o200k_base', LONG[0]) != keys[0]
+
+
+def test_count_caches_only_long_texts():
+    """Texts shorter than MIN_CACHED_LENGTH are encoded every time"""
+    def check(cache):
+        assert tokenizer_registry.count("short text", BYTES.name) == 10
+        assert cache.stats()['entries'] == 0 and cache.stats()['misses'] == 0
+        assert tokenizer_registry.count(LONG[0], BYTES.name) == len(LONG[0])
+        assert tokenizer_registry.count(LONG[0], BYTES.name) == len(LONG[0])
+        assert cache.stats()['entries'] == 1 and cache.stats()['hits'] == 1
+
+    with_count_cache(8, check)
+
+
+def test_count_batch_keeps_order_across_hits_and_misses():
+    """count_batch answers cached texts from the cache and encodes the rest, in input order"""
+    def check(cache):
+        tokenizer_registry.count(LONG[1], BYTES.name)
+        texts = ["tiny", LONG[0], LONG[1], "", LONG[2], LONG[0]]
+        assert tokenizer_registry.count_batch(texts, BYTES.name) == [len(text) for text in texts]
+        stats = cache.stats()
+        assert stats['hits'] == 1 and stats['entries'] == 3
+        assert tokenizer_registry.count_batch([LONG[2], LONG[0]], BYTES.name) == [len(LONG[2]), len(LONG[0])]
+        assert cache.stats()['hits'] == 3
+
+    with_count_cache(8, check)
+
+
+def test_profile_for_url():
+    """Requests are counted with the profile of the site they came from"""
+    cases = {
+        "https://chat.openai.com/c/abc123": "openai",
+        "https://chatgpt.com/": "openai",
+        "https://claude.ai/chat/1": "anthropic",
+        "https://gemini.google.com/app": "gemini",
+        "https://bard.google.com/": "gemini",
+        "https://grok.com/": "grok",
+        "https://www.grok.com/": "grok",
+        "https://example.com/": "openai",
+        "unknown": "openai",
+        None: "openai",
+    }
+    for url, name in cases.items():
+        assert tokenizer_registry.profile_for_url(url).name == name, url
+
+
+def test_approximated_profile_loads_lazily_and_once():
+    """A profile loads on first use and profiles share one copy of a vocabulary"""
+    profile = tokenizer_registry.PROFILES['grok']
+    counter = tokenizer_registry.counter_for_url("https://grok.com/")
+    assert profile.loaded
+    assert counter is tokenizer_registry.counter_for_url("https://grok.x.ai/")
+    assert not counter.exact and not counter.incremental
+    assert counter.count("") == 0
+    assert counter.count_batch(["abcd" * 10, "abcd"]) == [10, 1]
+    assert "approx:grok" in tokenizer_registry.stats()['vocabularies']
+
+
+def test_unused_tokenizer_libraries_are_not_imported():
+    """Profiles that are never used never import their tokenizer library"""
+    tokenizer_registry.counter_for_url("https://claude.ai/")
+    assert 'sentencepiece' not in sys.modules
+    assert 'tokenizers' not in sys.modules
+
+
+if __name__ == "__main__":
+    tests = [
+        test_count_cache_evicts_least_recently_used,
+        test_count_caches_only_long_texts,
+        test_count_batch_keeps_order_across_hits_and_misses,
+        test_profile_for_url,
+        test_approximated_profile_loads_lazily_and_once,
+        test_unused_tokenizer_libraries_are_not_imported,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Tokenizer registry tests passed!")
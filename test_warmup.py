@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Tests for background model loading
+"""
+
+import threading
+
+from warmup import BackgroundLoader
+
+
+def test_loader_states():
+    """The model is only handed over after warm-up; missing and broken backends are reported"""
+    release = threading.Event()
+    warmed = []
+    used = []
+    loader = BackgroundLoader(
+        'model', lambda: release.wait(5) and 'model',
+        warm=warmed.append, on_ready=used.append
+    ).start()
+    assert loader.state == 'loading' and not loader.ready
+    release.set()
+    assert loader.wait(5)
+    assert loader.ready and loader.state == 'ready'
+    assert warmed == used == ['model']
+    assert loader.stats()['warmup_seconds'] is not None
+
+    missing = BackgroundLoader('missing', lambda: None).start()
+    assert missing.wait(5) and missing.state == 'unavailable' and missing.ready
+
+    def broken_warmup(model):
+        raise RuntimeError("out of memory")
+
+    broken = BackgroundLoader('broken', lambda: 'model', warm=broken_warmup, on_ready=used.append).start()
+    assert broken.wait(5) and broken.state == 'failed' and not broken.ready
+    assert broken.stats()['error'] == "RuntimeError: out of memory"
+    assert used == ['model']
+
+
+if __name__ == "__main__":
+    tests = [
+        test_loader_states,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Warm-up tests passed!")
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Tests for parallel windowed compression of long prompts
+"""
+
+import re
+import threading
+from concurrent.futures import Future
+
+from micro_batcher import MicroBatcher
+from score_cache import ScoreCache
+from selective_context import ScoredText, compress_scored
+from windowed_compression import WindowedCompressor, context_windows
+
+SENTENCES = [
+    "The report covers revenue and churn.", "Hiring slowed in the second quarter!",
+    "Why did costs rise?", "Each region lists its figures first.", "Questions follow at the end.",
+]
+WORD = re.compile(r'\S+')
+
+
+def word_scores(text):
+    """Context-free stand-in for the model: each word scored by its letters"""
+    offsets = [match.span() for match in WORD.finditer(text)]
+    return offsets, [sum(map(ord, text[start:end])) % 97 / 10 for start, end in offsets]
+
+
+class FakeScorer:
+    """Scores like SelectiveContext.self_info_batch and records each batch"""
+
+    def __init__(self):
+        self.calls = []
+        self.texts = []
+
+    def self_info_batch(self, texts):
+        self.calls.append((threading.current_thread().name, len(texts)))
+        self.texts.extend(texts)
+        return [word_scores(text) for text in texts]
+
+
+def long_document(sentences=200):
+    return ' '.join(f"{SENTENCES[i % len(SENTENCES)]} Item {i}." for i in range(sentences))
+
+
+def test_context_windows():
+    """Windows partition the text at sentence ends, with bounded context before them"""
+    text = long_document()
+    windows = context_windows(text, window_length=400, overlap=100)
+    assert windows[0][:2] == (0, 0) and windows[-1][2] == len(text)
+    for (context, start, end), (_, next_start, _) in zip(windows, windows[1:]):
+        assert end == next_start
+        assert text[end - 2:end] in ('. ', '! ', '? ')
+    for context, start, end in windows:
+        assert start - context <= 100 and end - start <= 400
+    run_on = "One sentence without a break " * 30
+    assert context_windows(run_on, window_length=100) == [(0, 0, len(run_on))]
+    assert context_windows(text[:900]) == [(0, 0, 900)]
+
+
+def test_windows_follow_content():
+    """A document gets the same windows after the first cut, whatever precedes it"""
+    document = long_document()
+    prefixed = "Please summarise this for the board. " * 7 + document
+    offset = len(prefixed) - len(document)
+
+    def cuts(text, shift=0):
+        return {start - shift for _, start, _ in context_windows(text, 800, 100, min_length=300)}
+
+    # Cuts line up again within a few windows of the document's start
+    assert {cut for cut in cuts(document) if cut > 1200} <= cuts(prefixed, offset)
+
+
+def test_windowed_matches_whole_prompt():
+    """Stitched window scores give the same text as scoring the whole prompt at once"""
+    text = long_document()
+    scorer = FakeScorer()
+    batcher = MicroBatcher(scorer.self_info_batch, max_batch=8, max_wait_ms=50, concurrency=4)
+    compressor = WindowedCompressor(batcher.submit, window_length=500, overlap=120, min_length=200)
+    for ratio in (0.0, 0.3, 0.6):
+        offsets, self_info = word_scores(text)
+        assert compressor.compress(text, ratio) == compress_scored(text, offsets, self_info, ratio)
+    # Each prompt's windows were split into several batches of at most max_batch
+    assert len(scorer.calls) >= 3 * 4 and max(count for _, count in scorer.calls) == 8
+    assert compressor.stats()['scored_windows'] == compressor.stats()['windows'] == len(scorer.texts)
+    batcher.close()
+
+
+def test_cached_scores_are_reused():
+    """Another ratio, or the same document in a new prompt, only scores new windows"""
+    document = long_document()
+    scorer = FakeScorer()
+    batcher = MicroBatcher(scorer.self_info_batch, max_wait_ms=1, concurrency=2)
+    compressor = WindowedCompressor(batcher.submit, ScoreCache(), 'fake', window_length=500,
+                                    overlap=120, min_length=200)
+    first = compressor.compress(document, 0.3)
+    windows = len(scorer.texts)
+    assert compressor.compress(document, 0.3) == first
+    compressor.compress(document, 0.5)
+    assert len(scorer.texts) == windows
+
+    prompt = "Here is our report. " * 15 + document + " What should we cut first?"
+    offsets, self_info = word_scores(prompt)
+    assert compressor.compress(prompt, 0.3) == compress_scored(prompt, offsets, self_info, 0.3)
+    # Only windows at either end of the document were scored again
+    assert len(scorer.texts) - windows <= 4
+    stats = compressor.stats()['score_cache']
+    assert stats['hits'] >= 3 * windows - 4 and 0 < stats['hit_rate'] < 1
+    batcher.close()
+
+
+def test_failed_window_keeps_finished_ones():
+    """When a window fails, windows already scored are cached and queued ones cancelled"""
+    document = long_document()
+    windows = context_windows(document, 500, 120, 200)
+    futures = []
+
+    def submit(window):
+        future = Future()
+        if not futures:
+            future.set_exception(RuntimeError("pool busy"))
+        elif len(futures) == len(windows) - 1:
+            future.set_result(word_scores(window))
+        futures.append(future)
+        return future
+
+    cache = ScoreCache()
+    compressor = WindowedCompressor(submit, cache, 'fake', window_length=500, overlap=120, min_length=200)
+    try:
+        compressor.score(document)
+        assert False, "the failing window should raise"
+    except RuntimeError:
+        pass
+    context_start, start, end = windows[-1]
+    assert cache.get(cache.key('fake', document[context_start:end], start - context_start)) is not None
+    assert all(future.cancelled() for future in futures[1:-1]) and len(futures) == len(windows) > 2
+
+
+def test_variants_and_token_budget_from_one_scoring():
+    """Scores taken once give every ratio, and the largest text within a token budget"""
+    text = long_document(40)
+    scored = ScoredText(text, *word_scores(text))
+    for ratio in (0.0, 0.3, 0.6):
+        assert scored.compress(ratio) == compress_scored(text, *word_scores(text), ratio)
+
+    counted = []
+
+    def count_words(texts):
+        counted.append(len(texts))
+        return [len(WORD.findall(text)) for text in texts]
+
+    words = len(WORD.findall(text))
+    assert scored.fit(words, count_words) == (text, 0.0)
+    for budget in (words // 2, 25, 1):
+        compressed, dropped = scored.fit(budget, count_words)
+        assert len(WORD.findall(compressed)) <= budget and 0 < dropped <= 1
+        # Units are counted once, and the result once more
+        assert counted[-2:] == [len(scored.units), 1]
+    # Units are dropped one at a time, so nearly all of the budget is used
+    compressed, dropped = scored.fit(words // 2, count_words)
+    assert len(WORD.findall(compressed)) > words // 2 - 8
+
+
+if __name__ == "__main__":
+    tests = [
+        test_context_windows,
+        test_windows_follow_content,
+        test_windowed_matches_whole_prompt,
+        test_cached_scores_are_reused,
+        test_failed_window_keeps_finished_ones,
+        test_variants_and_token_budget_from_one_scoring,
+    ]
+    for test in tests:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ Windowed compression tests passed!")
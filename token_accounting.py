@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Incremental token accounting for rewritten text
+
+GPT-style BPE tokenizers (cl100k_base, o200k_base, ...) first split text into
+pieces with a regex and then encode each piece on its own, so the token
+count of a text is the sum over its pieces. A space that follows a
+non-whitespace character always starts a new piece, as does almost any
+non-whitespace character right after a line break, and the pieces before
+such a boundary do not depend on anything after it. Re-encoding only the windows
+between such boundaries around each edit therefore gives the same total
+as re-encoding the whole rewritten text.
+"""
+
+from rule_matcher import apply_edits
+
+# Past this share of the text, one full encode is cheaper than two window encodes
+MAX_WINDOW_COVERAGE = 0.4
+# Edits closer together than this on average are not worth windowing
+MIN_CHARS_PER_EDIT = 64
+
+
+def is_piece_boundary(text, index):
+    """True if the pre-tokenizer always splits text at index"""
+    if index <= 0 or index >= len(text):
+        return True
+    if text[index] == ' ':
+        return not text[index - 1].isspace()
+    # o200k_base keeps '/' after a line break in the punctuation piece before it
+    return text[index - 1] in '\r\n' and not text[index].isspace() and text[index] != '/'
+
+
+def _common_prefix_length(a, b, limit):
+    """Length of the common prefix of a and b, found with C-speed slice compares"""
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def diff_edits(original, changed):
+    """Describe changed as a single edit of original, trimming the common prefix and suffix"""
+    if original == changed:
+        return []
+
+    limit = min(len(original), len(changed))
+    prefix = _common_prefix_length(original, changed, limit)
+    suffix = _common_prefix_length(original[::-1], changed[::-1], limit - prefix)
+    return [(prefix, len(original) - suffix, changed[prefix:len(changed) - suffix])]
+
+
+def _boundary_before(text, index, floor):
+    """Last piece boundary in (floor, index], or floor if there is none"""
+    while index > floor:
+        index = text.rfind(' ', floor + 1, index + 1)
+        if index == -1:
+            return floor
+        if not text[index - 1].isspace():
+            return index
+        index -= 1
+    return floor
+
+
+def _boundary_after(text, index, ceiling):
+    """First piece boundary in [index, ceiling), or ceiling if there is none"""
+    while index < ceiling:
+        index = text.find(' ', index, ceiling)
+        if index == -1:
+            return ceiling
+        if not text[index - 1].isspace():
+            return index
+        index += 1
+    return ceiling
+
+
+def _edit_windows(text, edits, budget):
+    """
+    Group edits into windows whose edges are piece boundaries in both texts
+
+    Both characters on either side of a window edge are untouched by the
+    edits. Returns None once the windows cover more than budget characters.
+    """
+    windows = []
+    covered = 0
+    i = 0
+    while i < len(edits):
+        floor = windows[-1][1] if windows else 0
+        left = _boundary_before(text, edits[i][0] - 1, floor)
+
+        group = [edits[i]]
+        while True:
+            ceiling = edits[i + 1][0] if i + 1 < len(edits) else len(text)
+            right = _boundary_after(text, group[-1][1] + 1, ceiling)
+            if right < ceiling or i + 1 == len(edits):
+                break
+            # Ran into the next edit before finding a boundary: merge it
+            i += 1
+            group.append(edits[i])
+        right = min(right, len(text))
+
+        if windows and 0 < left <= floor:
+            # Touching the previous window: extend it instead
+            prev_left, prev_right, prev_group = windows.pop()
+            covered -= prev_right - prev_left
+            left, group = prev_left, prev_group + group
+        windows.append((left, right, group))
+        covered += right - left
+        if covered > budget:
+            return None
+        i += 1
+    return windows
+
+
+def count_after_edits(count_tokens, text, text_tokens, edits, rewritten=None,
+                      max_coverage=MAX_WINDOW_COVERAGE):
+    """
+    Token count of text after applying edits, re-encoding only the changed windows
+
+    Args:
+        count_tokens: function returning the token count of a string
+        text: original text
+        text_tokens: count_tokens(text), already known to the caller
+        edits: ordered, non-overlapping (start, end, replacement) spans of text
+        rewritten: the edited text, if the caller already has it
+        max_coverage: share of text the windows may cover before falling
+            back to a full encode of the rewritten text
+    Returns:
+        int: the token count of the rewritten text
+    """
+    if not edits:
+        return text_tokens
+
+    windows = None
+    if len(edits) * MIN_CHARS_PER_EDIT <= len(text) * max_coverage:
+        windows = _edit_windows(text, edits, len(text) * max_coverage)
+    if windows is None:
+        # Edits are dense enough that the windows are most of the text
+        if rewritten is None:
+            rewritten = apply_edits(text, edits)
+        return count_tokens(rewritten)
+
+    total = text_tokens
+    for left, right, group in windows:
+        pieces = []
+        pos = left
+        for start, end, replacement in group:
+            pieces.append(text[pos:start])
+            pieces.append(replacement)
+            pos = end
+        pieces.append(text[pos:right])
+        total += count_tokens(''.join(pieces)) - count_tokens(text[left:right])
+    return total
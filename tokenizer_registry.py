@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Shared tokenizer registry used by both compression services
+
+Encoders are built lazily, once per encoding (cl100k_base, o200k_base, ...),
+and looked up by model or encoding name. Counts for longer texts are kept
+in a small LRU keyed by a hash of the text, and count_batch() uses
+tiktoken's threaded batch encoder for everything not already cached.
+
+Token counting profiles map each target site (ChatGPT, Claude, Gemini,
+Grok) to the tokenizer, or approximation, that matches its models. A
+profile's tokenizer is only imported and loaded the first time a request
+from that site arrives, and each vocabulary is loaded once per process
+however many profiles share it.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+try:
+    import tiktoken
+    import tiktoken.model
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = 'cl100k_base'
+COUNT_CACHE_SIZE = int(os.environ.get('SEQUOIA_TOKEN_CACHE_SIZE', 4096))
+# Shorter texts encode faster than they hash, so they skip the cache
+MIN_CACHED_LENGTH = 256
+BATCH_THREADS = os.cpu_count() or 1
+
+_encoders = {}
+_encoding_names = {}
+_vocabularies = {}
+# Re-entrant: building a vocabulary may build its tiktoken encoder
+_lock = threading.RLock()
+
+
+class CountCache:
+    """Thread-safe LRU of token counts keyed by (encoding, text hash)"""
+
+    def __init__(self, max_entries=COUNT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(encoding_name, text):
+        digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        return encoding_name, digest
+
+    def get(self, key):
+        with self._lock:
+            count = self._entries.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return count
+
+    def put(self, key, count):
+        with self._lock:
+            self._entries[key] = count
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+count_cache = CountCache()
+
+
+def encoding_name_for(model=None):
+    """Resolve a model or encoding name (gpt-4o, cl100k_base, ...) to an encoding name"""
+    if not model:
+        return DEFAULT_ENCODING
+    name = _encoding_names.get(model)
+    if name is None:
+        if model in tiktoken.list_encoding_names():
+            name = model
+        else:
+            name = tiktoken.model.encoding_name_for_model(model)
+        _encoding_names[model] = name
+    return name
+
+
+def get_encoder(model=None):
+    """Return the shared encoder for a model or encoding name, building it on first use"""
+    if not TIKTOKEN_AVAILABLE:
+        raise RuntimeError("tiktoken is not installed")
+
+    name = encoding_name_for(model)
+    encoder = _encoders.get(name)
+    if encoder is None:
+        with _lock:
+            encoder = _encoders.get(name)
+            if encoder is None:
+                encoder = tiktoken.get_encoding(name)
+                _encoders[name] = encoder
+                logger.info(f"✓ Loaded tokenizer {name}")
+    return encoder
+
+
+def count(text, model=None):
+    """Count tokens in text for a model or encoding name"""
+    encoder = get_encoder(model)
+    if len(text) < MIN_CACHED_LENGTH:
+        return len(encoder.encode_ordinary(text))
+
+    key = CountCache.key(encoder.name, text)
+    cached = count_cache.get(key)
+    if cached is not None:
+        return cached
+
+    tokens = len(encoder.encode_ordinary(text))
+    count_cache.put(key, tokens)
+    return tokens
+
+
+def count_batch(texts, model=None, num_threads=BATCH_THREADS):
+    """Count tokens for many texts at once, encoding cache misses in parallel"""
+    encoder = get_encoder(model)
+    counts = [None] * len(texts)
+    keys = {}
+    misses = []
+
+    for i, text in enumerate(texts):
+        if len(text) >= MIN_CACHED_LENGTH:
+            keys[i] = CountCache.key(encoder.name, text)
+            counts[i] = count_cache.get(keys[i])
+        if counts[i] is None:
+            misses.append(i)
+
+    if misses:
+        encoded = encoder.encode_ordinary_batch([texts[i] for i in misses], num_threads=num_threads)
+        for i, tokens in zip(misses, encoded):
+            counts[i] = len(tokens)
+            if i in keys:
+                count_cache.put(keys[i], counts[i])
+
+    return counts
+
+
+class TiktokenCounter:
+    """Exact counts with a tiktoken encoding"""
+    exact = True
+    # BPE pieces never span a space after a word, see token_accounting
+    incremental = True
+
+    def __init__(self, encoding_name):
+        self.name = encoding_name
+        get_encoder(encoding_name)
+
+    def count(self, text):
+        return count(text, self.name)
+
+    def count_batch(self, texts):
+        return count_batch(texts, self.name)
+
+
+class SentencePieceCounter:
+    """Exact counts with a SentencePiece model file (Gemini/Gemma vocabularies)"""
+    exact = True
+    incremental = False
+
+    def __init__(self, name, model_path):
+        import sentencepiece
+        self.name = name
+        self.processor = sentencepiece.SentencePieceProcessor(model_file=model_path)
+
+    def count(self, text):
+        return len(self.processor.encode(text))
+
+    def count_batch(self, texts):
+        return [len(ids) for ids in self.processor.encode(list(texts))]
+
+
+class HuggingFaceCounter:
+    """Exact counts with a Hugging Face tokenizer.json file (Grok vocabulary)"""
+    exact = True
+    incremental = False
+
+    def __init__(self, name, tokenizer_path):
+        from tokenizers import Tokenizer
+        self.name = name
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+
+    def count(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(list(texts), add_special_tokens=False)
+        return [len(encoding.ids) for encoding in encodings]
+
+
+class CharRatioCounter:
+    """Approximate counts for vendors that do not publish their tokenizer"""
+    exact = False
+    incremental = False
+
+    def __init__(self, name, chars_per_token):
+        self.name = name
+        self.chars_per_token = chars_per_token
+
+    def count(self, text):
+        return round(len(text) / self.chars_per_token) if text else 0
+
+    def count_batch(self, texts):
+        return [self.count(text) for text in texts]
+
+
+def load_vocabulary(key, factory):
+    """Return the counter for a vocabulary, building it at most once per process"""
+    counter = _vocabularies.get(key)
+    if counter is None:
+        with _lock:
+            counter = _vocabularies.get(key)
+            if counter is None:
+                counter = factory()
+                _vocabularies[key] = counter
+    return counter
+
+
+def _tiktoken_vocabulary(encoding_name):
+    return lambda: load_vocabulary(f"tiktoken:{encoding_name}", lambda: TiktokenCounter(encoding_name))
+
+
+def _file_vocabulary(env_var, counter_class, name, chars_per_token):
+    """Use a local tokenizer file when configured, else approximate from characters"""
+    def load():
+        path = os.environ.get(env_var)
+        if path:
+            try:
+                return load_vocabulary(f"{counter_class.__name__}:{path}",
+                                       lambda: counter_class(name, path))
+            except Exception as e:
+                logger.warning(f"Could not load {name} tokenizer from {path}: {e}, approximating")
+        return load_vocabulary(f"approx:{name}",
+                               lambda: CharRatioCounter(f"{name}_approx", chars_per_token))
+    return load
+
+
+class TokenizerProfile:
+    """How tokens are counted for one target site, loaded on first use"""
+
+    def __init__(self, name, sites, loader):
+        self.name = name
+        self.sites = sites
+        self._loader = loader
+        self._counter = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._counter is not None
+
+    def counter(self):
+        if self._counter is None:
+            with self._lock:
+                if self._counter is None:
+                    self._counter = self._loader()
+                    logger.info(f"✓ Token counting for {self.name} uses {self._counter.name}")
+        return self._counter
+
+
+DEFAULT_PROFILE = 'openai'
+
+PROFILES = {
+    'openai': TokenizerProfile(
+        'openai', ['chat.openai.com', 'chatgpt.com'],
+        _tiktoken_vocabulary(DEFAULT_ENCODING)
+    ),
+    'anthropic': TokenizerProfile(
+        'anthropic', ['claude.ai'],
+        # No public tokenizer for current Claude models
+        _file_vocabulary('SEQUOIA_CLAUDE_TOKENIZER', HuggingFaceCounter, 'claude', 3.5)
+    ),
+    'gemini': TokenizerProfile(
+        'gemini', ['gemini.google.com', 'bard.google.com'],
+        _file_vocabulary('SEQUOIA_GEMINI_TOKENIZER', SentencePieceCounter, 'gemini', 4.0)
+    ),
+    'grok': TokenizerProfile(
+        'grok', ['grok.com', 'grok.x.ai'],
+        _file_vocabulary('SEQUOIA_GROK_TOKENIZER', HuggingFaceCounter, 'grok', 4.0)
+    ),
+}
+
+_profiles_by_site = {site: profile for profile in PROFILES.values() for site in profile.sites}
+
+
+def profile_for_url(url):
+    """Pick the token counting profile for the site a request came from"""
+    host = urlparse(url).hostname if url and '://' in url else None
+    while host:
+        if host in _profiles_by_site:
+            return _profiles_by_site[host]
+        host = host.partition('.')[2]
+    return PROFILES[DEFAULT_PROFILE]
+
+
+def counter_for_url(url):
+    """Token counter for the site a request came from, loading it on first use"""
+    return profile_for_url(url).counter()
+
+
+def preload():
+    """Load every profile's counter now, e.g. before forking web workers"""
+    for profile in PROFILES.values():
+        try:
+            profile.counter()
+        except Exception as e:
+            logger.warning(f"Could not preload the {profile.name} tokenizer: {e}")
+
+
+def stats():
+    """Loaded encoders, profiles and count cache statistics, for status endpoints"""
+    return {
+        'encoders': sorted(_encoders),
+        'vocabularies': sorted(_vocabularies),
+        'profiles': {name: profile.counter().name if profile.loaded else None
+                     for name, profile in PROFILES.items()},
+        'count_cache': count_cache.stats(),
+    }
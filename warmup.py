@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Background loading and warm-up of model backends
+
+Loading a compression model takes far longer than the extension's health
+check waits, so services start serving at once with their cheap tiers
+while the model loads on a background thread. One warm-up inference then
+runs before the model takes traffic, so the first user request does not
+pay for lazy initialisation. /health reports that the process is alive;
+/ready reports whether the model tier is warmed up.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Long enough to touch every code path of a compressor
+WARMUP_TEXT = (
+    "Could you please explain, in a few simple sentences, how a neural network "
+    "learns from examples? I am really interested in the basic idea behind it."
+)
+
+LOADING = 'loading'
+WARMING = 'warming'
+READY = 'ready'
+FAILED = 'failed'
+# No backend is installed, so there is nothing to wait for
+UNAVAILABLE = 'unavailable'
+
+
+class BackgroundLoader:
+    """Loads and warms up a model on a daemon thread"""
+
+    def __init__(self, name, load, warm=None, on_ready=None):
+        """
+        Args:
+            name: backend name for logs and stats
+            load: returns the model, or None when the backend is not installed
+            warm: called once with the model before it is marked ready
+            on_ready: called with the model once it is ready
+        """
+        self.name = name
+        self.load = load
+        self.warm = warm
+        self.on_ready = on_ready
+        self.state = LOADING
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self._done = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.run, name=f'{self.name}-loader', daemon=True).start()
+        return self
+
+    def run(self):
+        """Load and warm up on the calling thread"""
+        started = time.monotonic()
+        try:
+            value = self.load()
+            self.load_seconds = round(time.monotonic() - started, 3)
+            if value is None:
+                self.state = UNAVAILABLE
+                return
+            self.state = WARMING
+            warm_started = time.monotonic()
+            if self.warm is not None:
+                self.warm(value)
+            self.warmup_seconds = round(time.monotonic() - warm_started, 3)
+            self.value = value
+            if self.on_ready is not None:
+                self.on_ready(value)
+            self.state = READY
+            logger.info(f"✓ {self.name} ready (loaded in {self.load_seconds}s, "
+                        f"warmed up in {self.warmup_seconds}s)")
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = FAILED
+            logger.warning(f"Could not load {self.name}: {self.error}")
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self):
+        """True once the model is warmed up, or when there is no model to wait for"""
+        return self.state in (READY, UNAVAILABLE)
+
+    def wait(self, timeout=None):
+        """Block until loading has finished, successfully or not"""
+        return self._done.wait(timeout)
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'state': self.state,
+            'ready': self.ready,
+            'load_seconds': self.load_seconds,
+            'warmup_seconds': self.warmup_seconds,
+            'error': self.error,
+        }
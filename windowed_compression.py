@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Windowed Selective Context compression with cached window scores
+
+A long paste either runs past the scoring model's context or costs one
+long serial forward pass. Here the prompt is cut at sentence boundaries
+into windows whose scoring is spread over the model workers by the
+micro-batcher. Each window is scored together with up to WINDOW_OVERLAP
+characters of the sentences before it, so its first tokens keep some
+context, but only the tokens inside the window itself are kept. The
+per-token scores are then stitched back in text order and one percentile
+cut is made over the whole prompt, so the requested ratio holds globally
+rather than per window and the result does not depend on how windows were
+spread over workers.
+
+Window scores are cached by the scored text (see score_cache), and windows
+end after sentences picked by their content rather than their position,
+so a document pasted again with other text before or after it is cut into
+the same windows and only the windows touching the new text are scored.
+"""
+
+import os
+import threading
+import zlib
+
+from deadline import Deadline
+from selective_context import SENTENCE_END, compress_scored
+
+# Most characters scored per window, about 750 GPT-2 tokens of English
+WINDOW_LENGTH = int(os.environ.get('SEQUOIA_SC_WINDOW_CHARS', 3000))
+# Fewest characters in a window before it may end; shorter prompts are one window
+MIN_WINDOW_LENGTH = int(os.environ.get('SEQUOIA_SC_MIN_WINDOW_CHARS', 1000))
+# Preceding characters scored with each window for context only
+WINDOW_OVERLAP = int(os.environ.get('SEQUOIA_SC_WINDOW_OVERLAP', 500))
+# A window may end after about one sentence in this many
+CUT_EVERY = 4
+
+
+def ends_window(sentence):
+    """Content-defined cut point: the same sentence gives the same answer in any prompt"""
+    return zlib.crc32(sentence.encode('utf-8', 'surrogatepass')) % CUT_EVERY == 0
+
+
+def context_windows(text, window_length=WINDOW_LENGTH, overlap=WINDOW_OVERLAP, min_length=MIN_WINDOW_LENGTH):
+    """
+    Cut text into windows at sentence boundaries
+
+    A window ends after a sentence chosen by ends_window() once it holds
+    min_length characters, or earlier than that sentence when it would
+    grow past window_length.
+
+    Returns:
+        list of (context_start, start, end): the window text[start:end] is
+        scored as text[context_start:end]; the windows partition the text
+    """
+    boundaries = [0] + [match.end() for match in SENTENCE_END.finditer(text) if match.end() < len(text)]
+    boundaries.append(len(text))
+    windows = []
+    first = 0
+    while boundaries[first] < len(text):
+        start = boundaries[first]
+        last = first + 1
+        # Whole sentences up to the window length, and at least one
+        while last + 1 < len(boundaries) and boundaries[last + 1] - start <= window_length:
+            if boundaries[last] - start >= min_length and ends_window(text[boundaries[last - 1]:boundaries[last]]):
+                break
+            last += 1
+        context = first
+        while context > 0 and start - boundaries[context - 1] <= overlap:
+            context -= 1
+        windows.append((boundaries[context], start, boundaries[last]))
+        first = last
+    return windows
+
+
+def merge_window_scores(windows, scored):
+    """
+    Stitch per-window token scores into scores for the whole text
+
+    Args:
+        windows: context_windows() of the text
+        scored: (offsets, self_info) for each window's text[context_start:end]
+    Returns:
+        (offsets, self_info) over the whole text, each token taken from the
+        window holding its last character
+    """
+    offsets = []
+    self_info = []
+    for (context_start, start, end), (window_offsets, window_info) in zip(windows, scored):
+        for (token_start, token_end), info in zip(window_offsets, window_info):
+            token_start += context_start
+            token_end += context_start
+            if token_end > token_start and start < token_end <= end:
+                offsets.append((token_start, token_end))
+                self_info.append(info)
+    return offsets, self_info
+
+
+class WindowedCompressor:
+    """Compresses prompts by scoring their windows in parallel, reusing cached window scores"""
+
+    def __init__(self, submit, score_cache=None, model_id='', level='phrase',
+                 window_length=WINDOW_LENGTH, overlap=WINDOW_OVERLAP, min_length=MIN_WINDOW_LENGTH):
+        """
+        Args:
+            submit: called with a window's text, returns a Future of its
+                (offsets, self_info), e.g. MicroBatcher.submit in front of
+                SelectiveContext.self_info_batch
+            score_cache: ScoreCache for window scores, or None
+            model_id: names the scoring model and runtime in cache keys
+        """
+        self.submit = submit
+        self.score_cache = score_cache
+        self.model_id = model_id
+        self.level = level
+        self.window_length = window_length
+        self.overlap = overlap
+        self.min_length = min_length
+        self._lock = threading.Lock()
+        self.compressions = 0
+        self.windows = 0
+        self.scored_windows = 0
+
+    def score(self, text, deadline=None):
+        """
+        Token offsets and self-information for the whole of text
+        Raises DeadlineExceeded when the windows are not all scored in time
+        """
+        windows = context_windows(text, self.window_length, self.overlap, self.min_length)
+        scored = [None] * len(windows)
+        keys = [None] * len(windows)
+        futures = {}
+        for index, (context_start, start, end) in enumerate(windows):
+            if self.score_cache is not None:
+                keys[index] = self.score_cache.key(self.model_id, text[context_start:end], start - context_start)
+                scored[index] = self.score_cache.get(keys[index])
+            if scored[index] is None:
+                futures[index] = self.submit(text[context_start:end])
+
+        deadline = deadline or Deadline()
+        try:
+            for index, future in futures.items():
+                scored[index] = deadline.wait(future)
+                if self.score_cache is not None:
+                    self.score_cache.put(keys[index], scored[index])
+        except Exception:
+            # Out of time, or a window failed: windows that finished scoring
+            # stay cached for a retry and those still queued are dropped
+            for index, future in futures.items():
+                if not future.done():
+                    future.cancel()
+                elif self.score_cache is not None and not future.cancelled() and future.exception() is None:
+                    self.score_cache.put(keys[index], future.result())
+            raise
+
+        with self._lock:
+            self.compressions += 1
+            self.windows += len(windows)
+            self.scored_windows += len(futures)
+        return merge_window_scores(windows, scored)
+
+    def compress(self, text, ratio, deadline=None):
+        """
+        Compress text, removing its ratio share of lexical units overall
+        Raises DeadlineExceeded when the windows are not all scored in time
+        """
+        offsets, self_info = self.score(text, deadline)
+        return compress_scored(text, offsets, self_info, ratio, self.level)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'window_length': self.window_length,
+                'min_window_length': self.min_length,
+                'overlap': self.overlap,
+                'compressions': self.compressions,
+                'windows': self.windows,
+                'scored_windows': self.scored_windows,
+                'score_cache': self.score_cache.stats() if self.score_cache is not None else None,
+            }